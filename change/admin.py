@@ -1,12 +1,88 @@
 from django.contrib import admin
-from .models import Shop, Category, SalesRecord
+from django.db import transaction
+from .caching import clear_sales_caches, invalidate_sales_caches
+from .hierarchy import apply_hierarchy, rebuild_category_closure, sync_sales_hierarchy
+from .models import Shop, Category, DataVersion, SalesRecord, CustomerCount, SalesSummary, ImportJob
+from .summary import rebuild_month_summary, rebuild_sales_summary
+from .versions import bump_data_version
+
+
+# --- 管理画面での編集後の更新 ---
+# 売上取込・部門マスタ取込と同じく、集計サマリー・部門の親子関係表を作り直し、データの版と
+# 売上キャッシュの世代を進める（キャッシュは削除しない）。コミット後に 1 回だけ行う。
+
+def refresh_all_sales():
+    """すべての年月の集計サマリーを作り直し、すべての売上キャッシュを無効にする"""
+    with transaction.atomic():
+        rebuild_sales_summary()
+        bump_data_version(DataVersion.SALES)
+    clear_sales_caches()
+
+
+def refresh_sales_periods(periods):
+    """periods [(年, 月), ...] の集計サマリーを作り直し、その年月に依存する売上キャッシュを無効にする"""
+    periods = sorted(set(periods))
+    if not periods:
+        return
+    with transaction.atomic():
+        for year, month in periods:
+            rebuild_month_summary(year, month)
+        bump_data_version(DataVersion.SALES)
+    invalidate_sales_caches(periods)
+
+
+def refresh_category_master(deleted=False):
+    """部門の親子関係表と部門マスタの版を更新する。
+
+    親部門が変わった、または部門を削除した（売上行も削除される）場合は集計サマリーも作り直す。
+    """
+    with transaction.atomic():
+        rebuild_category_closure()
+        updated = sync_sales_hierarchy()
+    if updated or deleted:
+        refresh_all_sales()
+
+
+class SalesPeriodAdminMixin:
+    """日付を持つ売上データの編集後に、その年月の集計とキャッシュを更新する"""
+
+    def save_model(self, request, obj, form, change):
+        periods = {(obj.date.year, obj.date.month)}
+        initial = form.initial.get('date')
+        if change and initial:
+            periods.add((initial.year, initial.month))
+        super().save_model(request, obj, form, change)
+        transaction.on_commit(lambda: refresh_sales_periods(periods))
+
+    def delete_model(self, request, obj):
+        periods = {(obj.date.year, obj.date.month)}
+        super().delete_model(request, obj)
+        transaction.on_commit(lambda: refresh_sales_periods(periods))
+
+    def delete_queryset(self, request, queryset):
+        periods = {(d.year, d.month) for d in queryset.dates('date', 'month')}
+        super().delete_queryset(request, queryset)
+        transaction.on_commit(lambda: refresh_sales_periods(periods))
+
 
 @admin.register(Shop)
 class ShopAdmin(admin.ModelAdmin):
-    """店舗管理"""
+    """店舗管理（店舗名は全ページの店舗選択に出るため、変更後は売上キャッシュをすべて無効にする）"""
     list_display = ('id', 'name')
     search_fields = ('name',)
 
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        transaction.on_commit(clear_sales_caches)
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        transaction.on_commit(refresh_all_sales)
+
+    def delete_queryset(self, request, queryset):
+        super().delete_queryset(request, queryset)
+        transaction.on_commit(refresh_all_sales)
+
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
     """部門マスタ管理"""
@@ -15,8 +91,20 @@ class CategoryAdmin(admin.ModelAdmin):
     search_fields = ('code', 'name')
     ordering = ('code',)
 
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        transaction.on_commit(refresh_category_master)
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        transaction.on_commit(lambda: refresh_category_master(deleted=True))
+
+    def delete_queryset(self, request, queryset):
+        super().delete_queryset(request, queryset)
+        transaction.on_commit(lambda: refresh_category_master(deleted=True))
+
 @admin.register(SalesRecord)
-class SalesRecordAdmin(admin.ModelAdmin):
+class SalesRecordAdmin(SalesPeriodAdminMixin, admin.ModelAdmin):
     """売上データ管理"""
     # ★ここに新しい項目を追加します
     list_display = (
@@ -32,4 +120,36 @@ class SalesRecordAdmin(admin.ModelAdmin):
     
     list_filter = ('date', 'shop', 'category__level')
     search_fields = ('category__name', 'shop__name')
-    date_hierarchy = 'date'
\ No newline at end of file
+    date_hierarchy = 'date'
+
+    def save_model(self, request, obj, form, change):
+        # 階層列（cat10/cat35/cat90）は取込時と同じく部門マスタから設定する
+        apply_hierarchy([obj])
+        super().save_model(request, obj, form, change)
+
+@admin.register(CustomerCount)
+class CustomerCountAdmin(SalesPeriodAdminMixin, admin.ModelAdmin):
+    """客数管理"""
+    list_display = ('date', 'shop', 'count')
+    list_filter = ('date', 'shop')
+    search_fields = ('shop__name',)
+    date_hierarchy = 'date'
+
+@admin.register(SalesSummary)
+class SalesSummaryAdmin(admin.ModelAdmin):
+    """売上集計サマリー（取込時に自動更新されるため参照のみ）"""
+    list_display = ('year', 'month', 'date', 'shop', 'category', 'level', 'amount_sales', 'amount_profit')
+    list_filter = ('year', 'month', 'level', 'shop')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+@admin.register(ImportJob)
+class ImportJobAdmin(admin.ModelAdmin):
+    """取込ジョブ管理"""
+    list_display = ('id', 'kind', 'original_name', 'dry_run', 'status', 'stage', 'created_at', 'started_at', 'finished_at')
+    list_filter = ('kind', 'status', 'dry_run')
+    readonly_fields = ('timings', 'result', 'message', 'created_at', 'started_at', 'finished_at')
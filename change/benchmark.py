@@ -0,0 +1,216 @@
+"""取込処理のベンチマーク
+
+180部門明細と同じレイアウトの合成ブックを生成し、アップロードと同じ取込ジョブの経路
+（ファイル保存 → 指紋 → 解析 → 差分 → 書き込み → キャッシュクリア）で計測する。
+計測は一時 SQLite DB 上で行い、結果は JSON に書き出して版ごとの比較に使う。
+"""
+import io
+import platform
+import sqlite3
+import tempfile
+import time
+import tracemalloc
+from datetime import date, timedelta
+
+import django
+import numpy as np
+import openpyxl
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from .importer import METRIC_FIELDS
+from .jobs import claim_next_job, enqueue_import_job, run_job
+from .models import ImportJob
+
+# 店舗ブロックの見出し（販売の上にある行は店舗名の検出で読み飛ばされる）
+METRIC_HEADERS = ('販売', '買取', '仕入', 'ネット', '粗利')
+
+
+def build_master_codes(n10=10, per=(3, 3, 2)):
+    """10-35-90-180 の部門コード体系を作る。返り値: [(code_10, code_35, code_90, code_180), ...]"""
+    rows = []
+    c35 = c90 = c180 = 0
+    for a in range(1, n10 + 1):
+        for _ in range(per[0]):
+            c35 += 1
+            for _ in range(per[1]):
+                c90 += 1
+                for _ in range(per[2]):
+                    c180 += 1
+                    rows.append((a, 100 + c35, 1000 + c90, 5000 + c180))
+    return rows
+
+
+def build_master_workbook(master_codes):
+    """部門マスタのブック（1 行目は見出し）をバイト列で返す"""
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet()
+    ws.append(['10部門', '10部門名', '35部門', '35部門名', '90部門', '90部門名', '180部門', '180部門名'])
+    for c10, c35, c90, c180 in master_codes:
+        ws.append([c10, f'大分類{c10}', c35, f'中分類{c35}', c90, f'小分類{c90}', c180, f'部門{c180}'])
+    bio = io.BytesIO()
+    wb.save(bio)
+    return bio.getvalue()
+
+
+def generate_sales_values(n_codes, n_shops, rng, empty_ratio=0.05):
+    """月初からの累計値を模した (n_codes, n_shops, 5) の int64 配列を作る"""
+    values = rng.integers(0, 200000, size=(n_codes, n_shops, len(METRIC_FIELDS)), dtype=np.int64)
+    values[rng.random(values.shape) < empty_ratio] = 0
+    return values
+
+
+def advance_sales_values(values, rng, change_ratio=0.2):
+    """翌日の累計値を作る（change_ratio の割合のセルだけ増える）"""
+    changed = rng.random(values.shape) < change_ratio
+    return values + changed * rng.integers(1, 20000, size=values.shape, dtype=np.int64)
+
+
+def build_sales_workbook(report_date, shop_names, codes, values, customers):
+    """180部門明細シートのブックをバイト列で返す。
+
+    実ファイルと同じく、H1 に日付、店舗名の下に前年比・構成比の行、6 行目に
+    販売/買取/仕入/ネット/粗利の見出し、7 行目に客数、以降に部門行と合計行を置く。
+    値の 0 は空欄、一部は「1,234」形式の文字列として書き出す。
+    """
+    width = 2 + len(shop_names) * len(METRIC_FIELDS)
+
+    def header_row(cells):
+        row = [None] * width
+        for col, v in cells:
+            row[col] = v
+        return row
+
+    block = [(2 + s * len(METRIC_FIELDS), name) for s, name in enumerate(shop_names)]
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet('１８０明細（類）')
+    ws.append(header_row([(0, 'チェンジ速報'), (7, f'{report_date.year}年{report_date.month}月{report_date.day}日')]))
+    ws.append([])
+    ws.append(header_row([(col, '累計') for col, _ in block]))
+    ws.append(header_row(block))
+    ws.append(header_row([(col, '前年比') for col, _ in block] + [(col + 1, '構成比') for col, _ in block]))
+    ws.append(header_row([(col + i, h) for col, _ in block for i, h in enumerate(METRIC_HEADERS)]))
+    ws.append(header_row([(0, '客 数')] + [(col, int(c)) for (col, _), c in zip(block, customers)]))
+    for i, code in enumerate(codes):
+        row = [int(code), f'部門{code}']
+        for v in values[i].ravel().tolist():
+            if v == 0:
+                row.append(None)
+            elif v % 7 == 0:
+                row.append(f'{v:,}')
+            else:
+                row.append(v)
+        ws.append(row)
+    ws.append(['合計', None] + values.sum(axis=0).ravel().tolist())
+    bio = io.BytesIO()
+    wb.save(bio)
+    return bio.getvalue()
+
+
+def _run_upload(scenario, kind, name, data, trace_memory=False):
+    """アップロード 1 件を取込ジョブとして実行し、計測結果を返す。
+
+    trace_memory: True なら tracemalloc でピークメモリを測る（処理時間は大きく伸びる）
+    """
+    if trace_memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    with CaptureQueriesContext(connection) as queries:
+        enqueue_import_job(kind, SimpleUploadedFile(name, data))
+        job = run_job(claim_next_job())
+    seconds = time.perf_counter() - started
+    peak = None
+    if trace_memory:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    if job.status != ImportJob.STATUS_DONE:
+        raise RuntimeError(f"{name}: {job.message}")
+    result = job.result
+    if kind == ImportJob.KIND_SALES:
+        rows = result['inserted'] + result['updated'] + result['unchanged']
+    else:
+        rows = result['rows']
+    return {
+        'scenario': scenario,
+        'file': name,
+        'bytes': len(data),
+        'rows': rows,
+        'seconds': round(seconds, 4),
+        'rows_per_sec': round(rows / seconds, 1) if seconds else None,
+        'queries': len(queries.captured_queries),
+        'peak_memory_bytes': peak,
+        'timings': job.timings,
+        'result': result,
+    }
+
+
+def _run_uploads(uploads, trace_memory=False):
+    """一時 DB を作り、[(scenario, kind, name, data), ...] を順に取り込む"""
+    runs = []
+    old_name = connection.settings_dict['NAME']
+    with tempfile.TemporaryDirectory() as tmp:
+        connection.settings_dict['TEST']['NAME'] = f'{tmp}/benchmark.sqlite3'
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            with override_settings(MEDIA_ROOT=tmp, IMPORT_JOBS_RUN_IN_PROCESS=False, DEBUG=False):
+                for upload in uploads:
+                    runs.append(_run_upload(*upload, trace_memory=trace_memory))
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+    return runs
+
+
+def run_import_benchmark(shops=40, days=5, n10=10, per=(3, 3, 2), change_ratio=0.2, seed=1,
+                         start=date(2025, 1, 1), trace_memory=True):
+    """一時 DB に部門マスタと days 日分の売上ブックを順に取り込み、計測結果を返す。
+
+    最後に最終日のブックをもう一度取り込み、同一内容のスキップも計測する。
+    処理時間・クエリ数を測る回と、ピークメモリを測る回（tracemalloc 有効）は別の一時 DB で行う。
+    """
+    rng = np.random.default_rng(seed)
+    master_codes = build_master_codes(n10, per)
+    codes = np.array([c[3] for c in master_codes], dtype=np.int64)
+    shop_names = [f'店舗{s + 1:03d}' for s in range(shops)]
+
+    generated = time.perf_counter()
+    workbooks = []
+    values = generate_sales_values(len(codes), shops, rng)
+    customers = rng.integers(100, 1000, size=shops)
+    for day in range(days):
+        report_date = start + timedelta(days=day)
+        if day:
+            values = advance_sales_values(values, rng, change_ratio)
+            customers = customers + rng.integers(0, 100, size=shops)
+        workbooks.append((f'sales_{report_date:%Y%m%d}.xlsx',
+                          build_sales_workbook(report_date, shop_names, codes, values, customers)))
+    generate_seconds = time.perf_counter() - generated
+
+    uploads = [('master', ImportJob.KIND_MASTER, 'master.xlsx', build_master_workbook(master_codes))]
+    uploads += [('first' if day == 0 else 'next_day', ImportJob.KIND_SALES, name, data)
+                for day, (name, data) in enumerate(workbooks)]
+    uploads.append(('duplicate', ImportJob.KIND_SALES) + workbooks[-1])
+
+    runs = _run_uploads(uploads)
+    if trace_memory:
+        for run, traced in zip(runs, _run_uploads(uploads, trace_memory=True)):
+            run['peak_memory_bytes'] = traced['peak_memory_bytes']
+
+    return {
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'environment': {
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'numpy': np.__version__,
+            'openpyxl': openpyxl.__version__,
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+        },
+        'params': {
+            'shops': shops, 'days': days, 'categories_180': len(codes),
+            'change_ratio': change_ratio, 'seed': seed,
+        },
+        'generate_seconds': round(generate_seconds, 4),
+        'runs': runs,
+    }
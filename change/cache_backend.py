@@ -0,0 +1,321 @@
+"""2 段構成のキャッシュバックエンド（プロセス内 LRU + 共有キャッシュ）
+
+settings.CACHES で BACKEND に 'change.cache_backend.TwoTierCache' を指定し、OPTIONS の 'SHARED' に
+すべてのワーカーと管理コマンドから見える共有キャッシュ（ファイルキャッシュなど）の設定を書く。
+
+  - 読み込みはプロセス内の LRU（pickle したバイト数で上限を管理）を先に見て、無ければ共有キャッシュから読む。
+    共有キャッシュには (期限の時刻, 値) の組で保存し、プロセス内に置く期限は LOCAL_TIMEOUT と共有側の残り時間の短い方にする。
+  - 書き込み・削除は共有キャッシュに行う。既にあるキーを上書き・削除したときだけ、共有キャッシュの
+    無効化ログ (LOG_KEY) にキーを追記する。各プロセスは VERSION_CHECK_INTERVAL 秒ごとにログを読み、
+    追記されたキーだけをプロセス内の LRU から捨てる。LRU 全体を捨てるのは clear() のときと、
+    ログが読めない・読み落としがある（ログが LOG_SIZE 件を超えて切り詰められた、ログが消えた）ときだけ。
+    新しいキーの書き込み（世代付きのキーなど）はログに書かない。
+  - add() はロックなどに使うため共有キャッシュだけに書き、add() で作ったキーの削除もログに書かない
+    （プロセス内では直列に行うが、ファイルキャッシュの場合、別プロセスとの間では同時に成功することがある）。
+  - ログの追記は共有キャッシュの add() によるロックの中で行う。ロックが取れない・別プロセスと競合した場合に
+    取りこぼした無効化は、LOCAL_TIMEOUT 秒で消える。
+
+Django はスレッドごとにバックエンドのインスタンスを作るため、プロセス内の LRU と
+ヒット・ミスの回数はキャッシュ名 (LOCATION) ごとにプロセス内で共有する。回数は stats() で参照できる。
+"""
+import pickle
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.utils.module_loading import import_string
+
+LOG_KEY = 'two_tier_cache_log'
+LOG_LOCK_KEY = 'two_tier_cache_log:lock'
+LOG_SIZE = 1000
+LOG_LOCK_SECONDS = 5
+LOG_LOCK_WAIT = 1.0
+LOG_LOCK_POLL = 0.01
+# 共有キャッシュに保存する値の形式 (STORED_FORMAT, 期限の時刻, 値)。形式の違う値は無いものとして扱う
+STORED_FORMAT = 'two_tier:1'
+
+_MISSING = object()
+
+
+class LocalTier:
+    """プロセス内の LRU（値は pickle したバイト列で持ち、合計バイト数が max_bytes を超えたら古いものから捨てる）"""
+
+    def __init__(self, max_bytes, timeout):
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.add_lock = threading.Lock()
+        self.entries = OrderedDict()    # キー -> (pickle したバイト列, 期限の時刻)
+        self.bytes = 0
+        self.log_epoch = None           # 最後に読んだ無効化ログの epoch と番号
+        self.log_seq = 0
+        self.checked_at = None
+        self.shared_only = set()        # このプロセスが add() で作ったキー（削除してもログに書かない）
+        self.counters = {'local_hits': 0, 'local_misses': 0, 'shared_hits': 0, 'shared_misses': 0, 'evictions': 0,
+                         'invalidations': 0, 'flushes': 0}
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[1] > time.time():
+                self.entries.move_to_end(key)
+                self.counters['local_hits'] += 1
+                return entry[0]
+            if entry is not None:
+                self._discard(key)
+            self.counters['local_misses'] += 1
+            return None
+
+    def set(self, key, data, expires_at):
+        local_expires_at = time.time() + self.timeout
+        if expires_at is not None:
+            local_expires_at = min(local_expires_at, expires_at)
+        with self.lock:
+            self._discard(key)
+            if len(data) > self.max_bytes or local_expires_at <= time.time():
+                return
+            self.entries[key] = (data, local_expires_at)
+            self.bytes += len(data)
+            while self.bytes > self.max_bytes:
+                oldest = next(iter(self.entries))
+                self._discard(oldest)
+                self.counters['evictions'] += 1
+
+    def delete(self, key):
+        with self.lock:
+            self._discard(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    def apply_log(self, log):
+        """無効化ログを反映する（ログが消えた・別の epoch になった・読み落としがあれば LRU 全体を捨てる）"""
+        epoch = log['epoch'] if log is not None else None
+        with self.lock:
+            if epoch != self.log_epoch or (log is not None and log['seq'] > self.log_seq and log['entries']
+                                           and log['entries'][0][0] > self.log_seq + 1):
+                if self.entries:
+                    self.counters['flushes'] += 1
+                self.entries.clear()
+                self.bytes = 0
+            elif log is not None:
+                for seq, key in log['entries']:
+                    if seq > self.log_seq and key in self.entries:
+                        self._discard(key)
+                        self.counters['invalidations'] += 1
+            self.log_epoch = epoch
+            self.log_seq = log['seq'] if log is not None else 0
+
+    def _discard(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= len(entry[0])
+
+
+def _is_stored(stored):
+    return isinstance(stored, tuple) and len(stored) == 3 and stored[0] == STORED_FORMAT
+
+
+_local_tiers = {}
+_local_tiers_lock = threading.Lock()
+
+
+class TwoTierCache(BaseCache):
+    """プロセス内 LRU と共有キャッシュの 2 段キャッシュ
+
+    OPTIONS:
+        SHARED: 共有キャッシュの設定（CACHES の 1 エントリと同じ形式の dict）
+        LOCAL_MAX_BYTES: プロセス内 LRU の上限バイト数（pickle 後のサイズの合計）
+        LOCAL_TIMEOUT: プロセス内 LRU に置く最長秒数
+        VERSION_CHECK_INTERVAL: 共有キャッシュの無効化ログを確認する間隔（秒）
+    """
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        shared = dict(options['SHARED'])
+        # キーの作り方（接頭辞・版）は共有キャッシュにも同じものを使う
+        for name in ('KEY_PREFIX', 'VERSION', 'KEY_FUNCTION'):
+            if name in params:
+                shared.setdefault(name, params[name])
+        self._shared = import_string(shared.pop('BACKEND'))(shared.pop('LOCATION', ''), shared)
+        self._check_interval = options.get('VERSION_CHECK_INTERVAL', 1.0)
+        with _local_tiers_lock:
+            if location not in _local_tiers:
+                _local_tiers[location] = LocalTier(
+                    options.get('LOCAL_MAX_BYTES', 32 * 1024 * 1024), options.get('LOCAL_TIMEOUT', 300)
+                )
+            self._local = _local_tiers[location]
+
+    # --- 無効化ログ ---
+
+    def _check_log(self):
+        """共有キャッシュの無効化ログを読み、上書き・削除されたキーをプロセス内 LRU から捨てる（VERSION_CHECK_INTERVAL ごと）"""
+        local = self._local
+        now = time.monotonic()
+        if local.checked_at is not None and now - local.checked_at < self._check_interval:
+            return
+        local.checked_at = now
+        local.apply_log(self._shared.get(LOG_KEY))
+
+    def _invalidate(self, local_keys, flush=False):
+        """local_keys を他のプロセスの LRU から捨てるようログに追記する（flush なら全体を捨てさせる）"""
+        if not local_keys and not flush:
+            return
+        local = self._local
+        deadline = time.monotonic() + LOG_LOCK_WAIT
+        with local.add_lock:
+            locked = self._shared.add(LOG_LOCK_KEY, True, LOG_LOCK_SECONDS)
+            while not locked and time.monotonic() < deadline:
+                time.sleep(LOG_LOCK_POLL)
+                locked = self._shared.add(LOG_LOCK_KEY, True, LOG_LOCK_SECONDS)
+            try:
+                log = None if flush else self._shared.get(LOG_KEY)
+                if log is None:
+                    # 新しい epoch のログを始める（読んだプロセスは LRU 全体を捨てる）
+                    log = {'epoch': uuid.uuid4().hex, 'seq': 0, 'entries': []}
+                previous = (log['epoch'], log['seq'])
+                entries = list(log['entries'])
+                for key in local_keys:
+                    log['seq'] += 1
+                    entries.append((log['seq'], key))
+                log['entries'] = entries[-LOG_SIZE:]
+                self._shared.set(LOG_KEY, log, None)
+            finally:
+                if locked:
+                    self._shared.delete(LOG_LOCK_KEY)
+        with local.lock:
+            # 自分の書き込みで自プロセスの新しい値を捨てないよう、直前まで読んでいれば読んだことにする
+            if flush or (local.log_epoch, local.log_seq) == previous:
+                local.log_epoch, local.log_seq = log['epoch'], log['seq']
+
+    # --- BaseCache ---
+
+    def get(self, key, default=None, version=None):
+        self._check_log()
+        local_key = self.make_and_validate_key(key, version=version)
+        data = self._local.get(local_key)
+        if data is not None:
+            return pickle.loads(data)
+        stored = self._shared.get(key, _MISSING, version=version)
+        if not _is_stored(stored):
+            self._local.count('shared_misses')
+            return default
+        self._local.count('shared_hits')
+        _, expires_at, value = stored
+        self._local.set(local_key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), expires_at)
+        return value
+
+    def _store(self, key, value, timeout, version):
+        """共有キャッシュへ保存する値と、既にあるキーの上書きになるか"""
+        existed = self._shared.has_key(key, version=version)
+        return (STORED_FORMAT, self.get_backend_timeout(timeout), value), existed
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        local_key = self.make_and_validate_key(key, version=version)
+        timeout = self.default_timeout if timeout is DEFAULT_TIMEOUT else timeout
+        stored, existed = self._store(key, value, timeout, version)
+        self._shared.set(key, stored, timeout, version=version)
+        self._local.shared_only.discard(local_key)
+        if existed:
+            self._invalidate([local_key])
+        if timeout is None or timeout > 0:
+            self._local.set(local_key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), stored[1])
+        else:
+            self._local.delete(local_key)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        timeout = self.default_timeout if timeout is DEFAULT_TIMEOUT else timeout
+        stored, overwritten = {}, []
+        for key, value in data.items():
+            stored[key], existed = self._store(key, value, timeout, version)
+            if existed:
+                overwritten.append(self.make_and_validate_key(key, version=version))
+        failed = self._shared.set_many(stored, timeout, version=version)
+        self._invalidate(overwritten)
+        for key, value in data.items():
+            local_key = self.make_and_validate_key(key, version=version)
+            self._local.shared_only.discard(local_key)
+            if key in failed or not (timeout is None or timeout > 0):
+                self._local.delete(local_key)
+            else:
+                self._local.set(local_key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), stored[key][1])
+        return failed
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        timeout = self.default_timeout if timeout is DEFAULT_TIMEOUT else timeout
+        # ファイルキャッシュの add は「無ければ書く」を 2 回に分けて行うため、プロセス内のスレッド間では直列にする
+        with self._local.add_lock:
+            added = self._shared.add(key, (STORED_FORMAT, self.get_backend_timeout(timeout), value), timeout, version=version)
+        if added:
+            self._local.shared_only.add(self.make_and_validate_key(key, version=version))
+        return added
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        timeout = self.default_timeout if timeout is DEFAULT_TIMEOUT else timeout
+        stored = self._shared.get(key, _MISSING, version=version)
+        if not _is_stored(stored):
+            return False
+        # 保存した値の中の期限の時刻も書き換える（プロセス内の期限は次に共有キャッシュから読んだときから反映）
+        self._shared.set(key, (STORED_FORMAT, self.get_backend_timeout(timeout), stored[2]), timeout, version=version)
+        return True
+
+    def delete(self, key, version=None):
+        local_key = self.make_and_validate_key(key, version=version)
+        self._local.delete(local_key)
+        deleted = self._shared.delete(key, version=version)
+        if local_key in self._local.shared_only:
+            # add() で作ったロックなどは、どのプロセスの LRU にも入らない
+            self._local.shared_only.discard(local_key)
+        elif deleted:
+            self._invalidate([local_key])
+        return deleted
+
+    def delete_many(self, keys, version=None):
+        deleted = []
+        for key in keys:
+            local_key = self.make_and_validate_key(key, version=version)
+            self._local.delete(local_key)
+            if self._shared.delete(key, version=version) and local_key not in self._local.shared_only:
+                deleted.append(local_key)
+            self._local.shared_only.discard(local_key)
+        self._invalidate(deleted)
+
+    def has_key(self, key, version=None):
+        return self.get(key, _MISSING, version=version) is not _MISSING
+
+    def clear(self):
+        self._local.clear()
+        self._shared.clear()
+        self._invalidate([], flush=True)
+
+    def close(self, **kwargs):
+        self._shared.close(**kwargs)
+
+    # --- 統計 ---
+
+    def stats(self):
+        """このプロセスでのヒット・ミスの回数と、プロセス内 LRU の使用量"""
+        local = self._local
+        with local.lock:
+            return {
+                'local': {
+                    'hits': local.counters['local_hits'],
+                    'misses': local.counters['local_misses'],
+                    'evictions': local.counters['evictions'],
+                    'invalidations': local.counters['invalidations'],
+                    'flushes': local.counters['flushes'],
+                    'entries': len(local.entries),
+                    'bytes': local.bytes,
+                    'max_bytes': local.max_bytes,
+                },
+                'shared': {'hits': local.counters['shared_hits'], 'misses': local.counters['shared_misses']},
+            }
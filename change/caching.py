@@ -0,0 +1,409 @@
+"""売上データに依存するキャッシュのキーと無効化（世代番号）
+
+売上データに依存するキャッシュは、キーの末尾に「世代」を付けて保存する (sales_cache_key)。
+世代は、部門マスタの版・売上キャッシュ全体の版・年月や店舗の選択肢の版・依存する期間 (年, 月) ごとの版
+(DataVersion) から作る。年・月の None は「すべての年」「すべての月」を表す（(None, None) は全期間）。
+
+無効化はキャッシュを削除せず、版を新しい値にするだけで行う。古い世代のエントリは参照されなくなり、
+期限切れで消える。版は DB にあり、各プロセスは change.versions のスナップショットを
+settings.DATA_VERSION_CHECK_INTERVAL 秒ごとに読み直すため、複数のワーカープロセスでもその間隔以内に切り替わる。
+  - 売上取込・管理画面での売上の編集: 取り込んだ年月に依存する期間の版 (invalidate_sales_caches)
+  - 新しい年月・店舗の追加: 選択肢の版（全ページの年・月・店舗の選択肢が変わる）
+  - 集計サマリーの再構築など: 売上キャッシュ全体の版 (clear_sales_caches)
+  - 部門マスタの取込・管理画面での部門の編集: 部門マスタの版（部門の親子関係表の再構築で更新される）
+
+年・年月ごとの集計値 (cached_period_values) は、選択肢の版を含まないその期間だけの世代で保存し、
+最新の取込月より前の締まった期間は期限なしで持つ。新しい月の取込で作り直すのは、その月を含む期間だけになる。
+ただし期限なしでも永続ではなく、共有キャッシュ（ファイルキャッシュ）が MAX_ENTRIES に達したときの間引きや
+clear() で消えることがあり、その場合は次の参照時にその期間だけを集計し直す。
+
+店舗を選んで比較するページは、ページ全体ではなく店舗ごとの集計値 (cached_shop_vectors) を
+キャッシュし、どの店舗の組み合わせでも店舗ごとのエントリを足し合わせて表示する。
+
+集計に時間のかかるレポート (cached_report, cached_shop_vectors) は、世代をキーではなく値に持ち、
+  - 同じキャッシュが無いときは 1 つのリクエストだけが集計し、他はその結果を待つ（シングルフライト）
+  - 古い世代でも作成から settings.SALES_CACHE_STALE_SECONDS 以内なら古い値をそのまま返し、
+    1 つのスレッドだけが裏で作り直す（stale-while-revalidate）
+ことで、取込直後に同じ集計が並行して何度も走らないようにする。
+
+レポートのキャッシュにはテンプレートのコンテキスト（モデルのインスタンスや整形済みの文字列）を入れず、
+id と整数の配列からなる小さな payload を保存して、表示用のコンテキストはビューで毎回組み立てる
+(cached_payload, pack_ints)。payload の形を変えたときはキーの版（dashboard_v4 など）を上げる。
+"""
+import hashlib
+import logging
+import pickle
+import threading
+import time
+import zlib
+from array import array
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.middleware.cache import CacheMiddleware
+from django.utils.decorators import decorator_from_middleware_with_args
+
+from .models import DataVersion
+from .versions import bump_data_version, data_versions
+
+ALL_DATES_CACHE_KEY = 'salesrecord_all_dates'
+PERIOD_INDEX_CACHE_KEY = 'sales_period_index'
+
+# 全期間に依存する（どの年月の取込でも無効になる）
+ALL_PERIODS = ((None, None),)
+
+# 集計中の他のリクエストを待つときの確認間隔（秒）
+LOCK_POLL_SECONDS = 0.05
+
+logger = logging.getLogger(__name__)
+
+
+def period_tag(year=None, month=None):
+    return f"{year or '*'}-{month or '*'}"
+
+
+def affected_tags(year, month):
+    """year 年 month 月の売上が変わったときに無効になる期間タグ"""
+    return {period_tag(year, month), period_tag(year, None), period_tag(None, month), period_tag()}
+
+
+def period_version_name(tag):
+    """期間タグ tag の版の DataVersion 名"""
+    return f'{DataVersion.SALES_CACHE}:{tag}'
+
+
+def _read_versions(names):
+    versions = data_versions()
+    return {name: versions[name] for name in names if name in versions}
+
+
+def _stamp(names, versions):
+    stamp = '|'.join(f'{name}={versions.get(name, "")}' for name in names)
+    return hashlib.md5(stamp.encode()).hexdigest()[:16]
+
+
+def sales_generation(periods=ALL_PERIODS):
+    """periods [(年, 月), ...] に依存する売上キャッシュの現在の世代（版はプロセス内のスナップショットから読む）"""
+    names = [DataVersion.CATEGORY_MASTER, DataVersion.SALES_CACHE, DataVersion.SALES_CHOICES]
+    names += sorted({period_version_name(period_tag(year, month)) for year, month in periods})
+    return _stamp(names, _read_versions(names))
+
+
+def period_generations(periods):
+    """期間 (年, 月) ごとの集計値の世代 {期間: 世代}（選択肢の版は含まない）"""
+    common = [DataVersion.CATEGORY_MASTER, DataVersion.SALES_CACHE]
+    names = {period: common + [period_version_name(period_tag(*period))] for period in periods}
+    versions = _read_versions(common + [n[-1] for n in names.values()])
+    return {period: _stamp(period_names, versions) for period, period_names in names.items()}
+
+
+def sales_cache_key(key, periods=ALL_PERIODS):
+    """key に periods の売上キャッシュの世代を付けたキャッシュキー"""
+    return f'{key}@{sales_generation(periods)}'
+
+
+def _stale_seconds():
+    return getattr(settings, 'SALES_CACHE_STALE_SECONDS', 60 * 30)
+
+
+def _lock_seconds():
+    return getattr(settings, 'SALES_CACHE_LOCK_SECONDS', 30)
+
+
+def _entry(generation, value):
+    return {'generation': generation, 'stored_at': time.time(), 'value': value}
+
+
+def _is_fresh(entry, generation):
+    return entry is not None and entry['generation'] == generation
+
+
+def _is_recent(entry):
+    """古い世代でも返してよいエントリか（作成から SALES_CACHE_STALE_SECONDS 以内）"""
+    stale_seconds = _stale_seconds()
+    return entry is not None and stale_seconds > 0 and time.time() - entry['stored_at'] <= stale_seconds
+
+
+_MISSING = object()
+
+
+def _single_flight(lock_key, lookup, compute):
+    """lock_key のロックを取れたリクエストだけが compute() し、他は lookup() で結果が見つかるまで待つ。
+
+    lookup: 結果を返す関数（まだ無ければ _MISSING）
+    ロックを持つリクエストが SALES_CACHE_LOCK_SECONDS 以内に終わらなければ、自分で集計する。
+    """
+    deadline = time.monotonic() + _lock_seconds()
+    while True:
+        if cache.add(lock_key, True, _lock_seconds()):
+            try:
+                # ロックを取る直前に他のリクエストが保存し終えていれば、それを使う
+                value = lookup()
+                return compute() if value is _MISSING else value
+            finally:
+                cache.delete(lock_key)
+        value = lookup()
+        if value is not _MISSING:
+            return value
+        if time.monotonic() >= deadline:
+            return compute()
+        time.sleep(LOCK_POLL_SECONDS)
+
+
+def _refresh_in_background(lock_key, refresh):
+    """lock_key のロックを取れたら、refresh() を別スレッドで実行する（取れなければ他が作り直し中）"""
+    if not cache.add(lock_key, True, _lock_seconds()):
+        return
+
+    def run():
+        try:
+            refresh()
+        except Exception:
+            logger.exception('Background refresh of %s failed', lock_key)
+        finally:
+            cache.delete(lock_key)
+            connections.close_all()
+
+    threading.Thread(target=run, name='sales-cache-refresh').start()
+
+
+def cached_report(key, compute, periods=ALL_PERIODS, timeout=60 * 60 * 24):
+    """compute() の結果を key にキャッシュする（シングルフライト・stale-while-revalidate 付き）。
+
+    キャッシュの値には periods の売上キャッシュの世代を持ち、現在の世代と違えば作り直す。
+    """
+    generation = sales_generation(periods)
+    entry = cache.get(key)
+    if _is_fresh(entry, generation):
+        return entry['value']
+
+    def store():
+        value = compute()
+        cache.set(key, _entry(generation, value), timeout)
+        return value
+
+    if _is_recent(entry):
+        _refresh_in_background(f'{key}@{generation}:refresh', store)
+        return entry['value']
+
+    def lookup():
+        found = cache.get(key)
+        return found['value'] if _is_fresh(found, generation) else _MISSING
+
+    return _single_flight(f'{key}@{generation}:lock', lookup, store)
+
+
+def _compress_min_bytes():
+    return getattr(settings, 'SALES_CACHE_COMPRESS_MIN_BYTES', 4096)
+
+
+def pack_ints(*columns):
+    """整数の列をつなげた 1 本の array('q') にする（pickle 後も 1 要素 8 バイト）"""
+    packed = array('q')
+    for column in columns:
+        packed.extend(column)
+    return packed
+
+
+def unpack_ints(packed, size):
+    """pack_ints の結果を size 個ずつの整数のリストに戻す"""
+    return [packed[i:i + size].tolist() for i in range(0, len(packed), size)] if size else []
+
+
+def encode_payload(payload, name=''):
+    """payload を pickle し、SALES_CACHE_COMPRESS_MIN_BYTES 以上なら zlib で圧縮する。
+
+    返り値: (圧縮したか, バイト列)
+    """
+    started = time.perf_counter()
+    data = pickle.dumps(payload, pickle.HIGHEST_PROTOCOL)
+    size = len(data)
+    compressed = size >= _compress_min_bytes()
+    if compressed:
+        data = zlib.compress(data)
+    logger.debug('cache payload %s: %d bytes%s, encoded in %.2f ms', name, size,
+                 f' -> {len(data)} bytes (zlib)' if compressed else '', (time.perf_counter() - started) * 1000)
+    return compressed, data
+
+
+def decode_payload(blob, name=''):
+    """encode_payload の結果を元の payload に戻す"""
+    started = time.perf_counter()
+    compressed, data = blob
+    payload = pickle.loads(zlib.decompress(data) if compressed else data)
+    logger.debug('cache payload %s: %d bytes, decoded in %.2f ms', name, len(data), (time.perf_counter() - started) * 1000)
+    return payload
+
+
+def cached_payload(key, compute, periods=ALL_PERIODS, timeout=60 * 60 * 24):
+    """compute() が返す payload（id と整数の配列などの pickle できる値）を cached_report でキャッシュする。
+
+    保存する値は encode_payload の結果で、大きいものは圧縮される。
+    返り値: payload（キャッシュからの場合は毎回新しく復元したもの）
+    """
+    blob = cached_report(key, lambda: encode_payload(compute(), key), periods, timeout)
+    return decode_payload(blob, key)
+
+
+def cached_shop_vectors(prefix, shop_ids, compute, periods=ALL_PERIODS, timeout=60 * 60 * 24, empty=None):
+    """店舗ごとの集計値を '{prefix}:{店舗 id}' のキーでキャッシュし、キャッシュに無い店舗だけを集計する。
+
+    prefix: 期間・部門・指標など、店舗以外の集計条件を表す文字列
+    compute: 店舗 id のリストを受け取り {店舗 id: 集計値} を返す関数（データの無い店舗は省略してよく、empty を保存する）
+    periods: 集計値が依存する [(年, 月), ...]（その年月の売上取込で無効になる）
+    古い世代の店舗は cached_report と同じく、最近のものなら古い値を返して裏で作り直す。
+    返り値: {店舗 id: 集計値}（shop_ids の順）
+    """
+    generation = sales_generation(periods)
+    keys = {sid: f'{prefix}:{sid}' for sid in dict.fromkeys(shop_ids)}
+    found = cache.get_many(list(keys.values()))
+    values, stale, missing = {}, [], []
+    for sid, key in keys.items():
+        entry = found.get(key)
+        if _is_fresh(entry, generation):
+            values[sid] = entry['value']
+        elif _is_recent(entry):
+            values[sid] = entry['value']
+            stale.append(sid)
+        else:
+            missing.append(sid)
+
+    def store(sids):
+        computed = compute(sids)
+        fresh = {sid: computed.get(sid, empty) for sid in sids}
+        cache.set_many({keys[sid]: _entry(generation, value) for sid, value in fresh.items()}, timeout)
+        return fresh
+
+    if stale:
+        _refresh_in_background(f'{prefix}@{generation}:refresh', lambda: store(stale))
+    if missing:
+        def lookup():
+            entries = cache.get_many([keys[sid] for sid in missing])
+            if all(_is_fresh(entries.get(keys[sid]), generation) for sid in missing):
+                return {sid: entries[keys[sid]]['value'] for sid in missing}
+            return _MISSING
+
+        values.update(_single_flight(f'{prefix}@{generation}:lock', lookup, lambda: store(missing)))
+    return {sid: values[sid] for sid in keys}
+
+
+def cached_period_values(prefix, periods, compute, closed, timeout=60 * 60 * 24):
+    """期間ごとの集計値を '{prefix}:{期間タグ}@{世代}' のキーでキャッシュし、キャッシュに無い期間だけを集計する。
+
+    periods: [(年, 月), ...]（月 None はその年全体）
+    compute: 期間のリストを受け取り {期間: 集計値} を返す関数
+    closed: 期間を受け取り、最新の取込月より前の締まった期間なら True を返す関数（期限なしで保存する。
+        キャッシュの間引きで消えた期間は、他の期間と同じくキャッシュに無い期間として集計し直す）
+    締まった期間も、その年月が取り込み直されれば世代が変わって作り直す。
+    返り値: {期間: 集計値}（periods の順）
+    """
+    periods = list(dict.fromkeys(periods))
+    generations = period_generations(periods)
+    keys = {period: f'{prefix}:{period_tag(*period)}@{generations[period]}' for period in periods}
+    found = cache.get_many(list(keys.values()))
+    missing = [period for period in periods if keys[period] not in found]
+    if missing:
+        computed = compute(missing)
+        closed_entries, open_entries = {}, {}
+        for period in missing:
+            (closed_entries if closed(period) else open_entries)[keys[period]] = computed[period]
+        cache.set_many(closed_entries, None)
+        cache.set_many(open_entries, timeout)
+        found.update(closed_entries)
+        found.update(open_entries)
+    return {period: found[keys[period]] for period in periods}
+
+
+def invalidate_sales_caches(periods):
+    """periods [(年, 月), ...] の売上が変わったときに、依存する期間の版を更新する。
+
+    返り値: 更新した期間の版の数
+    """
+    tags = set()
+    for year, month in periods:
+        tags |= affected_tags(year, month)
+    for tag in sorted(tags):
+        bump_data_version(period_version_name(tag))
+    return len(tags)
+
+
+def clear_sales_caches():
+    """売上キャッシュ全体の版を更新し、すべての売上キャッシュを無効にする（キャッシュ自体は削除しない）"""
+    bump_data_version(DataVersion.SALES_CACHE)
+
+
+def invalidate_after_sales_import(results):
+    """売上取込の結果（write_parsed_sales の返り値のリスト）に応じて売上キャッシュを無効にする。
+
+    取り込んだ年月に依存するものを無効にし、新しい年月や店舗が増えた場合は、年・月・店舗の選択肢が
+    全ページで変わるため選択肢の版も更新する（期間ごとの集計値 cached_period_values は残る）。
+    返り値: 無効にした範囲（'all' / 'periods' / None）
+    """
+    results = [r for r in results if not r.get('skipped') and not r.get('dry_run')]
+    if not results:
+        return None
+    invalidate_sales_caches({(r['report_date'].year, r['report_date'].month) for r in results})
+    if any(r.get('new_period') or r.get('created_shops') for r in results):
+        bump_data_version(DataVersion.SALES_CHOICES)
+        return 'all'
+    return 'periods'
+
+
+def _month_param(request, name='month'):
+    value = request.GET.get(name)
+    if value and value.isdigit() and 1 <= int(value) <= 12:
+        return int(value)
+    return None
+
+
+def month_periods(request):
+    """?month=M なら各年の M 月に依存し、未指定・合計なら全期間に依存する"""
+    month = _month_param(request)
+    return ((None, month),) if month else ALL_PERIODS
+
+
+def year_periods(request):
+    """?year=Y なら Y 年に依存し、未指定（最新年を表示）なら全期間に依存する"""
+    year = request.GET.get('year')
+    return ((int(year), None),) if year and year.isdigit() else ALL_PERIODS
+
+
+def year_month_periods(request):
+    """?year=Y&month=M なら Y 年 M 月に依存し、どちらかが未指定（最新年月を表示）なら全期間に依存する"""
+    year = request.GET.get('year')
+    month = _month_param(request)
+    return ((int(year), month),) if year and year.isdigit() and month else ALL_PERIODS
+
+
+class SalesCacheMiddleware(CacheMiddleware):
+    """ページ全体のキャッシュ (cache_page) のキーに、ページが依存する期間の売上キャッシュの世代を付ける。
+
+    インスタンスはビューごとに 1 つで、スレッド間で共有される。世代は process_request でリクエストごとに求め、
+    同じスレッドで続く process_response まで保持する。
+    """
+
+    def __init__(self, get_response, periods=lambda request: ALL_PERIODS, **kwargs):
+        self._generation = threading.local()
+        super().__init__(get_response, **kwargs)
+        self.periods = periods
+
+    @property
+    def key_prefix(self):
+        return f"{self._key_prefix}sales@{getattr(self._generation, 'value', '')}"
+
+    @key_prefix.setter
+    def key_prefix(self, value):
+        self._key_prefix = value
+
+    def process_request(self, request):
+        self._generation.value = sales_generation(self.periods(request))
+        return super().process_request(request)
+
+
+def cache_sales_page(timeout, periods=lambda request: ALL_PERIODS):
+    """cache_page と同じくページ全体をキャッシュし、キーに売上キャッシュの世代を付ける。
+
+    periods: request を受け取り、ページが依存する [(年, 月), ...] を返す関数
+    """
+    return decorator_from_middleware_with_args(SalesCacheMiddleware)(page_timeout=timeout, periods=periods)
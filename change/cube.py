@@ -0,0 +1,205 @@
+"""売上キューブ（プロセス内の NumPy 配列で売上レポートを集計する）
+
+集計サマリー (SalesSummary) の 180部門の行を 年月 × 店舗 × 部門 × 指標 (販売/買取/仕入/ネット/粗利) の
+密な配列に読み込み、レポートは DB を集計する代わりに配列の切り出しと部門階層への積み上げ（行列積）で作る。
+各年月の値は集計サマリーと同じく店舗ごとの月内最新日のスナップショットで、取込は (店舗, 月) ごとに
+1 日分の SalesRecord だけを残すため、年月を足し合わせた値は SalesRecord を期間で合計した値と一致する。
+各セルに行があるかどうかも別の真偽値配列に持ち、「データの無い店舗・部門は表示しない」
+という DB 集計と同じ結果になるようにする。
+
+キューブはプロセスごとに 1 つ持ち、初回参照時に 1 クエリで読み込む。売上取込・集計サマリーの再構築で
+売上データの版 (DataVersion 'sales') が変わると、次の参照時に読み直す。
+大きさは取込日ではなく年月の数に比例する。settings.SALES_CUBE_ENABLED が False なら get_sales_cube() は
+None を返し、各レポートは DB を集計する。見積もりが settings.SALES_CUBE_MAX_BYTES を超える場合も
+読み込まずに DB の集計を使う（メモリの少ないワーカーで上限を超えて確保しないように）。
+"""
+import calendar
+import logging
+import threading
+from datetime import date
+from itertools import islice
+
+import numpy as np
+from django.conf import settings
+
+from .models import Category, DataVersion, SalesPeriod, SalesRecord, SalesSummary, Shop
+from .versions import get_data_version
+
+METRIC_FIELDS = SalesRecord.METRIC_FIELDS
+
+# 集計サマリーを読み込むときに 1 度に配列へ書き込む行数
+LOAD_CHUNK_ROWS = 10000
+
+logger = logging.getLogger(__name__)
+
+
+class SalesCube:
+    """年月 × 店舗 × 部門 × 指標 の売上配列（読み込み後は変更しない）"""
+
+    def __init__(self, version, periods, shop_ids, category_ids, values, present):
+        self.version = version
+        self.periods = list(periods)    # [(年, 月), ...]（昇順）
+        self.shop_ids = np.asarray(shop_ids, dtype=np.int64)
+        self.category_ids = np.asarray(category_ids, dtype=np.int64)
+        self.values = values      # (年月, 店舗, 部門, 指標) の int64
+        self.present = present    # (年月, 店舗, 部門) の bool（行があるか）
+        self._shop_index = {int(sid): i for i, sid in enumerate(self.shop_ids)}
+        self._category_index = {int(cid): i for i, cid in enumerate(self.category_ids)}
+
+    @property
+    def nbytes(self):
+        return self.values.nbytes + self.present.nbytes
+
+    # --- 年月の選択 ---
+
+    def period_indices(self, year=None, month=None):
+        """year 年 month 月の年月の添字（None はすべての年・すべての月）"""
+        return [i for i, (y, m) in enumerate(self.periods)
+                if (year is None or y == year) and (month is None or m == month)]
+
+    def range_indices(self, start=None, end=None):
+        """月全体が start 以上 end 以下に入る年月の添字（None は端まで）。月単位・年単位の範囲に使う"""
+        return [i for i, (y, m) in enumerate(self.periods)
+                if (start is None or date(y, m, 1) >= start)
+                and (end is None or date(y, m, calendar.monthrange(y, m)[1]) <= end)]
+
+    # --- 部門の積み上げ ---
+
+    def category_groups(self, tree, categories):
+        """部門ごとに、その部門と子孫にあたる部門軸の添字を集めた (部門軸 × グループ) の 0/1 行列"""
+        matrix = np.zeros((len(self.category_ids), len(categories)), dtype=np.int64)
+        for col, category in enumerate(categories):
+            for cid in tree.descendant_ids(category.id):
+                row = self._category_index.get(cid)
+                if row is not None:
+                    matrix[row, col] = 1
+        return matrix
+
+    def rollup(self, period_indices, groups, shop_ids=None, by_shop=False, metrics=('amount_sales',)):
+        """period_indices の年月を合計し、部門を groups（category_groups の行列）で積み上げる。
+
+        shop_ids: 対象店舗（None なら全店舗）
+        by_shop: True なら店舗別に返す
+        返り値: (values, present)
+            by_shop=False: values (グループ, 指標), present (グループ,)
+            by_shop=True:  values (店舗, グループ, 指標), present (店舗, グループ)、店舗の並びは shops_of(shop_ids)
+        """
+        shop_axis = self._shop_axis(shop_ids)
+        metric_axis = [METRIC_FIELDS.index(m) for m in metrics]
+        n_shops, n_groups = len(shop_axis), groups.shape[1]
+        if not period_indices or not n_shops:
+            shape = (n_shops, n_groups) if by_shop else (n_groups,)
+            return np.zeros(shape + (len(metric_axis),), dtype=np.int64), np.zeros(shape, dtype=bool)
+
+        if len(period_indices) == 1:
+            values, present = self.values[period_indices[0]], self.present[period_indices[0]]
+        else:
+            values, present = self.values[period_indices].sum(axis=0), self.present[period_indices].any(axis=0)
+        values = values[shop_axis][:, :, metric_axis]
+        present = present[shop_axis]
+        # (店舗, 部門, 指標) x (部門, グループ) -> (店舗, グループ, 指標)
+        values = np.einsum('scm,cg->sgm', values, groups)
+        present = (present.astype(np.int64) @ groups) > 0
+        if by_shop:
+            return values, present
+        return values.sum(axis=0), present.any(axis=0)
+
+    def shops_of(self, shop_ids=None):
+        """rollup(by_shop=True) の店舗軸に対応する店舗 id"""
+        return [int(self.shop_ids[i]) for i in self._shop_axis(shop_ids)]
+
+    def _shop_axis(self, shop_ids):
+        if shop_ids is None:
+            return list(range(len(self.shop_ids)))
+        return [self._shop_index[sid] for sid in dict.fromkeys(shop_ids) if sid in self._shop_index]
+
+
+def rank(values):
+    """降順の順位（1 始まり、同値は先に並んでいるものが上位）"""
+    order = np.argsort(-np.asarray(values), kind='stable')
+    ranks = np.empty(len(order), dtype=np.int64)
+    ranks[order] = np.arange(1, len(order) + 1)
+    return ranks
+
+
+def share(values, decimals=1):
+    """合計に対する構成比 (%)。合計が 0 以下なら 0"""
+    values = np.asarray(values, dtype=np.float64)
+    total = values.sum()
+    if total <= 0:
+        return np.zeros(len(values))
+    return np.round(values / total * 100, decimals)
+
+
+def cube_nbytes(n_periods, n_shops, n_categories):
+    """年月・店舗・部門の数から見積もった SalesCube の配列のバイト数"""
+    return n_periods * n_shops * n_categories * (len(METRIC_FIELDS) * 8 + 1)
+
+
+def _axis_positions(axis, ids):
+    """ids の axis 上の添字と、axis にある id かどうかの bool 配列"""
+    if not len(axis):
+        return np.zeros(len(ids), dtype=np.int64), np.zeros(len(ids), dtype=bool)
+    positions = np.minimum(np.searchsorted(axis, ids), len(axis) - 1)
+    return positions, axis[positions] == ids
+
+
+def load_sales_cube(version=None, max_bytes=None, chunk_rows=LOAD_CHUNK_ROWS):
+    """集計サマリーの 180部門の行を 1 クエリで読み込んで SalesCube を作る。
+
+    軸は期間索引の売上のある年月・全店舗・180部門。読み込み中に追加された年月・店舗・部門の行は読み飛ばす
+    （追加した取込が版を更新するため、次の参照時に読み直される）。
+    max_bytes: 見積もりがこれを超える場合は読み込まずに None を返す
+    chunk_rows: 1 度に配列へ書き込む行数（DB からもこの件数ずつ読み出す）
+    """
+    periods = list(SalesPeriod.objects.filter(month__isnull=False, has_sales=True)
+                   .order_by('year', 'month').values_list('year', 'month'))
+    shop_ids = list(Shop.objects.order_by('id').values_list('id', flat=True))
+    category_ids = list(Category.objects.filter(level=180).order_by('id').values_list('id', flat=True))
+    nbytes = cube_nbytes(len(periods), len(shop_ids), len(category_ids))
+    if max_bytes is not None and nbytes > max_bytes:
+        logger.warning("Sales cube would need %d bytes (%d months) over SALES_CUBE_MAX_BYTES=%d; "
+                       "reports aggregate in the database", nbytes, len(periods), max_bytes)
+        return None
+    period_axis = np.asarray([y * 12 + m - 1 for y, m in periods], dtype=np.int64)
+    shop_axis = np.asarray(shop_ids, dtype=np.int64)
+    category_axis = np.asarray(category_ids, dtype=np.int64)
+
+    values = np.zeros((len(periods), len(shop_ids), len(category_ids), len(METRIC_FIELDS)), dtype=np.int64)
+    present = np.zeros((len(periods), len(shop_ids), len(category_ids)), dtype=bool)
+    rows = (SalesSummary.objects.filter(level=180).order_by()
+            .values_list('year', 'month', 'shop_id', 'category_id', *METRIC_FIELDS)
+            .iterator(chunk_size=chunk_rows))
+    while True:
+        chunk = np.array(list(islice(rows, chunk_rows)), dtype=np.int64).reshape(-1, 4 + len(METRIC_FIELDS))
+        if not len(chunk):
+            break
+        p, p_ok = _axis_positions(period_axis, chunk[:, 0] * 12 + chunk[:, 1] - 1)
+        s, s_ok = _axis_positions(shop_axis, chunk[:, 2])
+        c, c_ok = _axis_positions(category_axis, chunk[:, 3])
+        known = p_ok & s_ok & c_ok
+        values[p[known], s[known], c[known]] = chunk[known, 4:]
+        present[p[known], s[known], c[known]] = True
+    return SalesCube(version, periods, shop_ids, category_ids, values, present)
+
+
+_cube = None    # (売上データの版, SalesCube または上限を超えて読み込まなかった場合は None)
+_cube_lock = threading.Lock()
+
+
+def get_sales_cube():
+    """現在の売上データの SalesCube（無効化されている・上限を超える場合は None）。
+
+    プロセス内で共有し、売上データの版が変わったときだけ読み直す。
+    """
+    global _cube
+    if not getattr(settings, 'SALES_CUBE_ENABLED', True):
+        return None
+    version = get_data_version(DataVersion.SALES)
+    loaded = _cube
+    if loaded is not None and loaded[0] == version:
+        return loaded[1]
+    with _cube_lock:
+        if _cube is None or _cube[0] != version:
+            _cube = (version, load_sales_cube(version, getattr(settings, 'SALES_CUBE_MAX_BYTES', None)))
+        return _cube[1]
@@ -2,4 +2,8 @@ from django import forms
 
 class ExcelUploadForm(forms.Form):
     """Excelファイルアップロード用のフォーム"""
-    file = forms.FileField(label='Excelファイルを選択')
\ No newline at end of file
+    file = forms.FileField(label='Excelファイルを選択')
+
+class SalesUploadForm(ExcelUploadForm):
+    """売上データアップロード用のフォーム"""
+    dry_run = forms.BooleanField(label='差分の確認のみ（書き込まない）', required=False)
@@ -0,0 +1,169 @@
+"""部門階層の参照と同期
+
+- CategoryClosure: 祖先 × 子孫の閉包テーブル（部門マスタの取込時に作り直す）
+- CategoryTree: 閉包テーブルから作る不変な木。プロセスごとに 1 つ持ち、部門マスタの版が変わったら読み直す
+  （読み込みだけを行う。閉包テーブルは移行 0014・部門マスタの取込・backfill_sales_hierarchy で作る）
+- SalesRecord.cat10 / cat35 / cat90: 部門自身を含む 10/35/90 部門の祖先。レポートは cat_map や
+  長い category_id__in の代わりに cat10_id などで集計・絞り込みを行う
+"""
+import threading
+
+from django.conf import settings
+from django.db.models import Q
+
+from .models import Category, CategoryClosure, DataVersion, SalesRecord
+from .versions import bump_data_version, get_data_version
+
+HIERARCHY_FIELDS = SalesRecord.HIERARCHY_FIELDS
+
+
+def _parent_chains(parents):
+    """{部門 id: 親 id} から、各部門について (祖先 id, 階層差) を自身から順に返す（循環は打ち切る）"""
+    for cid in parents:
+        seen = set()
+        current, depth = cid, 0
+        while current is not None and current in parents and current not in seen:
+            seen.add(current)
+            yield cid, current, depth
+            current, depth = parents[current], depth + 1
+
+
+def rebuild_category_closure(batch_size=None):
+    """CategoryClosure を部門マスタから作り直し、部門マスタの版を更新する。
+
+    返り値: 新しい版
+    """
+    parents = dict(Category.objects.values_list('id', 'parent_id'))
+    rows = [CategoryClosure(ancestor_id=ancestor, descendant_id=cid, depth=depth)
+            for cid, ancestor, depth in _parent_chains(parents)]
+    CategoryClosure.objects.all().delete()
+    CategoryClosure.objects.bulk_create(rows, batch_size=batch_size or getattr(settings, 'SALES_IMPORT_BATCH_SIZE', 500))
+    return bump_data_version(DataVersion.CATEGORY_MASTER)
+
+
+class CategoryTree:
+    """部門マスタの不変な木（部門 id から子孫・祖先・パンくずを O(1) で引く）
+
+    部門は保存済みの Category インスタンスとして返すが、共有されるため変更しないこと。
+    """
+
+    def __init__(self, version, categories, closure):
+        self.version = version
+        self._nodes = {c.id: c for c in categories}
+        self._by_code = {}
+        for c in sorted(self._nodes.values(), key=lambda c: c.id):
+            self._by_code.setdefault((c.level, c.code), c)
+        children = {}
+        for c in sorted(self._nodes.values(), key=lambda c: (c.code, c.id)):
+            if c.parent_id is not None:
+                children.setdefault(c.parent_id, []).append(c)
+        self._children = {pid: tuple(cs) for pid, cs in children.items()}
+        descendants = {}
+        ancestors = {}
+        for ancestor_id, descendant_id, depth in closure:
+            descendants.setdefault(ancestor_id, set()).add(descendant_id)
+            ancestors.setdefault(descendant_id, []).append((depth, ancestor_id))
+        self._descendants = {cid: frozenset(ids) for cid, ids in descendants.items()}
+        self._ancestors = {cid: tuple(a for _, a in sorted(pairs)) for cid, pairs in ancestors.items()}
+
+    def get(self, category_id):
+        return self._nodes.get(category_id)
+
+    def find(self, code, level):
+        """code と level の部門（無ければ None）"""
+        try:
+            return self._by_code.get((int(level), int(code)))
+        except (TypeError, ValueError):
+            return None
+
+    def children(self, category_id):
+        """直下の部門（コード順）"""
+        return self._children.get(category_id, ())
+
+    def descendant_ids(self, category_id):
+        """自身を含む子孫の id"""
+        return self._descendants.get(category_id, frozenset())
+
+    def ancestor_ids(self, category_id):
+        """自身から最上位までの祖先の id"""
+        return self._ancestors.get(category_id, ())
+
+    def breadcrumbs(self, category_id):
+        """最上位から自身までの部門"""
+        return [self._nodes[a] for a in reversed(self.ancestor_ids(category_id))]
+
+
+_tree = None
+_tree_lock = threading.Lock()
+
+
+def category_tree():
+    """現在の部門マスタの CategoryTree（プロセス内で共有し、版が変わったときだけ読み直す）"""
+    global _tree
+    version = get_data_version(DataVersion.CATEGORY_MASTER)
+    tree = _tree
+    if tree is not None and tree.version == version:
+        return tree
+    with _tree_lock:
+        if _tree is None or _tree.version != version:
+            categories = list(Category.objects.all())
+            closure = list(CategoryClosure.objects.values_list('ancestor_id', 'descendant_id', 'depth'))
+            if categories and not closure:
+                # 閉包テーブルがまだ無い（移行前のデータなど）: 親子関係からプロセス内で作る（DB には書かない）
+                closure = [(ancestor, cid, depth) for cid, ancestor, depth
+                           in _parent_chains({c.id: c.parent_id for c in categories})]
+            _tree = CategoryTree(version, categories, closure)
+        return _tree
+
+
+def category_ancestor_map():
+    """{部門 id: {'cat10_id': id, 'cat35_id': id, 'cat90_id': id}} を 1 クエリで作る。
+
+    自身を含めて親をたどり、各階層で最初に見つかった部門を入れる（無い階層は None）。
+    """
+    nodes = {cid: (level, parent_id) for cid, level, parent_id in Category.objects.values_list('id', 'level', 'parent_id')}
+    result = {cid: {f'{field}_id': None for field in HIERARCHY_FIELDS.values()} for cid in nodes}
+    for cid, ancestor, _ in _parent_chains({cid: parent_id for cid, (_, parent_id) in nodes.items()}):
+        field = HIERARCHY_FIELDS.get(nodes[ancestor][0])
+        if field and result[cid][f'{field}_id'] is None:
+            result[cid][f'{field}_id'] = ancestor
+    return result
+
+
+def apply_hierarchy(records, ancestor_map=None):
+    """保存前の SalesRecord インスタンスに階層列を設定する"""
+    ancestor_map = category_ancestor_map() if ancestor_map is None else ancestor_map
+    for r in records:
+        for attr, value in ancestor_map.get(r.category_id, {}).items():
+            setattr(r, attr, value)
+    return records
+
+
+def sync_sales_hierarchy(batch_size=500):
+    """既存の SalesRecord の階層列を部門マスタに合わせる（ずれている行だけを更新する）。
+
+    祖先の組み合わせが同じ部門をまとめ、組み合わせごとに一括 UPDATE する。
+    返り値: 更新した行数
+    """
+    groups = {}
+    for cid, ancestors in category_ancestor_map().items():
+        groups.setdefault(tuple(sorted(ancestors.items())), []).append(cid)
+
+    updated = 0
+    for key, category_ids in groups.items():
+        ancestors = dict(key)
+        in_sync = Q()
+        for attr, value in ancestors.items():
+            in_sync &= Q(**{f'{attr}__isnull': True}) if value is None else Q(**{attr: value})
+        for i in range(0, len(category_ids), batch_size):
+            updated += (SalesRecord.objects
+                        .filter(category_id__in=category_ids[i:i + batch_size])
+                        .exclude(in_sync)
+                        .update(**ancestors))
+    return updated
+
+
+def hierarchy_filter(category):
+    """category とその配下の部門の SalesRecord を絞り込む条件（filter に渡す dict）"""
+    field = HIERARCHY_FIELDS.get(category.level)
+    return {field: category} if field else {'category': category}
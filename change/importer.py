@@ -0,0 +1,691 @@
+"""売上データ・部門マスタの取込処理
+
+`upload_sales_data` から呼ばれる取込パイプライン。
+0. 読込: .xlsx は openpyxl の read-only モードで逐次読込（.xls は pandas）
+1. 解析: シートを店舗×部門×5指標の NumPy 配列にまとめる（DB にはアクセスしない）
+2. 書き込み: 解析結果を (shop, category, date) の一意制約をキーにバッチ upsert する
+   （客数行は CustomerCount に (shop, date) をキーに書き込む）
+直前の取込とファイル内容または解析結果が同じ場合は、DB とキャッシュに触れずに終了する。
+"""
+import calendar
+import hashlib
+import itertools
+import logging
+import time
+from contextlib import contextmanager
+from datetime import datetime, date
+
+import numpy as np
+import openpyxl
+import pandas as pd
+from django.conf import settings
+from django.db import transaction
+
+from .hierarchy import apply_hierarchy, rebuild_category_closure, sync_sales_hierarchy
+from .models import Category, CustomerCount, DataVersion, Shop, SalesRecord, SalesImportFingerprint
+from .summary import rebuild_month_summary, rebuild_sales_summary
+from .versions import bump_data_version
+
+logger = logging.getLogger(__name__)
+
+# 1ステートメントあたりの upsert 件数（settings.SALES_IMPORT_BATCH_SIZE で上書き可）
+DEFAULT_BATCH_SIZE = 500
+
+# 店舗ごとの 5 列ブロック（販売/買取/仕入/ネット/粗利）に対応するフィールド
+METRIC_FIELDS = SalesRecord.METRIC_FIELDS
+
+# 日付・「販売」見出しを探す先頭行数
+HEADER_SEARCH_ROWS = 20
+
+# 店舗名の候補から除外するキーワード
+SHOP_EXCLUDE_KEYWORDS = ["原価率", "累計", "合計", "構成比", "予算", "前年", "売上", "仕入", "販売"]
+
+REPORT_DATE_PATTERN = r'(\d+)年(\d+)月(\d+)日'
+
+# ストリーミング読込で一度に DataFrame 化する行数（settings.SALES_IMPORT_CHUNK_ROWS で上書き可）
+DEFAULT_CHUNK_ROWS = 256
+
+# 部門マスタの (階層, コード列, 部門名列)。上位階層から順に並べる
+MASTER_LEVEL_COLUMNS = ((10, 0, 1), (35, 2, 3), (90, 4, 5), (180, 6, 7))
+
+
+@contextmanager
+def track_stage(timings, name, on_stage=None):
+    """取込の 1 段階を計測し、timings[name] に所要秒数を記録する。
+
+    on_stage: 段階の開始時に on_stage(name, timings) を呼ぶ（進捗表示用）
+    """
+    if on_stage:
+        on_stage(name, timings)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = round(time.perf_counter() - started, 4)
+
+
+def get_import_batch_size(batch_size=None):
+    if batch_size:
+        return int(batch_size)
+    return int(getattr(settings, 'SALES_IMPORT_BATCH_SIZE', DEFAULT_BATCH_SIZE))
+
+
+def bulk_upsert_sales_records(records, batch_size=None):
+    """SalesRecord をバッチ単位で upsert する（(shop, category, date) が既存なら指標と階層列を上書き）。
+
+    records: 保存前の SalesRecord インスタンスのリスト（同一キーを含まないこと）
+    """
+    SalesRecord.objects.bulk_create(
+        records,
+        batch_size=get_import_batch_size(batch_size),
+        update_conflicts=True,
+        unique_fields=['shop', 'category', 'date'],
+        update_fields=list(METRIC_FIELDS) + list(SalesRecord.HIERARCHY_FIELDS.values()),
+    )
+
+
+def bulk_upsert_customer_counts(counts, batch_size=None):
+    """CustomerCount をバッチ単位で upsert する（(shop, date) が既存なら客数を上書き）"""
+    CustomerCount.objects.bulk_create(
+        counts,
+        batch_size=get_import_batch_size(batch_size),
+        update_conflicts=True,
+        unique_fields=['shop', 'date'],
+        update_fields=['count'],
+    )
+
+
+def diff_sales_records(records, report_date, shop_ids=None):
+    """取込予定のレコードを、同じ店舗・同月で report_date 以前の既存レコードと突き合わせる。
+
+    既存レコードは 1 クエリで読み込み、キー (shop, category) ごとに最新日付の行と比較する。
+    shop_ids: 取込対象の店舗（未指定なら records の店舗）
+    返り値: {
+        'writes': 新規・変更のあるレコード（upsert する）,
+        'inserted': 新規件数, 'updated': 変更件数, 'unchanged': 変更なし件数,
+        'redate_ids': report_date に日付を付け替える過去日付の行,
+        'delete_ids': 削除する過去日付の行,
+    }
+    """
+    return _diff_month_rows(SalesRecord, records, report_date, shop_ids, ('shop_id', 'category_id'), METRIC_FIELDS)
+
+
+def diff_customer_counts(counts, report_date, shop_ids=None):
+    """取込予定の CustomerCount を、diff_sales_records と同じ規則で既存の客数と突き合わせる（キーは店舗）"""
+    return _diff_month_rows(CustomerCount, counts, report_date, shop_ids, ('shop_id',), ('count',))
+
+
+def _diff_month_rows(model, records, report_date, shop_ids, key_fields, value_fields):
+    incoming = {}
+    for r in records:
+        incoming[tuple(getattr(r, f) for f in key_fields)] = r  # 同一キーは後勝ち
+
+    latest = {}
+    delete_ids = []
+    if shop_ids is None:
+        shop_ids = {r.shop_id for r in records if r.shop_id is not None}
+    rows = (
+        model.objects
+        .filter(shop_id__in=shop_ids, date__gte=report_date.replace(day=1), date__lte=report_date)
+        .order_by('date', 'id')
+        .values_list('id', 'date', *key_fields, *value_fields)
+    )
+    n_keys = len(key_fields)
+    for row in rows:
+        key = row[2:2 + n_keys]
+        if key in latest:
+            delete_ids.append(latest[key][0])
+        latest[key] = row
+
+    writes = []
+    redate_ids = []
+    inserted = updated = unchanged = 0
+    for key, row in latest.items():
+        r = incoming.get(key)
+        if r is None:
+            # 取込対象外の行は、過去日付なら削除、同日付なら従来どおり残す
+            if row[1] < report_date:
+                delete_ids.append(row[0])
+            continue
+        if row[1] < report_date:
+            redate_ids.append(row[0])
+        if tuple(row[2 + n_keys:]) == tuple(getattr(r, f) for f in value_fields):
+            unchanged += 1
+        else:
+            writes.append(r)
+            updated += 1
+    for key, r in incoming.items():
+        if key not in latest:
+            writes.append(r)
+            inserted += 1
+
+    return {
+        'writes': writes,
+        'inserted': inserted,
+        'updated': updated,
+        'unchanged': unchanged,
+        'redate_ids': redate_ids,
+        'delete_ids': delete_ids,
+    }
+
+
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def pick_sales_sheet(sheet_names):
+    """ブック内のシート名から 180部門明細シートを選ぶ（見つからなければ先頭シート）"""
+    for name in sheet_names:
+        if ("180" in name or "１８０" in name) and "明細" in name and "類" in name: return name
+    for name in sheet_names:
+        if ("180" in name or "１８０" in name) and "明細" in name: return name
+    return sheet_names[0]
+
+
+def read_sales_dataframe(excel_file):
+    """アップロードされた Excel から 180部門明細シートを DataFrame として読み込む"""
+    engine = 'openpyxl'
+    if excel_file.name.endswith('.xls'): engine = 'xlrd'
+    try:
+        # ExcelFile で開いたブックをそのまま使い、ファイルを二重に解析しない
+        xl = pd.ExcelFile(excel_file, engine=engine)
+        return xl.parse(pick_sales_sheet(xl.sheet_names), header=None)
+    except:
+        if hasattr(excel_file, 'seek'): excel_file.seek(0)
+        return pd.read_excel(excel_file, header=None, engine=engine)
+
+
+def coerce_numeric_frame(frame):
+    """DataFrame を列単位で int64 配列に変換する。
+
+    カンマ・前後空白を除去し、空欄・`-`・NaN・数値化できない値は 0 とする。
+    小数は 0 方向に切り捨てる（従来の int(float(v)) と同じ）。
+    """
+    # 見出し行と同じ列に入っていたため object 型になっている数値列を数値型に戻す
+    frame = frame.infer_objects()
+    nums = np.empty(frame.shape, dtype='float64')
+    is_numeric = np.array([
+        pd.api.types.is_numeric_dtype(dt) and not pd.api.types.is_bool_dtype(dt) for dt in frame.dtypes
+    ], dtype=bool)
+
+    # 数値列はそのまま float 配列に変換する
+    if is_numeric.any():
+        nums[:, is_numeric] = frame.iloc[:, is_numeric].to_numpy(dtype='float64', na_value=np.nan)
+
+    # 文字列混在の列は、列ごとの処理のオーバーヘッドを避けるため 1 本の Series にまとめて変換する
+    if not is_numeric.all():
+        mixed = frame.iloc[:, ~is_numeric]
+        cells = pd.Series(mixed.to_numpy(dtype=object).ravel(), dtype=object)
+        flat = pd.to_numeric(cells, errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+        # 数値化できなかった文字列だけ、カンマと空白を除去して再変換する
+        retry = [i for i in np.flatnonzero(np.isnan(flat)) if isinstance(cells.iat[i], str)]
+        if len(retry):
+            cleaned = cells.iloc[retry].str.replace(',', '', regex=False).str.strip()
+            flat[retry] = pd.to_numeric(cleaned, errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+        nums[:, ~is_numeric] = flat.reshape(mixed.shape)
+
+    nums[~np.isfinite(nums)] = 0
+    return np.trunc(nums).astype(np.int64)
+
+
+def _head_cells(df):
+    """先頭行のセルを行優先で平坦化し、(セル配列, 文字列 Series, 行数, 列数) を返す"""
+    head = df.iloc[:HEADER_SEARCH_ROWS]
+    n_rows, n_cols = head.shape
+    cells = head.to_numpy(dtype=object).ravel()
+    texts = pd.Series(cells, dtype=object).astype(str)
+    return cells, texts, n_rows, n_cols
+
+
+def find_report_date(cells, texts):
+    """先頭行から報告日を探す（日付セル、または「YYYY年M月D日」を含む最初のセル）"""
+    if not len(cells):
+        return None
+    is_dt = np.fromiter((isinstance(v, datetime) and v is not pd.NaT for v in cells), dtype=bool, count=len(cells))
+    matches = texts.str.extract(REPORT_DATE_PATTERN)
+    hit = is_dt | matches[0].notna().to_numpy()
+    if not hit.any():
+        return None
+    i = int(np.argmax(hit))
+    if is_dt[i]:
+        return cells[i].date()
+    y, m, d = (int(v) for v in matches.iloc[i])
+    return date(y, m, d)
+
+
+def find_shop_columns(df, sales_header_row, exclude_names):
+    """「販売」見出しの列ごとに、上方向の店舗名を探して [(店舗名, 列番号), ...] を返す"""
+    header = df.iloc[sales_header_row].astype(str)
+    shop_columns = []
+    for col_idx in np.flatnonzero(header.str.contains("販売", regex=False).to_numpy()):
+        found_shop_name = ""
+        for offset in range(1, 7):
+            target_row = sales_header_row - offset
+            if target_row < 0: break
+            cell_val = df.iat[target_row, col_idx]
+            val_str = str(cell_val).strip()
+            if pd.isna(cell_val) or val_str == "" or val_str == "nan": continue
+            if any(k in val_str for k in SHOP_EXCLUDE_KEYWORDS): continue
+            if "%" in val_str: continue
+            if isinstance(cell_val, (int, float, np.integer, np.floating)): continue
+            if val_str in exclude_names: continue
+            found_shop_name = val_str; break
+        if found_shop_name:
+            shop_columns.append((found_shop_name, int(col_idx)))
+    return shop_columns
+
+
+def parse_sales_header(head, exclude_names=()):
+    """シート先頭行から報告日・「販売」見出し行・店舗列を求める。
+
+    返り値: (report_date, sales_header_row, [(店舗名, 列番号), ...])
+    """
+    cells, texts, n_head_rows, n_cols = _head_cells(head)
+
+    report_date = find_report_date(cells, texts)
+    if not report_date: raise ValueError("日付が見つかりませんでした。")
+
+    has_sales = texts.str.contains("販売", regex=False).to_numpy().reshape(n_head_rows, n_cols).any(axis=1)
+    if not has_sales.any(): raise ValueError("列名「販売」が見つかりませんでした。")
+    sales_header_row = int(np.argmax(has_sales))
+    logger.debug(f"sales_header_row index: {sales_header_row}")
+
+    shop_columns = find_shop_columns(head, sales_header_row, set(exclude_names))
+    if not shop_columns: raise ValueError(f"店舗情報が見つかりませんでした。(販売行:{sales_header_row+1} の上を確認しました)")
+    return report_date, sales_header_row, shop_columns
+
+
+def parse_sales_rows(data, shop_columns):
+    """「販売」見出しより下の行を解析する。
+
+    返り値: (codes, values, customers)
+      codes: 部門コード行のコード int64 (n,)
+      values: 部門コード行の値 int64 (n, n_shops, 5)
+      customers: 客数行の値 int64 (n_shops,)。客数行が無ければ None
+    """
+    n_shops = len(shop_columns)
+
+    # A列: 客数行の判定と部門コードの数値化
+    code_col = data.iloc[:, 0]
+    a_col = code_col.astype(str).str.replace("　", "", regex=False).str.replace(" ", "", regex=False).str.strip()
+    is_customer = a_col.str.contains("客数", regex=False).to_numpy()
+    codes = pd.to_numeric(a_col.str.replace(',', '', regex=False), errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+    is_dept = ~is_customer & code_col.notna().to_numpy() & np.isfinite(codes)
+
+    # 店舗ごとの 5 列ブロックをまとめて数値化（シート幅を超える列は 0）
+    block_cols = np.array([col_idx + o for _, col_idx in shop_columns for o in range(len(METRIC_FIELDS))])
+    in_range = block_cols < data.shape[1]
+    values = np.zeros((len(data), len(block_cols)), dtype=np.int64)
+    if in_range.any():
+        values[:, in_range] = coerce_numeric_frame(data.iloc[:, block_cols[in_range]])
+    values = values.reshape(len(data), n_shops, len(METRIC_FIELDS))
+
+    customers = None
+    if is_customer.any():
+        customers = values[np.flatnonzero(is_customer)[-1], :, 0].copy()
+
+    return np.trunc(codes[is_dept]).astype(np.int64), values[is_dept], customers
+
+
+def parse_sales_sheet(df, exclude_names=()):
+    """180部門明細シートを列単位で解析し、書き込み段階が使う列指向の結果を返す。
+
+    exclude_names: 店舗名と見なさない文字列（10部門名など）
+    返り値: {
+        'report_date': date,
+        'shop_names': [店舗名, ...],
+        'codes': int64 (n_rows,)                  部門コード行のコード,
+        'values': int64 (n_rows, n_shops, 5)      販売/買取/仕入/ネット/粗利,
+        'customers': int64 (n_shops,) または None  客数行（複数あれば最後の行）,
+    }
+    """
+    report_date, sales_header_row, shop_columns = parse_sales_header(df.iloc[:HEADER_SEARCH_ROWS], exclude_names)
+    codes, values, customers = parse_sales_rows(df.iloc[sales_header_row + 1:], shop_columns)
+    return {
+        'report_date': report_date,
+        'shop_names': [name for name, _ in shop_columns],
+        'codes': codes,
+        'values': values,
+        'customers': customers,
+    }
+
+
+def read_sales_sheet_streaming(excel_file, exclude_names=(), chunk_rows=None):
+    """.xlsx を openpyxl の read-only モードで 1 回だけ走査して解析する。
+
+    シート全体を DataFrame に展開せず、先頭行（日付・見出し検出用）と
+    chunk_rows 行ずつのデータ行だけをメモリに持つ。返り値は parse_sales_sheet と同じ。
+    """
+    chunk_rows = chunk_rows or getattr(settings, 'SALES_IMPORT_CHUNK_ROWS', DEFAULT_CHUNK_ROWS)
+    wb = openpyxl.load_workbook(excel_file, read_only=True, data_only=True, keep_links=False)
+    try:
+        ws = wb[pick_sales_sheet(wb.sheetnames)]
+        # 寸法情報が誤っているファイルで列が欠けないよう、実データから幅を判定させる
+        ws.reset_dimensions()
+        rows = ws.iter_rows(values_only=True)
+
+        head_rows = list(itertools.islice(rows, HEADER_SEARCH_ROWS))
+        report_date, sales_header_row, shop_columns = parse_sales_header(pd.DataFrame(head_rows), exclude_names)
+
+        code_chunks, value_chunks = [], []
+        customers = None
+        pending = head_rows[sales_header_row + 1:]
+        while True:
+            pending.extend(itertools.islice(rows, max(0, chunk_rows - len(pending))))
+            if not pending:
+                break
+            codes, values, chunk_customers = parse_sales_rows(pd.DataFrame(pending), shop_columns)
+            code_chunks.append(codes)
+            value_chunks.append(values)
+            if chunk_customers is not None:
+                customers = chunk_customers
+            pending = []
+    finally:
+        wb.close()
+
+    n_shops = len(shop_columns)
+    return {
+        'report_date': report_date,
+        'shop_names': [name for name, _ in shop_columns],
+        'codes': np.concatenate(code_chunks) if code_chunks else np.zeros(0, dtype=np.int64),
+        'values': np.concatenate(value_chunks) if value_chunks else np.zeros((0, n_shops, len(METRIC_FIELDS)), dtype=np.int64),
+        'customers': customers,
+    }
+
+
+def write_parsed_sales(parsed, batch_size=None, file_hash='', dry_run=False, timings=None, on_stage=None):
+    """parse_sales_sheet の結果を SalesRecord（客数は CustomerCount）に書き込み、同じトランザクションで取込指紋を記録する。
+
+    既存レコードとの差分（新規・変更・削除）だけを書き込む。変更のない過去日付の行は
+    削除・再挿入せず、日付だけを report_date に付け替える。
+    dry_run: True なら差分の件数だけを数え、何も書き込まない
+    timings, on_stage: 'diff'・'write'・'summary' の段階を track_stage で記録する
+    返り値: {'report_date', 'count', 'customer_rows_count', 'inserted', 'updated', 'unchanged',
+             'deleted', 'new_period', 'created_shops', 'skipped', 'dry_run'}
+    """
+    report_date = parsed['report_date']
+
+    shop_cache = {s.name: s for s in Shop.objects.filter(name__in=parsed['shop_names'])}
+    missing = [name for name in dict.fromkeys(parsed['shop_names']) if name not in shop_cache]
+    if missing and dry_run:
+        shop_cache.update({name: Shop(name=name) for name in missing})
+    elif missing:
+        Shop.objects.bulk_create([Shop(name=name) for name in missing], ignore_conflicts=True)
+        shop_cache.update({s.name: s for s in Shop.objects.filter(name__in=missing)})
+    shops = [shop_cache[name] for name in parsed['shop_names']]
+
+    # その年月の売上が初めて入るか（年・月の選択肢が変わるかどうか）
+    month_start = report_date.replace(day=1)
+    month_end = report_date.replace(day=calendar.monthrange(report_date.year, report_date.month)[1])
+    new_period = not (SalesRecord.objects.filter(date__range=(month_start, month_end)).exists()
+                      or CustomerCount.objects.filter(date__range=(month_start, month_end)).exists())
+
+    category_ids = dict(Category.objects.filter(level=180).values_list('code', 'id'))
+
+    records = []
+    customer_counts = []
+    count = 0
+    customer_rows_count = 0
+
+    if parsed['customers'] is not None:
+        # 客数は値が入っている店舗のみ登録
+        for shop, value in zip(shops, parsed['customers'].tolist()):
+            if value > 0:
+                customer_counts.append(CustomerCount(shop_id=shop.id, date=report_date, count=value))
+                customer_rows_count += 1
+        count += customer_rows_count
+        if customer_rows_count == 0:
+            logger.debug("客数行として検出されましたが、すべての店舗の客数値が 0 だったため登録されませんでした。")
+
+    for code, row in zip(parsed['codes'].tolist(), parsed['values'].tolist()):
+        category_id = category_ids.get(code)
+        if category_id is None:
+            continue
+        for shop, vals in zip(shops, row):
+            records.append(SalesRecord(
+                shop_id=shop.id, category_id=category_id, date=report_date,
+                **dict(zip(METRIC_FIELDS, vals))
+            ))
+        count += 1
+    apply_hierarchy(records)
+
+    timings = {} if timings is None else timings
+    shop_ids = {shop.id for shop in shops if shop.id is not None}
+    with track_stage(timings, 'diff', on_stage):
+        diff = diff_sales_records(records, report_date, shop_ids)
+        customer_diff = diff_customer_counts(customer_counts, report_date, shop_ids)
+    if not dry_run:
+        size = get_import_batch_size(batch_size)
+        with transaction.atomic():
+            with track_stage(timings, 'write', on_stage):
+                # 新しい累計データで同月内の過去日付分を上書きするため、
+                # 取込に含まれない過去日付の行を削除し、含まれる行は日付を付け替える
+                for ids in _chunks(diff['delete_ids'], size):
+                    SalesRecord.objects.filter(id__in=ids).delete()
+                for ids in _chunks(diff['redate_ids'], size):
+                    SalesRecord.objects.filter(id__in=ids).update(date=report_date)
+                bulk_upsert_sales_records(diff['writes'], batch_size=size)
+                for ids in _chunks(customer_diff['delete_ids'], size):
+                    CustomerCount.objects.filter(id__in=ids).delete()
+                for ids in _chunks(customer_diff['redate_ids'], size):
+                    CustomerCount.objects.filter(id__in=ids).update(date=report_date)
+                bulk_upsert_customer_counts(customer_diff['writes'], batch_size=size)
+
+                SalesImportFingerprint.objects.create(
+                    report_date=report_date,
+                    shops=list(parsed['shop_names']),
+                    file_hash=file_hash,
+                    payload_hash=payload_sha256(parsed),
+                )
+                # 売上キューブなどのプロセス内キャッシュを読み直させる
+                bump_data_version(DataVersion.SALES)
+
+            with track_stage(timings, 'summary', on_stage):
+                # 同じトランザクションで、取り込んだ年月の集計サマリーを作り直す
+                rebuild_month_summary(report_date.year, report_date.month)
+
+    return {
+        'report_date': report_date,
+        'count': count,
+        'customer_rows_count': customer_rows_count,
+        'inserted': diff['inserted'] + customer_diff['inserted'],
+        'updated': diff['updated'] + customer_diff['updated'],
+        'unchanged': diff['unchanged'] + customer_diff['unchanged'],
+        'deleted': len(diff['delete_ids']) + len(customer_diff['delete_ids']),
+        'new_period': new_period,
+        'created_shops': len(missing),
+        'skipped': False,
+        'dry_run': dry_run,
+    }
+
+
+def file_sha256(excel_file):
+    """アップロードファイルのバイト列の SHA-256（読込位置は先頭に戻す）"""
+    h = hashlib.sha256()
+    excel_file.seek(0)
+    for chunk in iter(lambda: excel_file.read(1024 * 1024), b''):
+        h.update(chunk)
+    excel_file.seek(0)
+    return h.hexdigest()
+
+
+def payload_sha256(parsed):
+    """解析結果（報告日・店舗・部門コード・値・客数）を正規化した SHA-256。
+
+    書式だけが異なるファイル（保存し直し等）も同じ値になる。
+    """
+    h = hashlib.sha256()
+    h.update(parsed['report_date'].isoformat().encode())
+    h.update('\t'.join(parsed['shop_names']).encode())
+    h.update(np.ascontiguousarray(parsed['codes'], dtype=np.int64).tobytes())
+    h.update(np.ascontiguousarray(parsed['values'], dtype=np.int64).tobytes())
+    if parsed['customers'] is not None:
+        h.update(np.ascontiguousarray(parsed['customers'], dtype=np.int64).tobytes())
+    return h.hexdigest()
+
+
+def find_duplicate_import(file_hash=None, payload_hash=None):
+    """直前の取込と同じ内容なら、その取込指紋を返す"""
+    last = SalesImportFingerprint.objects.order_by('-id').first()
+    if last is None:
+        return None
+    if (file_hash and last.file_hash == file_hash) or (payload_hash and last.payload_hash == payload_hash):
+        return last
+    return None
+
+
+def skipped_import_result(fingerprint):
+    """重複のため書き込みを省略したときの結果"""
+    return {
+        'report_date': fingerprint.report_date,
+        'count': 0,
+        'customer_rows_count': 0,
+        'inserted': 0,
+        'updated': 0,
+        'unchanged': 0,
+        'deleted': 0,
+        'new_period': False,
+        'created_shops': 0,
+        'skipped': True,
+        'dry_run': False,
+    }
+
+
+def reset_import_fingerprints():
+    """取込指紋を破棄する（部門マスタが変わると同じファイルでも取込結果が変わるため）"""
+    SalesImportFingerprint.objects.all().delete()
+
+
+def use_streaming_reader(excel_file, streaming=None):
+    """read-only ストリーミング読込を使うか判定する（.xlsx のみ対応）"""
+    if streaming is None:
+        streaming = getattr(settings, 'SALES_IMPORT_STREAMING', True)
+    return bool(streaming) and not excel_file.name.lower().endswith('.xls')
+
+
+def get_shop_exclude_names():
+    """店舗名と見なさない名前（10部門名）。解析段階に渡すため DB から先に取得しておく"""
+    return set(Category.objects.filter(level=10).values_list('name', flat=True))
+
+
+def read_sales_workbook(excel_file, exclude_names=(), streaming=None):
+    """Excel ファイルを読み込んで parse_sales_sheet 形式の解析結果を返す（DB にはアクセスしない）"""
+    if use_streaming_reader(excel_file, streaming):
+        return read_sales_sheet_streaming(excel_file, exclude_names)
+    return parse_sales_sheet(read_sales_dataframe(excel_file), exclude_names)
+
+
+def import_sales_workbook(excel_file, batch_size=None, streaming=None, on_stage=None, force=False, dry_run=False):
+    """180部門明細シートを読み込み、SalesRecord に一括登録する。
+
+    streaming: True なら .xlsx を read-only で逐次読込（None は settings.SALES_IMPORT_STREAMING）
+    on_stage: track_stage を参照
+    force: True なら直前の取込と同じ内容でも書き込む
+    dry_run: True なら既存データとの差分件数だけを返し、書き込まない
+    返り値: write_parsed_sales の結果に各段階の所要秒数 'timings' を加えたもの
+    """
+    timings = {}
+    force = force or dry_run
+    with track_stage(timings, 'fingerprint', on_stage):
+        file_hash = file_sha256(excel_file)
+        duplicate = None if force else find_duplicate_import(file_hash=file_hash)
+    if duplicate is None:
+        with track_stage(timings, 'parse', on_stage):
+            parsed = read_sales_workbook(excel_file, get_shop_exclude_names(), streaming=streaming)
+            duplicate = None if force else find_duplicate_import(payload_hash=payload_sha256(parsed))
+
+    if duplicate is not None:
+        logger.info("Skipping sales import identical to the last one (%s)", duplicate)
+        result = skipped_import_result(duplicate)
+    else:
+        result = write_parsed_sales(
+            parsed, batch_size=batch_size, file_hash=file_hash, dry_run=dry_run, timings=timings, on_stage=on_stage
+        )
+    result['timings'] = timings
+    return result
+
+
+def import_category_master(excel_file, on_stage=None):
+    """部門マスタ(10-35-90-180階層)の一括登録
+
+    既存の Category を 1 回だけ読み込み、各階層のコードをメモリ上で重複排除してから
+    上位階層から順に一括登録・一括更新する（下位階層の親 ID を確定させるため）。
+    同じコードが複数行にある場合は、従来どおり後の行の部門名・親部門が優先される。
+    部門に変更があれば閉包テーブルを作り直し、親部門が変わった場合は売上データの階層列と
+    集計サマリーも同じトランザクションで更新する。
+
+    返り値: {'rows': 処理行数, 'levels': {階層: {'total', 'created', 'updated', 'unchanged'}}, 'timings': {...}}
+    """
+    timings = {}
+    with track_stage(timings, 'parse', on_stage):
+        df = pd.read_excel(excel_file, header=None, engine='openpyxl')
+        data = df.iloc[1:]
+        data = data[data[0].notna()]
+        rows = len(data)
+
+        # 階層ごとに {コード: (部門名, 親コード)}（後の行が優先）
+        wanted = {level: {} for level, _, _ in MASTER_LEVEL_COLUMNS}
+        for row in data.itertuples(index=False):
+            parent_code = None
+            for level, code_col, name_col in MASTER_LEVEL_COLUMNS:
+                code = int(row[code_col])
+                wanted[level][code] = (str(row[name_col]), parent_code)
+                parent_code = code
+
+    levels = {}
+    reparented = 0
+    batch_size = get_import_batch_size()
+    with transaction.atomic():
+        with track_stage(timings, 'write', on_stage):
+            existing = {}
+            for cat in Category.objects.filter(level__in=list(wanted)).order_by('id'):
+                existing.setdefault((cat.level, cat.code), cat)
+
+            parent_ids = {}
+            for level, _, _ in MASTER_LEVEL_COLUMNS:
+                created = []
+                changed = []
+                for code, (name, parent_code) in wanted[level].items():
+                    parent_id = parent_ids.get(parent_code)
+                    cat = existing.get((level, code))
+                    if cat is None:
+                        created.append(Category(code=code, level=level, name=name, parent_id=parent_id))
+                        continue
+                    # 10部門の親は取込で変更しない
+                    moved = parent_code is not None and cat.parent_id != parent_id
+                    if cat.name != name or moved:
+                        cat.name = name
+                        if moved:
+                            cat.parent_id = parent_id
+                            reparented += 1
+                        changed.append(cat)
+
+                Category.objects.bulk_create(created, batch_size=batch_size)
+                Category.objects.bulk_update(changed, ['name', 'parent'], batch_size=batch_size)
+                for cat in created:
+                    existing[(level, cat.code)] = cat
+                parent_ids = {code: existing[(level, code)].id for code in wanted[level]}
+
+                levels[level] = {
+                    'total': len(wanted[level]),
+                    'created': len(created),
+                    'updated': len(changed),
+                    'unchanged': len(wanted[level]) - len(created) - len(changed),
+                }
+
+            reset_import_fingerprints()
+
+        if any(counts['created'] or counts['updated'] for counts in levels.values()):
+            with track_stage(timings, 'hierarchy', on_stage):
+                # 閉包テーブルと部門マスタの版を更新し（各プロセスの部門ツリーが読み直される）、
+                # 親部門が変わった場合は売上データの階層列（cat10/cat35/cat90）も合わせる
+                rebuild_category_closure(batch_size)
+                if reparented:
+                    sync_sales_hierarchy(batch_size)
+        if reparented:
+            with track_stage(timings, 'summary', on_stage):
+                # 親部門が変わると上位階層への積み上げが変わるため、集計サマリーを全期間作り直す
+                rebuild_sales_summary()
+
+    return {'rows': rows, 'levels': levels, 'timings': timings}
@@ -0,0 +1,222 @@
+"""取込ジョブの登録と実行
+
+アップロードされたファイルを ImportJob としてディスクに保存し、
+リクエストとは別スレッド（または `manage.py run_import_jobs`）で登録順に処理する。
+
+ワーカープロセスの停止・再起動で実行中のまま残ったジョブは、開始から settings.IMPORT_JOB_TIMEOUT_SECONDS を
+過ぎると、次にジョブを取得するときに失敗にする (reclaim_stale_jobs)。登録したプロセスが再起動して待機中のまま
+残ったジョブは、次のアップロードで起きたワーカーが登録順に処理する（`manage.py run_import_jobs` でも処理できる）。
+進捗確認のエンドポイントはジョブを読むだけで、ワーカーを起こさない。
+アップロードされたファイルは、ジョブが完了・失敗した時点で削除する（ジョブの行と結果は残す）。
+"""
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from .caching import invalidate_after_sales_import
+from .importer import import_category_master, import_sales_workbook, track_stage
+from .models import ImportJob
+
+logger = logging.getLogger(__name__)
+
+# ジョブは登録順に 1 件ずつ処理する（SQLite の書き込みロックを奪い合わないため）
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='import-job')
+# ワーカースレッドの実行を登録済みで、まだ始まっていないか（同じプロセスで重ねて登録しない）
+_worker_queued = False
+_worker_lock = threading.Lock()
+
+STALE_JOB_MESSAGE = "エラー: 取込中にワーカーが停止したため中断しました。もう一度アップロードしてください。"
+
+
+def enqueue_import_job(kind, uploaded_file, dry_run=False):
+    """アップロードファイルを保存して ImportJob を登録する。
+
+    dry_run: True なら売上データを書き込まず、既存データとの差分件数だけを記録する
+
+    settings.IMPORT_JOBS_RUN_IN_PROCESS が True（既定）なら、コミット後に
+    プロセス内のワーカースレッドで処理を開始する。
+    """
+    job = ImportJob(kind=kind, original_name=os.path.basename(uploaded_file.name), dry_run=dry_run)
+    job.file.save(job.original_name, uploaded_file, save=False)
+    job.save()
+    if getattr(settings, 'IMPORT_JOBS_RUN_IN_PROCESS', True):
+        transaction.on_commit(_submit_worker)
+    return job
+
+
+def _job_timeout():
+    return timedelta(seconds=getattr(settings, 'IMPORT_JOB_TIMEOUT_SECONDS', 60 * 60))
+
+
+def delete_job_file(job):
+    """完了・失敗したジョブのアップロードファイルを削除する（削除できなくてもジョブの記録は続ける）。
+
+    返り値: ファイルの名前を消したか
+    """
+    if not job.file:
+        return False
+    try:
+        job.file.delete(save=False)
+    except OSError:
+        logger.warning("Could not delete the uploaded file of import job #%s", job.id, exc_info=True)
+        return False
+    return True
+
+
+def reclaim_stale_jobs():
+    """実行中のまま IMPORT_JOB_TIMEOUT_SECONDS を過ぎたジョブ（実行していたワーカーが停止したもの）を失敗にする。
+
+    取込は 1 トランザクションで書き込むため、中断したジョブのデータは残っていない。
+    取込そのものがワーカーを停止させた場合に繰り返さないよう、待機中には戻さない（アップロードファイルも削除する）。
+    返り値: 失敗にした件数
+    """
+    now = timezone.now()
+    reclaimed = 0
+    for job in ImportJob.objects.filter(status=ImportJob.STATUS_RUNNING, started_at__lt=now - _job_timeout()):
+        # 他のワーカーが同時に失敗にしていれば何もしない
+        if ImportJob.objects.filter(id=job.id, status=ImportJob.STATUS_RUNNING).update(
+            status=ImportJob.STATUS_FAILED, stage='', message=STALE_JOB_MESSAGE, finished_at=now
+        ):
+            reclaimed += 1
+            if delete_job_file(job):
+                ImportJob.objects.filter(id=job.id).update(file='')
+    if reclaimed:
+        logger.warning("Marked %s stale running import job(s) as failed", reclaimed)
+    return reclaimed
+
+
+def claim_next_job():
+    """最も古い待機中ジョブを実行中にして返す（他のワーカーが取得済みなら次を探す）。
+
+    先に、ワーカーの停止で実行中のまま残ったジョブを失敗にする。
+    """
+    reclaim_stale_jobs()
+    while True:
+        job = ImportJob.objects.filter(status=ImportJob.STATUS_PENDING).order_by('id').first()
+        if job is None:
+            return None
+        claimed = ImportJob.objects.filter(id=job.id, status=ImportJob.STATUS_PENDING).update(
+            status=ImportJob.STATUS_RUNNING, started_at=timezone.now()
+        )
+        if claimed:
+            job.refresh_from_db()
+            return job
+
+
+def run_job(job):
+    """1 件のジョブを実行し、段階ごとの所要時間と結果を記録する"""
+    def on_stage(name, timings):
+        ImportJob.objects.filter(id=job.id).update(stage=name, timings=dict(timings))
+
+    try:
+        with job.file.open('rb') as f:
+            if job.kind == ImportJob.KIND_SALES:
+                result = import_sales_workbook(f, on_stage=on_stage, dry_run=job.dry_run)
+            elif job.kind == ImportJob.KIND_MASTER:
+                result = import_category_master(f, on_stage=on_stage)
+            else:
+                raise ValueError(f"不明なジョブ種別です: {job.kind}")
+
+        timings = result.pop('timings', {})
+        if not result.get('skipped') and not result.get('dry_run'):
+            with track_stage(timings, 'cache', on_stage):
+                # データ更新後に売上キャッシュの世代を進める（重要: ダッシュボードビューが古いデータを読み込まないように）
+                # 部門マスタの取込は、部門が変わったときに部門マスタの版が更新され、すべての売上キャッシュの世代が変わる
+                if job.kind == ImportJob.KIND_SALES:
+                    # 取り込んだ年月に依存するキャッシュだけを無効にする
+                    invalidate_after_sales_import([result])
+
+        job.status = ImportJob.STATUS_DONE
+        job.timings = timings
+        job.result = {k: str(v) if k == 'report_date' else v for k, v in result.items()}
+        job.message = format_job_result(job)
+    except Exception as e:
+        logger.exception("Import job #%s failed", job.id)
+        job.refresh_from_db(fields=['timings'])
+        job.status = ImportJob.STATUS_FAILED
+        job.message = f"エラー: {e}"
+    job.stage = ''
+    job.finished_at = timezone.now()
+    delete_job_file(job)
+    job.save(update_fields=['status', 'stage', 'timings', 'result', 'message', 'finished_at', 'file'])
+    return job
+
+
+def run_pending_jobs():
+    """待機中のジョブがなくなるまで登録順に処理する。返り値: 処理件数"""
+    processed = 0
+    while True:
+        job = claim_next_job()
+        if job is None:
+            return processed
+        run_job(job)
+        processed += 1
+
+
+def _submit_worker():
+    global _worker_queued
+    with _worker_lock:
+        if _worker_queued:
+            return
+        _worker_queued = True
+    _executor.submit(_run_pending_jobs_in_thread)
+
+
+def _run_pending_jobs_in_thread():
+    global _worker_queued
+    with _worker_lock:
+        # ここから後に登録されたジョブのためには、もう一度スレッドを登録させる
+        _worker_queued = False
+    close_old_connections()
+    try:
+        run_pending_jobs()
+    except Exception:
+        logger.exception("Import worker thread failed")
+    finally:
+        close_old_connections()
+
+
+def format_job_result(job):
+    """完了したジョブの結果を管理画面向けのメッセージにする"""
+    r = job.result
+    if job.kind == ImportJob.KIND_SALES:
+        if r.get('skipped'):
+            return f"{r.get('report_date')} のデータは前回の取込と同一内容のため、取込をスキップしました。"
+        diff = (
+            f"新規:{r.get('inserted')}件・更新:{r.get('updated')}件・変更なし:{r.get('unchanged')}件"
+            f"・削除:{r.get('deleted')}件"
+        )
+        if r.get('dry_run'):
+            return f"{r.get('report_date')} の差分確認（書き込みなし）: 合計{r.get('count')}行 / {diff}"
+        return (
+            f"{r.get('report_date')} のデータ取り込み完了！(合計{r.get('count')}行 / うち客数行:{r.get('customer_rows_count')}"
+            f" / {diff})"
+        )
+    levels = " / ".join(
+        f"{level}部門 新規:{c['created']}件・更新:{c['updated']}件" for level, c in r.get('levels', {}).items()
+    )
+    return f"部門マスタの取り込みが完了しました！({r.get('rows')}行" + (f" / {levels})" if levels else ")")
+
+
+def job_status_payload(job):
+    """進捗確認エンドポイント用の JSON を作る"""
+    return {
+        'id': job.id,
+        'kind': job.kind,
+        'status': job.status,
+        'status_display': job.get_status_display(),
+        'stage': job.stage,
+        'file': job.original_name,
+        'timings': job.timings,
+        'result': job.result,
+        'message': job.message,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'started_at': job.started_at.isoformat() if job.started_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+    }
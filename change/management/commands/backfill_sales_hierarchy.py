@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from change.caching import clear_sales_caches
+from change.hierarchy import rebuild_category_closure, sync_sales_hierarchy
+
+
+class Command(BaseCommand):
+    help = ('Rebuild the category closure table and fill the denormalized cat10/cat35/cat90 columns of SalesRecord '
+            'from the category master. Run once after migrating, or after editing category parents outside the '
+            'master import. Only rows whose columns differ from the master are updated.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Category ids per UPDATE statement')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            # 閉包テーブルを作り直すと部門マスタの版が変わり、すべての売上キャッシュも作り直される
+            rebuild_category_closure(options['batch_size'])
+            updated = sync_sales_hierarchy(options['batch_size'])
+        if updated:
+            clear_sales_caches()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt the category closure; updated hierarchy columns on {updated} sales row(s).'))
@@ -0,0 +1,43 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from change.benchmark import run_import_benchmark
+
+
+class Command(BaseCommand):
+    help = ('Benchmark the upload import pipeline on generated 180部門明細 workbooks against a scratch SQLite DB '
+            'and write rows/sec, query counts, peak memory and stage timings to JSON')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--shops', type=int, default=40, help='Shops per workbook')
+        parser.add_argument('--days', type=int, default=5, help='Consecutive daily workbooks to import')
+        parser.add_argument('--n10', type=int, default=10, help='Top-level (10部門) categories; each has 18 180部門 codes')
+        parser.add_argument('--change-ratio', type=float, default=0.2, help='Share of cells that change from one day to the next')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--no-memory', action='store_true', help='Skip the second, tracemalloc-enabled pass that measures peak memory')
+        parser.add_argument('--label', default='', help='Free-form label stored in the report (e.g. release tag)')
+        parser.add_argument('--output', default='import_benchmark.json', help='JSON report path ("-" for stdout only)')
+
+    def handle(self, *args, **options):
+        report = run_import_benchmark(
+            shops=options['shops'], days=options['days'], n10=options['n10'],
+            change_ratio=options['change_ratio'], seed=options['seed'], trace_memory=not options['no_memory'],
+        )
+        report['label'] = options['label']
+
+        for run in report['runs']:
+            stages = ' '.join(f'{k}={v:.3f}s' for k, v in run['timings'].items())
+            peak = run['peak_memory_bytes']
+            self.stdout.write(
+                f"{run['scenario']:<9} {run['file']:<22} rows={run['rows']:<6} {run['seconds']:.3f}s "
+                f"{run['rows_per_sec'] or 0:.0f} rows/s queries={run['queries']} "
+                f"peak={'-' if peak is None else f'{peak / 1024 / 1024:.1f}MiB'} {stages}"
+            )
+
+        if options['output'] == '-':
+            self.stdout.write(json.dumps(report, ensure_ascii=False, indent=2))
+            return
+        with open(options['output'], 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        self.stdout.write(self.style.SUCCESS(f"Wrote {options['output']}"))
@@ -1,16 +1,41 @@
-from django.core.management.base import BaseCommand
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
 from django.core.cache import cache
 
+from change.caching import clear_sales_caches, invalidate_sales_caches
+
 
 class Command(BaseCommand):
-    help = 'Clear sales-related caches (salesrecord_all_dates and dashboard caches)'
+    help = ('Invalidate sales-related caches (the date list, period index and dashboard caches) by advancing '
+            'their generation. With --year/--month only the caches depending on that period are invalidated.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--year', type=int, help='Only invalidate caches depending on this year (requires --month)')
+        parser.add_argument('--month', type=int, help='Only invalidate caches depending on this month (requires --year)')
+        parser.add_argument('--all', action='store_true', help='Clear the whole cache, not only invalidate the sales caches')
+        parser.add_argument('--warm', action='store_true', help='Run warm_sales_cache afterwards')
+        parser.add_argument('--warm-http', action='store_true',
+                            help='Run warm_sales_cache --http afterwards (warms the running site)')
 
     def handle(self, *args, **options):
-        self.stdout.write('Clearing sales-related caches...')
+        if bool(options['year']) != bool(options['month']):
+            raise CommandError('--year and --month must be given together.')
+        self.stdout.write('Invalidating sales-related caches...')
         try:
-            cache.delete('salesrecord_all_dates')
-            # If you use more specific keys, delete them here.
-            cache.clear()
-            self.stdout.write(self.style.SUCCESS('Caches cleared.'))
+            if options['all']:
+                cache.clear()
+                self.stdout.write(self.style.SUCCESS('All caches cleared.'))
+            elif options['year']:
+                bumped = invalidate_sales_caches([(options['year'], options['month'])])
+                self.stdout.write(self.style.SUCCESS(
+                    f"Invalidated sales caches for {options['year']}-{options['month']:02d} ({bumped} generation(s) advanced)."
+                ))
+            else:
+                clear_sales_caches()
+                self.stdout.write(self.style.SUCCESS('Invalidated all sales caches.'))
         except Exception as e:
-            self.stderr.write(f'Error clearing caches: {e}')
\ No newline at end of file
+            self.stderr.write(f'Error clearing caches: {e}')
+            return
+        if options['warm'] or options['warm_http']:
+            call_command('warm_sales_cache', http=options['warm_http'], verbosity=options['verbosity'],
+                         stdout=self.stdout, stderr=self.stderr)
@@ -0,0 +1,129 @@
+import io
+import os
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+
+from change.caching import invalidate_after_sales_import
+from change.importer import (
+    file_sha256, find_duplicate_import, get_shop_exclude_names, payload_sha256, read_sales_workbook,
+    write_parsed_sales,
+)
+
+EXCEL_EXTENSIONS = ('.xlsx', '.xls')
+
+
+def _is_workbook_name(name):
+    base = os.path.basename(name)
+    return base.lower().endswith(EXCEL_EXTENSIONS) and not base.startswith('~$')
+
+
+def collect_sources(paths):
+    """ファイル・ディレクトリ・zip を展開して [(表示名, 読込元), ...] を返す。
+
+    読込元はファイルパス、または (zip パス, メンバー名) のタプル。
+    """
+    sources = []
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                full = os.path.join(path, name)
+                if os.path.isfile(full) and _is_workbook_name(name):
+                    sources.append((full, full))
+        elif zipfile.is_zipfile(path):
+            with zipfile.ZipFile(path) as zf:
+                for member in sorted(zf.namelist()):
+                    if not member.endswith('/') and _is_workbook_name(member):
+                        sources.append((f'{path}:{member}', (path, member)))
+        elif os.path.isfile(path):
+            sources.append((path, path))
+        else:
+            raise CommandError(f'File not found: {path}')
+    return sources
+
+
+def parse_source(source, exclude_names, streaming=None):
+    """ワーカープロセスで 1 ファイルを解析する（DB にはアクセスしない）。
+
+    返り値: (ファイルの SHA-256, 解析結果)
+    """
+    if isinstance(source, tuple):
+        zip_path, member = source
+        with zipfile.ZipFile(zip_path) as zf:
+            f = io.BytesIO(zf.read(member))
+        f.name = member
+        return file_sha256(f), read_sales_workbook(f, exclude_names, streaming=streaming)
+    with open(source, 'rb') as f:
+        return file_sha256(f), read_sales_workbook(f, exclude_names, streaming=streaming)
+
+
+class Command(BaseCommand):
+    help = ('Import 180部門明細 sales workbooks from files, directories or zip archives. '
+            'Workbooks are parsed in parallel and written serially in report-date order.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='*', help='Workbook files, directories or zip archives')
+        parser.add_argument('--file', action='append', default=[], dest='files', help='Workbook, directory or zip archive (repeatable)')
+        parser.add_argument('--workers', type=int, default=None, help='Parser processes (default: CPU count)')
+        parser.add_argument('--batch-size', type=int, default=None, help='Rows per upsert statement (default: SALES_IMPORT_BATCH_SIZE)')
+        parser.add_argument('--no-clear-cache', action='store_true', help='Do not invalidate sales caches after the import')
+        parser.add_argument('--force', action='store_true', help='Write workbooks even if identical to the last import')
+        parser.add_argument('--dry-run', action='store_true', help='Only report insert/update/delete counts against stored rows')
+
+    def handle(self, *args, **options):
+        sources = collect_sources(options['paths'] + options['files'])
+        if not sources:
+            raise CommandError('No workbooks to import.')
+        self.stdout.write(f'Parsing {len(sources)} workbook(s)...')
+
+        started = time.perf_counter()
+        exclude_names = get_shop_exclude_names()
+        parsed_files = []
+        failures = []
+        workers = min(options['workers'] or os.cpu_count() or 1, len(sources))
+        with ProcessPoolExecutor(max_workers=workers, initializer=django.setup) as pool:
+            futures = [(label, pool.submit(parse_source, source, exclude_names)) for label, source in sources]
+            for label, future in futures:
+                try:
+                    parsed_files.append((label, future.result()))
+                except Exception as e:
+                    failures.append(label)
+                    self.stderr.write(f'{label}: parse failed: {e}')
+        parse_seconds = time.perf_counter() - started
+
+        # 累計データのため、古い報告日から順に 1 ファイル 1 トランザクションで書き込む
+        parsed_files.sort(key=lambda item: item[1][1]['report_date'])
+        written = []
+        for label, (file_hash, parsed) in parsed_files:
+            try:
+                t = time.perf_counter()
+                if not (options['force'] or options['dry_run']) and find_duplicate_import(file_hash=file_hash, payload_hash=payload_sha256(parsed)):
+                    self.stdout.write(f"{parsed['report_date']} {label}: skipped (identical to the last import)")
+                    continue
+                result = write_parsed_sales(
+                    parsed, batch_size=options['batch_size'], file_hash=file_hash, dry_run=options['dry_run']
+                )
+                written.append(result)
+                self.stdout.write(
+                    f"{result['report_date']} {label}: rows={result['count']} inserted={result['inserted']} "
+                    f"updated={result['updated']} unchanged={result['unchanged']} deleted={result['deleted']}"
+                    f"{' (dry run)' if options['dry_run'] else ''} ({time.perf_counter() - t:.2f}s)"
+                )
+            except Exception as e:
+                failures.append(label)
+                self.stderr.write(f'{label}: write failed: {e}')
+
+        if not options['no_clear_cache'] and written:
+            scope = invalidate_after_sales_import(written)
+            if scope == 'all':
+                self.stdout.write('Invalidated all sales caches (new period or shop).')
+            elif scope:
+                self.stdout.write('Invalidated sales caches for the imported months.')
+
+        self.stdout.write(f'Parsed in {parse_seconds:.2f}s, total {time.perf_counter() - started:.2f}s.')
+        if failures:
+            raise CommandError(f'{len(failures)} of {len(sources)} workbook(s) failed.')
+        self.stdout.write(self.style.SUCCESS(f'Imported {len(sources)} workbook(s).'))
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from change.caching import clear_sales_caches, invalidate_sales_caches
+from change.models import DataVersion
+from change.summary import rebuild_sales_summary
+from change.versions import bump_data_version
+
+
+class Command(BaseCommand):
+    help = ('Rebuild the SalesSummary table (latest snapshot of the month for each shop, per shop × category) from SalesRecord. '
+            'Run once after migrating to backfill existing data. With --year/--month only that month is rebuilt.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--year', type=int, help='Only rebuild this year (requires --month)')
+        parser.add_argument('--month', type=int, help='Only rebuild this month (requires --year)')
+
+    def handle(self, *args, **options):
+        if bool(options['year']) != bool(options['month']):
+            raise CommandError('--year and --month must be given together.')
+        periods = [(options['year'], options['month'])] if options['year'] else None
+        with transaction.atomic():
+            created = rebuild_sales_summary(periods)
+            # 売上キューブは集計サマリーから読み込むため、各プロセスに読み直させる
+            bump_data_version(DataVersion.SALES)
+        if periods:
+            invalidate_sales_caches(periods)
+        else:
+            clear_sales_caches()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt sales summary: {created} row(s).'))
@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from change.jobs import run_pending_jobs
+
+
+class Command(BaseCommand):
+    help = 'Process pending import jobs (uploaded sales/master workbooks) in the order they were queued'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='Keep polling for new jobs instead of exiting when the queue is empty')
+        parser.add_argument('--interval', type=float, default=5.0, help='Seconds to wait between polls in --loop mode')
+
+    def handle(self, *args, **options):
+        while True:
+            processed = run_pending_jobs()
+            if processed:
+                self.stdout.write(self.style.SUCCESS(f'Processed {processed} import job(s).'))
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,135 @@
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode, urlsplit
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.urls import reverse
+
+from change.models import Category
+from change.summary import period_index
+
+
+def report_urls():
+    """ウォームアップするページの一覧 [(ビュー名, パス), ...]。
+
+    年・月・部門の選択肢はデータから作り、各画面のフォームやリンクが作る URL と同じ形にする
+    （ページ全体をキャッシュする画面は URL ごとにキャッシュされるため）。
+    """
+    index = period_index()
+    years = sorted({year for year, month in index})
+    months = sorted({month for year, month in index if month is not None})
+    depts = list(Category.objects.filter(level=10).order_by('code').values_list('id', 'code'))
+
+    def url(name, **params):
+        return reverse(name) + (f'?{urlencode(params)}' if params else '')
+
+    urls = []
+    # 部門ランキング: 年 × その年の月 × (全部門 + 10部門のドリルダウン)
+    for year in years:
+        for month in sorted(m for y, m in index if y == year and m is not None):
+            urls.append(('dashboard', url('dashboard', year=year, month=month)))
+            urls += [('dashboard', url('dashboard', year=year, month=month, parent_id=dept_id)) for dept_id, _ in depts]
+    # 推移: 全て（未指定・空）と各月
+    urls += [('trends', url('trends')), ('trends', url('trends', month=''))]
+    urls += [('trends', url('trends', month=m)) for m in months]
+    # 店舗ランキング: (全店合計 + 10部門) × (合計 + 各月)
+    urls.append(('shop_ranking', url('shop_ranking')))
+    for code in [''] + [str(code) for _, code in depts]:
+        for month in ['total'] + [str(m) for m in months]:
+            urls.append(('shop_ranking', url('shop_ranking', dept_code=code, month=month)))
+    # 粗利ランキング: 合計 + 各月
+    urls += [('profit_ranking', url('profit_ranking'))]
+    urls += [('profit_ranking', url('profit_ranking', month=m)) for m in ['total'] + [str(m) for m in months]]
+    return urls
+
+
+class Command(BaseCommand):
+    help = ('Warm the sales report caches (dashboard, trends, shop and profit rankings) for every year, month '
+            'and 10部門 found in the data. Run after an import or clear_sales_cache so the first visitors '
+            'do not pay the cold cost.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help='Number of pages rendered in parallel')
+        parser.add_argument('--base-url', default=getattr(settings, 'SALES_CACHE_WARM_BASE_URL', 'http://localhost'),
+                            help='Site URL; its host and scheme are part of the page cache keys')
+        parser.add_argument('--http', action='store_true',
+                            help='Request the pages from the running site at --base-url instead of rendering them '
+                                 'in this process (needed when the cache backend is per process, e.g. LocMemCache)')
+        parser.add_argument('--timeout', type=float, default=120.0, help='Seconds to wait for each page in --http mode')
+
+    def handle(self, *args, **options):
+        if options['workers'] < 1:
+            raise CommandError('--workers must be at least 1.')
+        base = urlsplit(options['base_url'])
+        if base.scheme not in ('http', 'https') or not base.netloc:
+            raise CommandError(f"Invalid --base-url: {options['base_url']}")
+        backend = settings.CACHES['default']['BACKEND']
+        if not options['http'] and backend.endswith('LocMemCache'):
+            self.stdout.write(self.style.WARNING(
+                'The cache backend is per process (LocMemCache); pages warmed here are not seen by the web '
+                'workers. Use --http to warm the running site.'
+            ))
+
+        urls = report_urls()
+        self.stdout.write(f"Warming {len(urls)} page(s) with {options['workers']} worker(s)...")
+
+        if options['http']:
+            root = options['base_url'].rstrip('/')
+
+            def fetch(path):
+                with urllib.request.urlopen(root + path, timeout=options['timeout']) as response:
+                    response.read()
+                    return response.status
+        else:
+            def fetch(path):
+                try:
+                    response = Client().get(path, HTTP_HOST=base.netloc, secure=base.scheme == 'https')
+                    return response.status_code
+                finally:
+                    # ワーカースレッドごとの DB 接続を閉じる
+                    connection.close()
+
+        def warm(item):
+            name, path = item
+            started = time.perf_counter()
+            try:
+                status, error = fetch(path), None
+            except Exception as e:
+                status, error = None, e
+            return name, path, status, error, time.perf_counter() - started
+
+        started = time.perf_counter()
+        timings = {}
+        failures = 0
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            for name, path, status, error, seconds in executor.map(warm, urls):
+                stats = timings.setdefault(name, {'pages': 0, 'total': 0.0, 'max': 0.0})
+                stats['pages'] += 1
+                stats['total'] += seconds
+                stats['max'] = max(stats['max'], seconds)
+                if error is not None or status != 200:
+                    failures += 1
+                    self.stderr.write(f'{path}: {error or f"HTTP {status}"}')
+                elif options['verbosity'] >= 2:
+                    self.stdout.write(f'{path} ({seconds:.2f}s)')
+
+        for name, stats in timings.items():
+            self.stdout.write(
+                f"{name}: {stats['pages']} page(s), total {stats['total']:.2f}s, "
+                f"slowest {stats['max']:.2f}s"
+            )
+        self.stdout.write(f'Finished in {time.perf_counter() - started:.2f}s.')
+        if not options['http'] and hasattr(cache, 'stats'):
+            stats = cache.stats()
+            self.stdout.write(
+                f"Cache: local {stats['local']['hits']} hit(s) / {stats['local']['misses']} miss(es), "
+                f"shared {stats['shared']['hits']} hit(s) / {stats['shared']['misses']} miss(es)"
+            )
+        if failures:
+            raise CommandError(f'{failures} of {len(urls)} page(s) failed.')
+        self.stdout.write(self.style.SUCCESS(f'Warmed {len(urls)} page(s).'))
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.8 on 2026-10-17 01:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('change', '0005_alter_salessummary_unique_together_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('sales', '売上データ'), ('master', '部門マスタ')], max_length=20, verbose_name='種別')),
+                ('status', models.CharField(choices=[('pending', '待機中'), ('running', '実行中'), ('done', '完了'), ('failed', '失敗')], db_index=True, default='pending', max_length=20, verbose_name='状態')),
+                ('file', models.FileField(upload_to='imports/%Y/%m/', verbose_name='取込ファイル')),
+                ('original_name', models.CharField(blank=True, max_length=255, verbose_name='元ファイル名')),
+                ('stage', models.CharField(blank=True, max_length=50, verbose_name='処理段階')),
+                ('timings', models.JSONField(blank=True, default=dict, verbose_name='段階ごとの所要秒数')),
+                ('result', models.JSONField(blank=True, default=dict, verbose_name='取込結果')),
+                ('message', models.TextField(blank=True, verbose_name='メッセージ')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='登録日時')),
+                ('started_at', models.DateTimeField(blank=True, null=True, verbose_name='開始日時')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='終了日時')),
+            ],
+            options={
+                'verbose_name': '取込ジョブ',
+                'verbose_name_plural': '取込ジョブ',
+                'ordering': ['-id'],
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.8 on 2026-10-17 01:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('change', '0006_importjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SalesImportFingerprint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('report_date', models.DateField(verbose_name='計上年月日')),
+                ('shops', models.JSONField(default=list, verbose_name='店舗名')),
+                ('file_hash', models.CharField(db_index=True, max_length=64, verbose_name='ファイルのハッシュ')),
+                ('payload_hash', models.CharField(db_index=True, max_length=64, verbose_name='解析結果のハッシュ')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='取込日時')),
+            ],
+            options={
+                'verbose_name': '売上取込指紋',
+                'verbose_name_plural': '売上取込指紋',
+                'ordering': ['-id'],
+            },
+        ),
+    ]
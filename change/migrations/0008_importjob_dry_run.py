@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-17 01:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('change', '0007_salesimportfingerprint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importjob',
+            name='dry_run',
+            field=models.BooleanField(default=False, verbose_name='差分の確認のみ'),
+        ),
+    ]
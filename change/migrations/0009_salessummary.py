@@ -0,0 +1,37 @@
+# Generated by Django 5.2.8 on 2026-10-17 01:18
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('change', '0008_importjob_dry_run'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SalesSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.IntegerField(verbose_name='年')),
+                ('month', models.IntegerField(verbose_name='月')),
+                ('date', models.DateField(verbose_name='スナップショット日')),
+                ('level', models.IntegerField(verbose_name='階層レベル')),
+                ('amount_sales', models.BigIntegerField(default=0, verbose_name='売上金額')),
+                ('amount_profit', models.BigIntegerField(default=0, verbose_name='粗利金額')),
+                ('amount_purchase', models.BigIntegerField(default=0, verbose_name='買取金額')),
+                ('amount_supply', models.BigIntegerField(default=0, verbose_name='仕入金額')),
+                ('amount_net', models.BigIntegerField(default=0, verbose_name='ネット金額')),
+                ('category', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='summaries', to='change.category', verbose_name='部門')),
+                ('shop', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='change.shop', verbose_name='店舗')),
+            ],
+            options={
+                'verbose_name': '売上集計サマリー',
+                'verbose_name_plural': '売上集計サマリー',
+                'indexes': [models.Index(fields=['year', 'month', 'level'], name='change_sale_year_5dd591_idx')],
+                'unique_together': {('year', 'month', 'shop', 'category')},
+            },
+        ),
+    ]
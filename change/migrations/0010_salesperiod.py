@@ -0,0 +1,30 @@
+# Generated by Django 5.2.8 on 2026-10-17 01:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('change', '0009_salessummary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SalesPeriod',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.IntegerField(verbose_name='年')),
+                ('month', models.IntegerField(blank=True, null=True, verbose_name='月')),
+                ('snapshot_date', models.DateField(verbose_name='スナップショット日')),
+                ('shop_count', models.IntegerField(default=0, verbose_name='店舗数')),
+                ('has_sales', models.BooleanField(default=False, verbose_name='客数以外のデータあり')),
+            ],
+            options={
+                'verbose_name': '売上期間',
+                'verbose_name_plural': '売上期間',
+                'ordering': ['year', 'month'],
+                'unique_together': {('year', 'month')},
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.8 on 2026-10-17 01:24
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('change', '0010_salesperiod'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='salesrecord',
+            name='cat10',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='change.category', verbose_name='10部門'),
+        ),
+        migrations.AddField(
+            model_name='salesrecord',
+            name='cat35',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='change.category', verbose_name='35部門'),
+        ),
+        migrations.AddField(
+            model_name='salesrecord',
+            name='cat90',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='change.category', verbose_name='90部門'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.8 on 2026-10-17 01:26
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('change', '0011_salesrecord_hierarchy'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DataVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True, verbose_name='名前')),
+                ('version', models.CharField(max_length=32, verbose_name='版')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新日時')),
+            ],
+            options={
+                'verbose_name': 'データの版',
+                'verbose_name_plural': 'データの版',
+            },
+        ),
+        migrations.CreateModel(
+            name='CategoryClosure',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('depth', models.IntegerField(verbose_name='階層差')),
+                ('ancestor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='descendant_links', to='change.category', verbose_name='祖先部門')),
+                ('descendant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ancestor_links', to='change.category', verbose_name='子孫部門')),
+            ],
+            options={
+                'verbose_name': '部門階層',
+                'verbose_name_plural': '部門階層',
+                'indexes': [models.Index(fields=['descendant', 'depth'], name='change_cate_descend_48a5b4_idx')],
+                'unique_together': {('ancestor', 'descendant')},
+            },
+        ),
+    ]
@@ -0,0 +1,87 @@
+# Generated by Django 5.2.8 on 2026-10-17 01:45
+
+import uuid
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+CUSTOMER_COUNT_CODE = 9999
+BATCH_SIZE = 500
+
+
+def bump_versions(DataVersion):
+    # 部門マスタと売上データが変わったため、プロセス内の部門ツリー・売上キューブを読み直させる
+    for name in ('category_master', 'sales'):
+        DataVersion.objects.update_or_create(name=name, defaults={'version': uuid.uuid4().hex})
+
+
+def move_customer_counts(apps, schema_editor):
+    """客数部門(9999)の SalesRecord を CustomerCount に移し、客数部門を削除する"""
+    Category = apps.get_model('change', 'Category')
+    CustomerCount = apps.get_model('change', 'CustomerCount')
+    DataVersion = apps.get_model('change', 'DataVersion')
+    SalesRecord = apps.get_model('change', 'SalesRecord')
+
+    customer_categories = Category.objects.filter(code=CUSTOMER_COUNT_CODE, level=10)
+    if not customer_categories.exists():
+        return
+    counts = {}
+    rows = (SalesRecord.objects.filter(category__in=customer_categories)
+            .order_by('id').values_list('shop_id', 'date', 'amount_sales'))
+    for shop_id, day, value in rows.iterator():
+        counts[(shop_id, day)] = value
+    CustomerCount.objects.bulk_create(
+        [CustomerCount(shop_id=shop_id, date=day, count=value) for (shop_id, day), value in counts.items()],
+        batch_size=BATCH_SIZE,
+    )
+    # 客数部門の売上データ・集計サマリー・部門階層は CASCADE で一緒に削除される
+    customer_categories.delete()
+    bump_versions(DataVersion)
+
+
+def restore_customer_counts(apps, schema_editor):
+    """CustomerCount を客数部門(9999)の SalesRecord に戻す（集計サマリーは rebuild_sales_summary で作り直す）"""
+    Category = apps.get_model('change', 'Category')
+    CategoryClosure = apps.get_model('change', 'CategoryClosure')
+    CustomerCount = apps.get_model('change', 'CustomerCount')
+    DataVersion = apps.get_model('change', 'DataVersion')
+    SalesRecord = apps.get_model('change', 'SalesRecord')
+
+    if not CustomerCount.objects.exists():
+        return
+    category, _ = Category.objects.get_or_create(code=CUSTOMER_COUNT_CODE, level=10, defaults={'name': '客数'})
+    CategoryClosure.objects.get_or_create(ancestor=category, descendant=category, defaults={'depth': 0})
+    SalesRecord.objects.bulk_create(
+        [SalesRecord(shop_id=shop_id, category=category, cat10=category, date=day, amount_sales=value)
+         for shop_id, day, value in CustomerCount.objects.values_list('shop_id', 'date', 'count').iterator()],
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+    bump_versions(DataVersion)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('change', '0012_categoryclosure'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CustomerCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='計上年月日')),
+                ('count', models.IntegerField(default=0, verbose_name='客数')),
+                ('shop', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='change.shop', verbose_name='店舗')),
+            ],
+            options={
+                'verbose_name': '客数',
+                'verbose_name_plural': '客数',
+                'ordering': ['-date', 'shop'],
+                'indexes': [models.Index(fields=['date'], name='change_cust_date_05fe68_idx')],
+                'unique_together': {('shop', 'date')},
+            },
+        ),
+        migrations.RunPython(move_customer_counts, restore_customer_counts),
+    ]
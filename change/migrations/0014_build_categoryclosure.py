@@ -0,0 +1,37 @@
+import uuid
+
+from django.db import migrations
+
+BATCH_SIZE = 500
+
+
+def build_category_closure(apps, schema_editor):
+    """既存の部門マスタから CategoryClosure を作り、部門マスタの版を設定する（初回参照時に作らないように）"""
+    Category = apps.get_model('change', 'Category')
+    CategoryClosure = apps.get_model('change', 'CategoryClosure')
+    DataVersion = apps.get_model('change', 'DataVersion')
+
+    parents = dict(Category.objects.values_list('id', 'parent_id'))
+    rows = []
+    for cid in parents:
+        # 自身から親をたどる（循環は打ち切る）
+        seen = set()
+        current, depth = cid, 0
+        while current is not None and current in parents and current not in seen:
+            seen.add(current)
+            rows.append(CategoryClosure(ancestor_id=current, descendant_id=cid, depth=depth))
+            current, depth = parents[current], depth + 1
+    CategoryClosure.objects.all().delete()
+    CategoryClosure.objects.bulk_create(rows, batch_size=BATCH_SIZE)
+    DataVersion.objects.update_or_create(name='category_master', defaults={'version': uuid.uuid4().hex})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('change', '0013_customercount'),
+    ]
+
+    operations = [
+        migrations.RunPython(build_category_closure, migrations.RunPython.noop),
+    ]
@@ -48,6 +48,54 @@ class Category(models.Model):
         unique_together = (('code', 'level'),) 
 
 
+class CategoryClosure(models.Model):
+    """
+    部門階層の閉包テーブル（祖先 × 子孫。自身も depth=0 で含む）
+
+    部門マスタの取込時に作り直す。
+    """
+    ancestor = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='descendant_links', verbose_name="祖先部門")
+    descendant = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='ancestor_links', verbose_name="子孫部門")
+    depth = models.IntegerField("階層差")
+
+    def __str__(self):
+        return f"{self.ancestor_id} -> {self.descendant_id} ({self.depth})"
+
+    class Meta:
+        verbose_name = "部門階層"
+        verbose_name_plural = "部門階層"
+        unique_together = ('ancestor', 'descendant')
+        indexes = [
+            models.Index(fields=['descendant', 'depth']),
+        ]
+
+
+class DataVersion(models.Model):
+    """
+    データの版（部門マスタなどが変わるたびに新しい値に置き換える）
+
+    プロセス内キャッシュは、保持している版と一致しなくなったら作り直す。
+    連番ではなく毎回新しい乱数値にするため、ロールバック後に同じ版が再利用されることはない。
+    """
+    CATEGORY_MASTER = 'category_master'
+    SALES = 'sales'
+    # 売上キャッシュ全体の版（期間ごとの版は 'sales_cache:{期間タグ}'、change.caching を参照）
+    SALES_CACHE = 'sales_cache'
+    # 年・月・店舗の選択肢の版（新しい年月・店舗の取込で更新する）
+    SALES_CHOICES = 'sales_choices'
+
+    name = models.CharField("名前", max_length=50, unique=True)
+    version = models.CharField("版", max_length=32)
+    updated_at = models.DateTimeField("更新日時", auto_now=True)
+
+    def __str__(self):
+        return f"{self.name}: {self.version}"
+
+    class Meta:
+        verbose_name = "データの版"
+        verbose_name_plural = "データの版"
+
+
 class SalesRecord(models.Model):
     """
     売上実績データ
@@ -65,6 +113,22 @@ class SalesRecord(models.Model):
     amount_supply = models.IntegerField("仕入金額", default=0)  # 仕入
     amount_net = models.IntegerField("ネット金額", default=0)  # ネット
 
+    # 部門階層の非正規化列（自身を含む各階層の祖先。change.hierarchy で取込・マスタ更新時に同期する）
+    cat10 = models.ForeignKey(
+        Category, on_delete=models.SET_NULL, null=True, blank=True, related_name='+', verbose_name="10部門"
+    )
+    cat35 = models.ForeignKey(
+        Category, on_delete=models.SET_NULL, null=True, blank=True, related_name='+', verbose_name="35部門"
+    )
+    cat90 = models.ForeignKey(
+        Category, on_delete=models.SET_NULL, null=True, blank=True, related_name='+', verbose_name="90部門"
+    )
+
+    # 店舗ごとの 5 列ブロック（販売/買取/仕入/ネット/粗利）に対応するフィールド
+    METRIC_FIELDS = ('amount_sales', 'amount_purchase', 'amount_supply', 'amount_net', 'amount_profit')
+    # 階層レベル -> 非正規化列
+    HIERARCHY_FIELDS = {10: 'cat10', 35: 'cat35', 90: 'cat90'}
+
     def __str__(self):
         return f"{self.date} - {self.shop.name} - {self.category.name}"
 
@@ -82,4 +146,150 @@ class SalesRecord(models.Model):
             models.Index(fields=['shop', '-date']), 
             # カテゴリと日付のクエリを高速化
             models.Index(fields=['category', '-date']),
-        ]
\ No newline at end of file
+        ]
+
+
+class CustomerCount(models.Model):
+    """
+    客数（店舗 × 日付）
+
+    売上データの部門とは別に持ち、部門別の集計に客数が混ざらないようにする。
+    """
+    date = models.DateField("計上年月日")
+    shop = models.ForeignKey(Shop, on_delete=models.CASCADE, verbose_name="店舗")
+    count = models.IntegerField("客数", default=0)
+
+    def __str__(self):
+        return f"{self.date} - {self.shop.name} - {self.count}"
+
+    class Meta:
+        verbose_name = "客数"
+        verbose_name_plural = "客数"
+        unique_together = ('shop', 'date')
+        ordering = ['-date', 'shop']
+        indexes = [
+            models.Index(fields=['date']),
+        ]
+
+
+class ImportJob(models.Model):
+    """
+    取込ジョブ（アップロードされた Excel をバックグラウンドで取り込む）
+    """
+    KIND_SALES = 'sales'
+    KIND_MASTER = 'master'
+    KIND_CHOICES = (
+        (KIND_SALES, '売上データ'),
+        (KIND_MASTER, '部門マスタ'),
+    )
+
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = (
+        (STATUS_PENDING, '待機中'),
+        (STATUS_RUNNING, '実行中'),
+        (STATUS_DONE, '完了'),
+        (STATUS_FAILED, '失敗'),
+    )
+
+    kind = models.CharField("種別", max_length=20, choices=KIND_CHOICES)
+    status = models.CharField("状態", max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDING, db_index=True)
+    file = models.FileField("取込ファイル", upload_to='imports/%Y/%m/')
+    original_name = models.CharField("元ファイル名", max_length=255, blank=True)
+    dry_run = models.BooleanField("差分の確認のみ", default=False)
+
+    stage = models.CharField("処理段階", max_length=50, blank=True)
+    timings = models.JSONField("段階ごとの所要秒数", default=dict, blank=True)
+    result = models.JSONField("取込結果", default=dict, blank=True)
+    message = models.TextField("メッセージ", blank=True)
+
+    created_at = models.DateTimeField("登録日時", auto_now_add=True)
+    started_at = models.DateTimeField("開始日時", null=True, blank=True)
+    finished_at = models.DateTimeField("終了日時", null=True, blank=True)
+
+    def __str__(self):
+        return f"#{self.id} {self.get_kind_display()} {self.original_name} ({self.get_status_display()})"
+
+    class Meta:
+        verbose_name = "取込ジョブ"
+        verbose_name_plural = "取込ジョブ"
+        ordering = ['-id']
+
+
+class SalesImportFingerprint(models.Model):
+    """
+    取込済み売上ファイルの指紋（同じ内容の再アップロードをスキップするため）
+    """
+    report_date = models.DateField("計上年月日")
+    shops = models.JSONField("店舗名", default=list)
+    file_hash = models.CharField("ファイルのハッシュ", max_length=64, db_index=True)
+    payload_hash = models.CharField("解析結果のハッシュ", max_length=64, db_index=True)
+    created_at = models.DateTimeField("取込日時", auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.report_date} ({len(self.shops)}店舗) {self.payload_hash[:12]}"
+
+    class Meta:
+        verbose_name = "売上取込指紋"
+        verbose_name_plural = "売上取込指紋"
+        ordering = ['-id']
+
+
+class SalesSummary(models.Model):
+    """
+    売上集計サマリー（年月ごとに、店舗ごとの月内最終日のスナップショットを店舗 × 部門で集計したもの）
+
+    10/35/90/180 の各階層の部門ごとに 1 行を持つ。category が空の行（level=0）は
+    客数を除く全部門の合計。売上取込時に取込んだ年月の分を作り直す。
+    """
+    LEVEL_TOTAL = 0
+
+    year = models.IntegerField("年")
+    month = models.IntegerField("月")
+    date = models.DateField("スナップショット日")
+    shop = models.ForeignKey(Shop, on_delete=models.CASCADE, verbose_name="店舗")
+    category = models.ForeignKey(
+        Category, on_delete=models.CASCADE, null=True, blank=True, related_name='summaries', verbose_name="部門"
+    )
+    level = models.IntegerField("階層レベル")
+
+    amount_sales = models.BigIntegerField("売上金額", default=0)
+    amount_profit = models.BigIntegerField("粗利金額", default=0)
+    amount_purchase = models.BigIntegerField("買取金額", default=0)
+    amount_supply = models.BigIntegerField("仕入金額", default=0)
+    amount_net = models.BigIntegerField("ネット金額", default=0)
+
+    def __str__(self):
+        return f"{self.year}/{self.month} - {self.shop_id} - {self.category_id or '合計'}"
+
+    class Meta:
+        verbose_name = "売上集計サマリー"
+        verbose_name_plural = "売上集計サマリー"
+        unique_together = ('year', 'month', 'shop', 'category')
+        indexes = [
+            models.Index(fields=['year', 'month', 'level']),
+        ]
+
+
+class SalesPeriod(models.Model):
+    """
+    売上期間の索引（年・年月ごとのスナップショット日）
+
+    month が空の行は年全体（その年の最新日）。売上取込時に SalesSummary と一緒に作り直す。
+    """
+    year = models.IntegerField("年")
+    month = models.IntegerField("月", null=True, blank=True)
+    snapshot_date = models.DateField("スナップショット日")
+    shop_count = models.IntegerField("店舗数", default=0)
+    has_sales = models.BooleanField("客数以外のデータあり", default=False)
+
+    def __str__(self):
+        return f"{self.year}/{self.month or '-'} ({self.snapshot_date})"
+
+    class Meta:
+        verbose_name = "売上期間"
+        verbose_name_plural = "売上期間"
+        ordering = ['year', 'month']
+        unique_together = ('year', 'month')
@@ -0,0 +1,139 @@
+"""売上ランキングの集計（SQL のウィンドウ関数）
+
+集計サマリー (SalesSummary) の各年のスナップショットから、年ごとの合計・順位・構成比・前年の順位を
+1 つのクエリで求める。順位は RANK() OVER (PARTITION BY 年)、構成比は年の合計に対する割合、
+前年の順位は LAG で付け、ビューは順位付け済みの行をそのまま表示に使う。
+同額の場合も順位が重ならないよう、並び順の最後にコード・店舗名を加える。
+
+期間は change.summary.snapshot_periods の結果 {年: (月, 日付)} で指定する。
+"""
+from django.db import connection
+
+from .models import Category, SalesSummary, Shop
+
+
+def _table(model):
+    return connection.ops.quote_name(model._meta.db_table)
+
+
+def _snapshot_condition(periods, alias='ss'):
+    """snapshot_periods の結果に対応する WHERE 句とパラメータ"""
+    clauses = []
+    params = []
+    for year, (month, _) in sorted(periods.items()):
+        clauses.append(f'({alias}.year = %s AND {alias}.month = %s)')
+        params += [year, month]
+    return '(' + ' OR '.join(clauses) + ')', params
+
+
+def _fetch(sql, params):
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        columns = [col[0] for col in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+def shop_sales_ranking(periods, category=None):
+    """店舗別の売上ランキング（全部門合計、category 指定時はその部門）。
+
+    店舗名は表示名に揃えてから集計する（和歌山 -> 和歌、加治 -> 加治木）。
+    返り値: [{'year', 'shop_name', 'amount', 'rank', 'share', 'prev_year', 'prev_rank'}, ...]
+        prev_year / prev_rank はその店舗の 1 つ前のデータのある年とその順位（無ければ None）
+    """
+    if not periods:
+        return []
+    condition, params = _snapshot_condition(periods)
+    if category is not None:
+        condition += ' AND ss.category_id = %s'
+        params.append(category.id)
+    else:
+        condition += ' AND ss.level = %s'
+        params.append(SalesSummary.LEVEL_TOTAL)
+    sql = f"""
+        WITH totals AS (
+            SELECT ss.year AS year, n.shop_name AS shop_name, SUM(ss.amount_sales) AS amount
+            FROM {_table(SalesSummary)} ss
+            JOIN (
+                SELECT id, CASE WHEN REPLACE(name, '和歌山', '和歌') = '加治' THEN '加治木'
+                                ELSE REPLACE(name, '和歌山', '和歌') END AS shop_name
+                FROM {_table(Shop)}
+            ) n ON n.id = ss.shop_id
+            WHERE {condition}
+            GROUP BY ss.year, n.shop_name
+        ), ranked AS (
+            SELECT year, shop_name, amount,
+                   RANK() OVER (PARTITION BY year ORDER BY amount DESC, shop_name) AS rank,
+                   CASE WHEN SUM(amount) OVER (PARTITION BY year) > 0
+                        THEN ROUND(amount * 100.0 / SUM(amount) OVER (PARTITION BY year), 1) ELSE 0 END AS share
+            FROM totals
+        )
+        SELECT year, shop_name, amount, rank, share,
+               LAG(year) OVER (PARTITION BY shop_name ORDER BY year) AS prev_year,
+               LAG(rank) OVER (PARTITION BY shop_name ORDER BY year) AS prev_rank
+        FROM ranked
+        ORDER BY year, rank
+    """
+    return _fetch(sql, params)
+
+
+def category_sales_ranking(periods, categories):
+    """categories の部門の全店舗合計の売上ランキング（順位・構成比は categories の中で付ける）。
+
+    返り値: [{'year', 'category_id', 'amount', 'rank', 'share'}, ...]
+    """
+    category_ids = [c.id for c in categories]
+    if not periods or not category_ids:
+        return []
+    condition, params = _snapshot_condition(periods)
+    placeholders = ', '.join(['%s'] * len(category_ids))
+    sql = f"""
+        WITH totals AS (
+            SELECT ss.year AS year, ss.category_id AS category_id, c.code AS code, SUM(ss.amount_sales) AS amount
+            FROM {_table(SalesSummary)} ss
+            JOIN {_table(Category)} c ON c.id = ss.category_id
+            WHERE {condition} AND ss.category_id IN ({placeholders})
+            GROUP BY ss.year, ss.category_id, c.code
+        )
+        SELECT year, category_id, amount,
+               RANK() OVER (PARTITION BY year ORDER BY amount DESC, code, category_id) AS rank,
+               CASE WHEN SUM(amount) OVER (PARTITION BY year) > 0
+                    THEN ROUND(amount * 100.0 / SUM(amount) OVER (PARTITION BY year), 1) ELSE 0 END AS share
+        FROM totals
+        ORDER BY year, rank
+    """
+    return _fetch(sql, params + category_ids)
+
+
+def category_profit_ranking(periods, level=10):
+    """level の部門の全店舗合計の売上順位と粗利率順位。
+
+    粗利率 = 粗利 / 売上 * 100（売上が 0 以下なら 0）。gap は 売上順位 - 粗利率順位。
+    返り値: [{'year', 'category_id', 'sales', 'profit', 'margin', 'sales_rank', 'profit_rank', 'gap'}, ...]
+    """
+    if not periods:
+        return []
+    condition, params = _snapshot_condition(periods)
+    sql = f"""
+        WITH totals AS (
+            SELECT ss.year AS year, ss.category_id AS category_id, c.code AS code,
+                   SUM(ss.amount_sales) AS sales, SUM(ss.amount_profit) AS profit
+            FROM {_table(SalesSummary)} ss
+            JOIN {_table(Category)} c ON c.id = ss.category_id
+            WHERE {condition} AND ss.level = %s
+            GROUP BY ss.year, ss.category_id, c.code
+        ), margins AS (
+            SELECT year, category_id, code, sales, profit,
+                   CASE WHEN sales > 0 THEN profit * 100.0 / sales ELSE 0 END AS margin
+            FROM totals
+        ), ranked AS (
+            SELECT year, category_id, sales, profit, margin,
+                   RANK() OVER (PARTITION BY year ORDER BY sales DESC, code, category_id) AS sales_rank,
+                   RANK() OVER (PARTITION BY year ORDER BY margin DESC, code, category_id) AS profit_rank
+            FROM margins
+        )
+        SELECT year, category_id, sales, profit, ROUND(margin, 1) AS margin, sales_rank, profit_rank,
+               sales_rank - profit_rank AS gap
+        FROM ranked
+        ORDER BY year, profit_rank
+    """
+    return _fetch(sql, params + [level])
@@ -0,0 +1,203 @@
+"""売上集計サマリー (SalesSummary) と期間索引 (SalesPeriod) の更新と参照
+
+各年月について、店舗ごとに「その月の最新日」の SalesRecord を店舗 × 部門（10/35/90/180 の各階層）で
+集計して保存しておき（月の最終取込に含まれない店舗も、その月の自店の最新日で数える）、レポートは最新日の探索と 180部門 -> 10部門 の積み上げを
+集計表の索引付き検索で済ませる。
+年・年月ごとのスナップショット日は SalesPeriod に持ち、period_index() で一度に読み込む。
+"""
+import calendar
+from datetime import date
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Max, Q, Sum
+
+from .caching import PERIOD_INDEX_CACHE_KEY, sales_cache_key
+from .models import CustomerCount, SalesPeriod, SalesRecord, SalesSummary
+
+METRIC_FIELDS = SalesRecord.METRIC_FIELDS
+
+# 180部門の行を上位階層へ積み上げるときの階層列 {列: 階層レベル}
+ROLLUP_FIELDS = {f'{field}_id': level for level, field in SalesRecord.HIERARCHY_FIELDS.items()}
+
+
+def rebuild_month_summary(year, month):
+    """year 年 month 月の SalesSummary を、店舗ごとのその月の最新日の SalesRecord から作り直す。
+
+    返り値: 作成した行数
+    """
+    SalesSummary.objects.filter(year=year, month=month).delete()
+    latest = latest_import_date(year, month)
+    rebuild_period(year, month, latest)
+    shop_dates = shop_snapshot_dates(year, month)
+    if latest is None or not shop_dates:
+        return 0
+
+    condition = Q()
+    for shop_id, shop_date in shop_dates.items():
+        condition |= Q(shop_id=shop_id, date=shop_date)
+    records = SalesRecord.objects.filter(condition).order_by()
+    sums = {f: Sum(f) for f in METRIC_FIELDS}
+    totals = {}
+
+    def add(shop_id, category_id, level, row):
+        key = (shop_id, category_id)
+        if key not in totals:
+            totals[key] = {'level': level, **{f: 0 for f in METRIC_FIELDS}}
+        for f in METRIC_FIELDS:
+            totals[key][f] += row[f] or 0
+
+    # 部門ごと（180部門）
+    for row in records.values('shop_id', 'category_id', 'category__level').annotate(**sums):
+        add(row['shop_id'], row['category_id'], row['category__level'], row)
+    # 180部門を 90/35/10 部門へ積み上げ（SalesRecord の階層列で GROUP BY）
+    for field, level in ROLLUP_FIELDS.items():
+        rows = (records.filter(category__level=180, **{f'{field}__isnull': False})
+                .values('shop_id', field).annotate(**sums))
+        for row in rows:
+            add(row['shop_id'], row[field], level, row)
+    # 全部門の合計
+    for row in records.values('shop_id').annotate(**sums):
+        add(row['shop_id'], None, SalesSummary.LEVEL_TOTAL, row)
+
+    objs = [
+        SalesSummary(year=year, month=month, date=shop_dates[shop_id], shop_id=shop_id, category_id=category_id, **values)
+        for (shop_id, category_id), values in totals.items()
+    ]
+    SalesSummary.objects.bulk_create(objs, batch_size=getattr(settings, 'SALES_IMPORT_BATCH_SIZE', 500))
+    return len(objs)
+
+
+def shop_snapshot_dates(year, month):
+    """year 年 month 月の店舗ごとの売上の最新日 {店舗 id: 日付}"""
+    start = date(year, month, 1)
+    end = date(year, month, calendar.monthrange(year, month)[1])
+    return dict(SalesRecord.objects.filter(date__range=(start, end)).order_by()
+                .values('shop_id').annotate(latest=Max('date')).values_list('shop_id', 'latest'))
+
+
+def latest_import_date(year, month):
+    """year 年 month 月の最新の取込日（売上か客数のある最新日、無ければ None）"""
+    start = date(year, month, 1)
+    end = date(year, month, calendar.monthrange(year, month)[1])
+    dates = [
+        model.objects.filter(date__range=(start, end)).aggregate(latest=Max('date'))['latest']
+        for model in (SalesRecord, CustomerCount)
+    ]
+    dates = [d for d in dates if d is not None]
+    return max(dates) if dates else None
+
+
+def rebuild_sales_summary(periods=None):
+    """SalesSummary を作り直す。
+
+    periods: [(年, 月), ...]。None なら SalesRecord・CustomerCount にあるすべての年月（と、データの無くなった年月の削除）
+    返り値: 作成した行数
+    """
+    if periods is None:
+        periods = {(d.year, d.month) for model in (SalesRecord, CustomerCount) for d in model.objects.dates('date', 'month')}
+        stale = set(SalesSummary.objects.order_by().values_list('year', 'month').distinct())
+        stale |= set(SalesPeriod.objects.filter(month__isnull=False).values_list('year', 'month'))
+        for year, month in stale - periods:
+            SalesSummary.objects.filter(year=year, month=month).delete()
+            rebuild_period(year, month, None)
+    return sum(rebuild_month_summary(year, month) for year, month in sorted(periods))
+
+
+def rebuild_period(year, month, latest):
+    """SalesPeriod の year 年 month 月の行と、year 年の行を作り直す。
+
+    latest: その月の最新日（None ならその月のデータは無い）。店舗数はその月に売上のある店舗と、最新日に客数のある店舗
+    """
+    SalesPeriod.objects.filter(year=year, month=month).delete()
+    if latest is not None:
+        start = date(year, month, 1)
+        end = date(year, month, calendar.monthrange(year, month)[1])
+        SalesPeriod.objects.create(
+            year=year, month=month, snapshot_date=latest,
+            shop_count=len(
+                set(SalesRecord.objects.filter(date__range=(start, end)).order_by().values_list('shop_id', flat=True).distinct())
+                | set(CustomerCount.objects.filter(date=latest).values_list('shop_id', flat=True))
+            ),
+            has_sales=SalesRecord.objects.filter(date__range=(start, end)).exists(),
+        )
+
+    # 年の行は月の行から作る（最新日は最終月のスナップショット日）
+    SalesPeriod.objects.filter(year=year, month__isnull=True).delete()
+    months = list(SalesPeriod.objects.filter(year=year, month__isnull=False).order_by('month'))
+    if months:
+        SalesPeriod.objects.create(
+            year=year, month=None, snapshot_date=months[-1].snapshot_date, shop_count=months[-1].shop_count,
+            has_sales=any(p.has_sales for p in months),
+        )
+
+
+def period_index(ttl=60 * 60 * 24):
+    """期間索引 {(年, 月): {'date', 'shop_count', 'has_sales'}} を返す（月 None は年全体）。
+
+    全期間を 1 クエリで読み込んでキャッシュし、売上取込時に無効化される（キーに売上キャッシュの世代を付ける）。
+    """
+    cache_key = sales_cache_key(PERIOD_INDEX_CACHE_KEY)
+    index = cache.get(cache_key)
+    if index is None:
+        index = {
+            (p.year, p.month): {'date': p.snapshot_date, 'shop_count': p.shop_count, 'has_sales': p.has_sales}
+            for p in SalesPeriod.objects.all()
+        }
+        cache.set(cache_key, index, ttl)
+    return index
+
+
+def period_months(year):
+    """year 年でデータのある月の一覧"""
+    return sorted(m for y, m in period_index() if y == year and m is not None)
+
+
+def closed_period_check():
+    """期間 (年, 月) が最新の取込月より前の締まった期間かを返す関数（月 None は年全体、最新月の前年まで）。
+
+    締まった期間の集計は変わらない（取り込み直した場合は期間ごとの版で作り直す）。
+    """
+    months = [key for key in period_index() if key[1] is not None]
+    latest = max(months) if months else None
+
+    def closed(period):
+        if latest is None:
+            return False
+        year, month = period
+        return year < latest[0] if month is None else (year, month) < latest
+    return closed
+
+
+def latest_sales_year(years=None):
+    """売上データ（客数以外）がある最新の年（無ければ None）
+
+    years: 候補の年。未指定なら索引にあるすべての年
+    """
+    index = period_index()
+    candidates = [y for y, m in index if m is None and (years is None or y in years) and index[(y, m)]['has_sales']]
+    return max(candidates) if candidates else None
+
+
+def snapshot_periods(month=None):
+    """期間索引にある年ごとのスナップショット {年: (月, 日付)}。
+
+    month: 指定時はその月にデータがある年だけ、未指定時は各年の最終月（= その年の最新日）
+    """
+    result = {}
+    for (year, m), period in sorted(period_index().items(), key=lambda kv: (kv[0][0], kv[0][1] or 0)):
+        if month is not None and m == month:
+            result[year] = (m, period['date'])
+        elif month is None and m is None:
+            result[year] = (period['date'].month, period['date'])
+    return result
+
+
+def snapshot_summary(periods, **filters):
+    """snapshot_periods の結果に対応する SalesSummary の QuerySet"""
+    if not periods:
+        return SalesSummary.objects.none()
+    q = Q()
+    for year, (month, _) in periods.items():
+        q |= Q(year=year, month=month)
+    return SalesSummary.objects.filter(q, **filters).order_by()
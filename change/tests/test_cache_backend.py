@@ -0,0 +1,66 @@
+import time
+
+from django.test import SimpleTestCase
+
+from change.cache_backend import TwoTierCache
+
+
+class TwoTierCacheTests(SimpleTestCase):
+    """プロセス内 LRU と共有キャッシュの 2 層キャッシュ（2 つの location で 2 プロセスを模す）"""
+
+    def setUp(self):
+        self.shared = f'two-tier-{self.id()}'
+        self.a = self.make_cache('a')
+        self.b = self.make_cache('b')
+
+    def make_cache(self, name):
+        return TwoTierCache(f'{self.shared}:{name}', {'OPTIONS': {
+            'LOCAL_MAX_BYTES': 1024 * 1024,
+            'LOCAL_TIMEOUT': 300,
+            'VERSION_CHECK_INTERVAL': 0,
+            'SHARED': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': self.shared},
+        }})
+
+    def test_second_read_is_a_local_hit(self):
+        self.a.set('k', {'v': 1})
+        self.assertEqual(self.b.get('k'), {'v': 1})
+        self.assertEqual(self.b.get('k'), {'v': 1})
+        stats = self.b.stats()
+        self.assertEqual(stats['shared']['hits'], 1)
+        self.assertEqual(stats['local']['hits'], 1)
+
+    def test_overwrite_and_delete_drop_other_process_copies(self):
+        self.a.set('k', 1)
+        self.assertEqual(self.b.get('k'), 1)
+        self.a.set('k', 2)
+        self.assertEqual(self.b.get('k'), 2)
+        self.a.delete('k')
+        self.assertIsNone(self.b.get('k'))
+
+    def test_new_keys_and_locks_do_not_invalidate(self):
+        self.a.set('k', 1)
+        self.b.get('k')
+        self.a.set('other', 1)
+        self.assertTrue(self.a.add('lock', True, 30))
+        self.a.delete('lock')
+        self.assertEqual(self.b.get('k'), 1)
+        self.assertEqual(self.b.stats()['local']['invalidations'], 0)
+        self.assertEqual(self.b.stats()['local']['flushes'], 0)
+
+    def test_clear_flushes_other_processes(self):
+        self.a.set('k', 1)
+        self.b.get('k')
+        self.a.clear()
+        self.assertIsNone(self.b.get('k'))
+
+    def test_local_copy_expires_with_shared_entry(self):
+        self.a.set('k', 1, 60)
+        before = time.time()
+        self.b.get('k')
+        key = self.b.make_and_validate_key('k')
+        self.assertLessEqual(self.b._local.entries[key][1], before + 60 + 1)
+
+        self.a.set('short', 1, 1)
+        self.b.get('short')
+        key = self.b.make_and_validate_key('short')
+        self.assertLessEqual(self.b._local.entries[key][1], before + 1 + 1)
@@ -0,0 +1,338 @@
+import pickle
+import threading
+from datetime import date
+from unittest import mock
+
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+
+from change.caching import (
+    _MISSING, ALL_PERIODS, SalesCacheMiddleware, _refresh_in_background, _single_flight, cache_sales_page,
+    cached_payload, cached_period_values, cached_report, cached_shop_vectors, decode_payload, encode_payload,
+    invalidate_after_sales_import, invalidate_sales_caches, month_periods, pack_ints, sales_cache_key, unpack_ints,
+)
+from change.models import DataVersion
+from change.versions import bump_data_version, data_versions, forget_data_versions, get_data_version
+
+from .utils import TEST_CACHES, SalesImportTestMixin, sales_values
+
+
+@override_settings(CACHES=TEST_CACHES)
+class SalesCacheInvalidationTests(SalesImportTestMixin, TestCase):
+    """取込後に、取り込んだ年月に依存するキャッシュの世代だけが変わること"""
+
+    def setUp(self):
+        super().setUp()
+        self.import_sales(date(2025, 1, 31), sales_values(4, 2, seed=1))
+        self.import_sales(date(2025, 2, 10), sales_values(4, 2, seed=2))
+
+    def test_reimport_only_invalidates_the_imported_month(self):
+        january = sales_cache_key('report', [(2025, 1)])
+        february = sales_cache_key('report', [(2025, 2)])
+        other_year = sales_cache_key('report', [(2024, 2)])
+        every_february = sales_cache_key('report', [(None, 2)])
+        everything = sales_cache_key('report', ALL_PERIODS)
+
+        result = self.import_sales(date(2025, 2, 11), sales_values(4, 2, seed=3))
+        self.assertEqual(invalidate_after_sales_import([result]), 'periods')
+
+        self.assertEqual(sales_cache_key('report', [(2025, 1)]), january)
+        self.assertEqual(sales_cache_key('report', [(2024, 2)]), other_year)
+        self.assertNotEqual(sales_cache_key('report', [(2025, 2)]), february)
+        self.assertNotEqual(sales_cache_key('report', [(None, 2)]), every_february)
+        self.assertNotEqual(sales_cache_key('report', ALL_PERIODS), everything)
+
+    def test_new_month_invalidates_everything(self):
+        january = sales_cache_key('report', [(2025, 1)])
+        result = self.import_sales(date(2025, 3, 1), sales_values(4, 2, seed=3))
+        self.assertEqual(invalidate_after_sales_import([result]), 'all')
+        self.assertNotEqual(sales_cache_key('report', [(2025, 1)]), january)
+
+    def test_skipped_and_dry_run_imports_invalidate_nothing(self):
+        february = sales_cache_key('report', [(2025, 2)])
+        skipped = self.import_sales(date(2025, 2, 10), sales_values(4, 2, seed=2))
+        dry_run = self.import_sales(date(2025, 2, 11), sales_values(4, 2, seed=3), dry_run=True)
+        self.assertTrue(skipped['skipped'])
+        self.assertIsNone(invalidate_after_sales_import([skipped, dry_run]))
+        self.assertEqual(sales_cache_key('report', [(2025, 2)]), february)
+
+
+@override_settings(CACHES=TEST_CACHES, SALES_CACHE_STALE_SECONDS=0)
+class CachedShopVectorsTests(TestCase):
+    """店舗ごとの集計値のキャッシュ（キャッシュに無い店舗だけを集計する）"""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.compute = mock.Mock(side_effect=lambda sids: {sid: [sid, sid * 10] for sid in sids if sid != 4})
+
+    def vectors(self, shop_ids):
+        return cached_shop_vectors('test_vectors', shop_ids, self.compute, periods=[(2025, 1)], empty=[0, 0])
+
+    def test_only_uncached_shops_are_computed(self):
+        self.assertEqual(self.vectors([1, 2]), {1: [1, 10], 2: [2, 20]})
+        self.compute.assert_called_once_with([1, 2])
+
+        self.compute.reset_mock()
+        result = self.vectors([1, 3])
+        self.compute.assert_called_once_with([3])
+        self.assertEqual(list(result.items()), [(1, [1, 10]), (3, [3, 30])])
+
+        self.compute.reset_mock()
+        self.assertEqual(self.vectors([3, 2, 1]), {3: [3, 30], 2: [2, 20], 1: [1, 10]})
+        self.compute.assert_not_called()
+
+    def test_shops_without_data_cache_the_empty_value(self):
+        self.assertEqual(self.vectors([4]), {4: [0, 0]})
+        self.assertEqual(self.vectors([4]), {4: [0, 0]})
+        self.compute.assert_called_once_with([4])
+
+    def test_invalidated_period_recomputes_every_shop(self):
+        self.vectors([1, 2])
+        invalidate_sales_caches([(2025, 1)])
+        self.compute.reset_mock()
+        self.vectors([1, 2])
+        self.compute.assert_called_once_with([1, 2])
+
+
+@override_settings(CACHES=TEST_CACHES)
+class CachedPeriodValuesTests(TestCase):
+    """期間ごとの集計値のキャッシュ（取り込んだ年月を含まない期間は作り直さない）"""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+    def test_untouched_periods_are_reused(self):
+        computed = []
+
+        def compute(periods):
+            computed.append(list(periods))
+            return {period: len(computed) for period in periods}
+
+        periods = [(2025, 1), (2025, 2), (2025, None)]
+        closed = lambda period: period == (2025, 1)
+        first = cached_period_values('test_values', periods, compute, closed)
+        second = cached_period_values('test_values', periods, compute, closed)
+        self.assertEqual(first, second)
+        self.assertEqual(computed, [periods])
+
+        invalidate_sales_caches([(2025, 2)])
+        third = cached_period_values('test_values', periods, compute, closed)
+        self.assertEqual(computed[1], [(2025, 2), (2025, None)])
+        self.assertEqual(third[(2025, 1)], first[(2025, 1)])
+
+        # 間引きなどで消えた締まった期間は、その期間だけ集計し直す
+        cache.clear()
+        cached_period_values('test_values', [(2025, 1)], compute, closed)
+        self.assertEqual(computed[2], [(2025, 1)])
+
+
+@override_settings(CACHES=TEST_CACHES, DATA_VERSION_CHECK_INTERVAL=60, SALES_CACHE_STALE_SECONDS=60)
+class CachedReportConcurrencyTests(TestCase):
+    """集計の重いレポートのキャッシュ（シングルフライトと stale-while-revalidate）"""
+
+    periods = [(2025, 1)]
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        forget_data_versions()
+        self.addCleanup(forget_data_versions)
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def blocking(self, value):
+        """release されるまで終わらない集計"""
+        def compute():
+            self.started.set()
+            self.release.wait(5)
+            return value
+        return mock.Mock(side_effect=compute)
+
+    def invalidate(self):
+        invalidate_sales_caches(self.periods)
+        # スレッドから DB を読まないよう、新しい版のスナップショットをここで読んでおく
+        data_versions()
+
+    def report(self, compute):
+        return cached_report('test_report', compute, self.periods)
+
+    def test_only_one_caller_computes_while_the_others_wait(self):
+        data_versions()
+        compute = self.blocking('report')
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(self.report(compute))) for _ in range(4)]
+        threads[0].start()
+        self.assertTrue(self.started.wait(5))
+        for thread in threads[1:]:
+            thread.start()
+        self.release.set()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(results, ['report'] * 4)
+        compute.assert_called_once_with()
+
+    def test_waiter_computes_itself_after_the_lock_timeout(self):
+        compute = mock.Mock(return_value='report')
+        cache.add('test_lock', True, 60)
+        with self.settings(SALES_CACHE_LOCK_SECONDS=0.1):
+            self.assertEqual(_single_flight('test_lock', lambda: _MISSING, compute), 'report')
+        compute.assert_called_once_with()
+
+    def test_stale_entry_is_served_while_the_refresh_is_pending(self):
+        data_versions()
+        self.assertEqual(self.report(mock.Mock(return_value='old')), 'old')
+        self.invalidate()
+
+        refresh = self.blocking('new')
+        self.assertEqual(self.report(refresh), 'old')
+        self.assertTrue(self.started.wait(5))
+        # 作り直し中の他のリクエストも古い値を返し、作り直しは 1 回だけ
+        self.assertEqual(self.report(refresh), 'old')
+        self.release.set()
+        for thread in threading.enumerate():
+            if thread.name == 'sales-cache-refresh':
+                thread.join(5)
+        self.assertEqual(self.report(refresh), 'new')
+        refresh.assert_called_once_with()
+
+    def test_refresh_is_skipped_while_another_is_running(self):
+        refresh = mock.Mock()
+        cache.add('test_refresh', True, 60)
+        _refresh_in_background('test_refresh', refresh)
+        refresh.assert_not_called()
+
+    @override_settings(SALES_CACHE_STALE_SECONDS=0)
+    def test_zero_stale_seconds_forces_a_fresh_compute(self):
+        data_versions()
+        self.report(mock.Mock(return_value='old'))
+        self.invalidate()
+        compute = mock.Mock(return_value='new')
+        with mock.patch('change.caching._refresh_in_background') as refresh:
+            self.assertEqual(self.report(compute), 'new')
+        compute.assert_called_once_with()
+        refresh.assert_not_called()
+
+
+@override_settings(CACHES=TEST_CACHES, SALES_CACHE_COMPRESS_MIN_BYTES=256)
+class CachedPayloadTests(TestCase):
+    """レポートの payload（整数の配列・閾値以上で圧縮）の保存と復元"""
+
+    small = {'ids': [1, 2, 3], 'values': pack_ints([10, 20, 30])}
+    large = {'ids': list(range(100)), 'values': pack_ints(range(100), range(100, 200))}
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+    def test_pack_ints_round_trip(self):
+        packed = pack_ints([1, 2, 3], [4, -5, 2 ** 40])
+        self.assertEqual(packed.typecode, 'q')
+        self.assertEqual(unpack_ints(packed, 3), [[1, 2, 3], [4, -5, 2 ** 40]])
+        self.assertEqual(unpack_ints(pickle.loads(pickle.dumps(packed)), 2), [[1, 2], [3, 4], [-5, 2 ** 40]])
+        self.assertEqual(unpack_ints(pack_ints(), 0), [])
+
+    def test_payload_below_the_threshold_is_not_compressed(self):
+        compressed, data = encode_payload(self.small)
+        self.assertFalse(compressed)
+        self.assertEqual(decode_payload((compressed, data)), self.small)
+
+    def test_payload_at_or_above_the_threshold_is_compressed(self):
+        compressed, data = encode_payload(self.large)
+        self.assertTrue(compressed)
+        self.assertLess(len(data), len(pickle.dumps(self.large, pickle.HIGHEST_PROTOCOL)))
+        self.assertEqual(decode_payload((compressed, data)), self.large)
+
+        size = len(pickle.dumps(self.small, pickle.HIGHEST_PROTOCOL))
+        with self.settings(SALES_CACHE_COMPRESS_MIN_BYTES=size):
+            self.assertTrue(encode_payload(self.small)[0])
+        with self.settings(SALES_CACHE_COMPRESS_MIN_BYTES=size + 1):
+            self.assertFalse(encode_payload(self.small)[0])
+
+    def test_cached_payload_round_trip(self):
+        for name, payload in (('small', self.small), ('large', self.large)):
+            compute = mock.Mock(return_value=payload)
+            with self.subTest(name):
+                first = cached_payload(f'test_payload_{name}', compute)
+                second = cached_payload(f'test_payload_{name}', compute)
+                self.assertEqual(first, payload)
+                self.assertEqual(second, payload)
+                # キャッシュからは毎回新しく復元する
+                self.assertIsNot(second, first)
+                compute.assert_called_once_with()
+                self.assertEqual(cache.get(f'test_payload_{name}')['value'][0], name == 'large')
+
+
+@override_settings(DATA_VERSION_CHECK_INTERVAL=60)
+class DataVersionSnapshotTests(TestCase):
+    """版はプロセス内のスナップショットから読み、間隔ごと・自プロセスでの更新時だけ DB を読む"""
+
+    def setUp(self):
+        super().setUp()
+        forget_data_versions()
+        self.addCleanup(forget_data_versions)
+
+    def test_versions_are_read_once_per_interval(self):
+        version = bump_data_version(DataVersion.SALES)
+        with self.assertNumQueries(1):
+            self.assertEqual(get_data_version(DataVersion.SALES), version)
+            self.assertEqual(get_data_version(DataVersion.SALES), version)
+            sales_cache_key('report', [(2025, 1)])
+
+    def test_own_bump_is_seen_immediately(self):
+        data_versions()
+        version = bump_data_version(DataVersion.SALES)
+        self.assertEqual(get_data_version(DataVersion.SALES), version)
+
+    def test_other_process_bump_is_seen_after_the_interval(self):
+        before = get_data_version(DataVersion.SALES)
+        # 他のプロセスでの更新（このプロセスのスナップショットは捨てられない）
+        DataVersion.objects.update_or_create(name=DataVersion.SALES, defaults={'version': 'other'})
+        self.assertEqual(get_data_version(DataVersion.SALES), before)
+        with self.settings(DATA_VERSION_CHECK_INTERVAL=0):
+            self.assertEqual(get_data_version(DataVersion.SALES), 'other')
+
+
+@override_settings(CACHES=TEST_CACHES, DATA_VERSION_CHECK_INTERVAL=60)
+class CacheSalesPageTests(TestCase):
+    """ページ全体のキャッシュ（ビューごとに 1 つのミドルウェア、キーに依存する期間の世代）"""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        forget_data_versions()
+        self.addCleanup(forget_data_versions)
+        self.calls = []
+
+    def view(self, request):
+        self.calls.append(request.GET.get('month'))
+        return HttpResponse(f'page {len(self.calls)}')
+
+    def get(self, page, month):
+        return page(RequestFactory().get('/sales/', {'month': month})).content.decode()
+
+    def test_one_middleware_instance_per_view(self):
+        with mock.patch.object(SalesCacheMiddleware, '__init__', autospec=True,
+                               side_effect=SalesCacheMiddleware.__init__) as init:
+            page = cache_sales_page(60, month_periods)(self.view)
+            for month in ('1', '2', '1'):
+                self.get(page, month)
+        self.assertEqual(init.call_count, 1)
+        self.assertEqual(self.calls, ['1', '2'])
+
+    def test_cached_page_is_served_without_queries(self):
+        page = cache_sales_page(60, month_periods)(self.view)
+        self.assertEqual(self.get(page, '2'), 'page 1')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get(page, '2'), 'page 1')
+
+    def test_only_pages_of_the_imported_period_are_rebuilt(self):
+        page = cache_sales_page(60, month_periods)(self.view)
+        self.get(page, '2')
+        self.get(page, '3')
+        invalidate_sales_caches([(2025, 2)])
+        self.assertEqual(self.get(page, '3'), 'page 2')
+        self.assertEqual(self.get(page, '2'), 'page 3')
+        self.assertEqual(self.calls, ['2', '3', '2'])
@@ -0,0 +1,110 @@
+import io
+import os
+import shutil
+import tempfile
+import zipfile
+from datetime import date
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import Client, TestCase, TransactionTestCase, override_settings
+from django.utils import translation
+
+from change.management.commands.warm_sales_cache import report_urls
+from change.models import SalesRecord
+from change.versions import forget_data_versions
+
+from .utils import TEST_CACHES, SalesImportTestMixin, sales_values
+
+
+@override_settings(CACHES=TEST_CACHES)
+class ImportSalesCommandTests(SalesImportTestMixin, TestCase):
+    """import_sales コマンド（ディレクトリ・zip の一括取込、報告日順の書き込み、キャッシュ無効化）"""
+
+    def setUp(self):
+        super().setUp()
+        self.tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tempdir, ignore_errors=True)
+        # ファイル名の順と報告日の順を逆にしておく
+        self.workbooks = [
+            ('a.xlsx', self.sales_workbook(date(2025, 1, 20), sales_values(4, 2, seed=2)).read()),
+            ('b.xlsx', self.sales_workbook(date(2025, 1, 10), sales_values(4, 2, seed=1)).read()),
+        ]
+
+    def write_directory(self):
+        for name, data in self.workbooks:
+            with open(os.path.join(self.tempdir, name), 'wb') as f:
+                f.write(data)
+        return self.tempdir
+
+    def write_zip(self):
+        path = os.path.join(self.tempdir, 'sales.zip')
+        with zipfile.ZipFile(path, 'w') as zf:
+            for name, data in self.workbooks:
+                zf.writestr(name, data)
+        return path
+
+    def run_command(self, *args):
+        out = io.StringIO()
+        with mock.patch('change.management.commands.import_sales.invalidate_after_sales_import') as invalidate:
+            call_command('import_sales', *args, '--workers', '1', stdout=out)
+        return out.getvalue(), invalidate
+
+    def assertWrittenInReportDateOrder(self, out):
+        written = [line.split()[0] for line in out.splitlines() if 'rows=' in line]
+        self.assertEqual(written, ['2025-01-10', '2025-01-20'])
+        # 同じ月は最新の報告日だけが残る（古い日付が後に書かれると 1/10 が残る）
+        self.assertEqual(set(SalesRecord.objects.values_list('date', flat=True)), {date(2025, 1, 20)})
+
+    def test_directory_is_written_in_report_date_order(self):
+        out, invalidate = self.run_command(self.write_directory())
+        self.assertWrittenInReportDateOrder(out)
+        invalidate.assert_called_once()
+        self.assertEqual([r['report_date'] for r in invalidate.call_args.args[0]],
+                         [date(2025, 1, 10), date(2025, 1, 20)])
+
+    def test_zip_is_written_in_report_date_order(self):
+        out, invalidate = self.run_command(self.write_zip())
+        self.assertWrittenInReportDateOrder(out)
+        invalidate.assert_called_once()
+
+    def test_no_clear_cache_skips_invalidation(self):
+        out, invalidate = self.run_command(self.write_zip(), '--no-clear-cache')
+        self.assertWrittenInReportDateOrder(out)
+        invalidate.assert_not_called()
+
+
+@override_settings(CACHES=TEST_CACHES, DATA_VERSION_CHECK_INTERVAL=60)
+class WarmSalesCacheCommandTests(SalesImportTestMixin, TransactionTestCase):
+    """warm_sales_cache コマンド（全ページが 200 を返し、その後のアクセスはキャッシュから返る）"""
+
+    def setUp(self):
+        super().setUp()
+        # ページはワーカースレッドで描画するため、コミット済みのデータを使う
+        self.import_sales(date(2024, 12, 31), sales_values(4, 2, seed=1))
+        self.import_sales(date(2025, 1, 31), sales_values(4, 2, seed=2))
+        self.import_sales(date(2025, 2, 10), sales_values(4, 2, seed=3))
+        self.addCleanup(forget_data_versions)
+
+    def test_every_page_is_rendered_and_then_served_from_the_cache(self):
+        urls = report_urls()
+        self.assertEqual({name for name, _ in urls}, {'dashboard', 'trends', 'shop_ranking', 'profit_ranking'})
+        out = io.StringIO()
+        call_command('warm_sales_cache', '--workers', '2', '--base-url', 'http://testserver', verbosity=2,
+                     stdout=out, stderr=io.StringIO())
+
+        rendered = [line.split(' (')[0] for line in out.getvalue().splitlines() if line.startswith('/')]
+        self.assertEqual(sorted(rendered), sorted(path for _, path in urls))
+        self.assertIn(f'Warmed {len(urls)} page(s).', out.getvalue())
+
+        # ページ全体をキャッシュする画面は、同じ URL なら DB を読まずに返る。キャッシュキーには言語が入るため、
+        # Web のワーカースレッドと同じく言語を有効にしていない状態で取得する（テストでは migrate が有効にする）
+        language = translation.get_language()
+        translation.deactivate()
+        self.addCleanup(translation.activate, language)
+        client = Client()
+        for name, path in urls:
+            if name == 'dashboard':
+                continue
+            with self.subTest(path=path), self.assertNumQueries(0):
+                self.assertEqual(client.get(path).status_code, 200)
@@ -0,0 +1,98 @@
+from datetime import date
+
+import numpy as np
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from change.cube import get_sales_cube, load_sales_cube
+from change.hierarchy import category_tree
+from change.models import Category, SalesRecord, Shop
+
+from .utils import TEST_CACHES, SalesImportTestMixin, sales_values
+
+# 店舗ごとに月の最終取込に含まれない月がある取込 (報告日, 店舗)
+IMPORTS = [
+    (date(2024, 11, 30), ['日向', '宮崎']),
+    (date(2024, 12, 15), ['日向', '宮崎', '延岡']),
+    (date(2024, 12, 31), ['日向', '延岡']),
+    (date(2025, 1, 31), ['日向', '宮崎']),
+    (date(2025, 2, 10), ['日向', '宮崎', '延岡']),
+    (date(2025, 2, 20), ['宮崎', '延岡']),
+]
+
+
+@override_settings(CACHES=TEST_CACHES, SALES_CUBE_ENABLED=True)
+class SalesCubeTests(SalesImportTestMixin, TestCase):
+    """集計サマリーから読み込む売上キューブと、キューブを使うページの DB 集計との一致"""
+
+    def setUp(self):
+        super().setUp()
+        for i, (report_date, shops) in enumerate(IMPORTS):
+            self.import_sales(report_date, sales_values(4, len(shops), seed=10 + i), shops=shops)
+        self.shop_ids = dict(Shop.objects.values_list('name', 'id'))
+
+    def test_cube_is_loaded_from_the_summary_in_one_query(self):
+        # 軸（期間索引・店舗・180部門）に 3 クエリ、値に 1 クエリ
+        with self.assertNumQueries(4):
+            cube = load_sales_cube(chunk_rows=3)
+        self.assertEqual(cube.periods, [(2024, 11), (2024, 12), (2025, 1), (2025, 2)])
+
+        leaves = Category.objects.filter(level=180)
+        values, present = cube.rollup(cube.period_indices(2024), np.eye(len(leaves), dtype=np.int64), by_shop=True,
+                                      metrics=SalesRecord.METRIC_FIELDS)
+        for s, sid in enumerate(cube.shops_of()):
+            for c, cid in enumerate(cube.category_ids):
+                records = SalesRecord.objects.filter(shop_id=sid, category_id=cid, date__year=2024)
+                expected = [sum(getattr(r, f) for r in records) for f in SalesRecord.METRIC_FIELDS]
+                self.assertEqual(values[s, c].tolist(), expected)
+                self.assertEqual(present[s, c], records.exists())
+
+    def test_cube_is_over_the_size_limit(self):
+        with self.assertLogs('change.cube', 'WARNING'):
+            self.assertIsNone(load_sales_cube(max_bytes=1))
+
+    def test_cube_is_on_by_default_and_reloaded_after_an_import(self):
+        cube = get_sales_cube()
+        self.assertIsNotNone(cube)
+        self.assertIs(get_sales_cube(), cube)
+        self.import_sales(date(2025, 3, 1), sales_values(4, 2, seed=99))
+        reloaded = get_sales_cube()
+        self.assertIsNot(reloaded, cube)
+        self.assertEqual(reloaded.periods[-1], (2025, 3))
+
+    def test_range_indices_select_whole_months(self):
+        cube = load_sales_cube()
+        self.assertEqual(cube.range_indices(date(2024, 12, 1), date(2024, 12, 31)), [1])
+        self.assertEqual(cube.range_indices(date(2024, 1, 1), date(2024, 12, 31)), [0, 1])
+        self.assertEqual(cube.range_indices(), [0, 1, 2, 3])
+        self.assertEqual(cube.period_indices(month=2), [3])
+
+    def render(self, name, params, cube_enabled):
+        cache.clear()
+        with self.settings(SALES_CUBE_ENABLED=cube_enabled):
+            response = self.client.get(reverse(name), params)
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode()
+
+    def assertSameWithAndWithoutCube(self, name, params):
+        with self.subTest(name, **{k: str(v) for k, v in params.items()}):
+            with_cube = self.render(name, params, True)
+            self.assertEqual(with_cube, self.render(name, params, False))
+
+    def test_pages_match_the_database_aggregation(self):
+        others = [str(self.shop_ids['宮崎']), str(self.shop_ids['延岡'])]
+        top = category_tree().find(self.master_codes[0][0], 10)
+        self.assertSameWithAndWithoutCube('trends', {})
+        self.assertSameWithAndWithoutCube('trends', {'month': '12'})
+        self.assertSameWithAndWithoutCube('hyuga_trend', {})
+        self.assertSameWithAndWithoutCube('store_comparison', {'year': '2024', 'comparison_shops': others})
+        self.assertSameWithAndWithoutCube('store_comparison', {'year': '2025', 'comparison_shops': ['all_others']})
+        for month in ('total', '12', '2'):
+            self.assertSameWithAndWithoutCube('hyuga_vs_others_trend', {
+                'dept_code': str(top.code), 'month': month, 'comparison_shops': others})
+        for level, year, month in ((10, '2024', '12'), (180, '2024', '13'), (90, '2025', '2')):
+            params = {'dept_level': str(level), 'year': year, 'month': month, 'comparison_shops': others,
+                      'metrics': ['sales', 'net', 'profit']}
+            self.assertSameWithAndWithoutCube('hyuga_vs_others_compare', params)
+            self.assertSameWithAndWithoutCube('hyuga_vs_others_compare_csv', params)
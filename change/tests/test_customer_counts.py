@@ -0,0 +1,87 @@
+from datetime import date
+
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+
+from change.models import Shop
+
+from .utils import TEST_CACHES, SalesImportTestMixin, sales_values
+
+
+@override_settings(CACHES=TEST_CACHES)
+class CustomerNetTrendTests(SalesImportTestMixin, TestCase):
+    """客数・ネット売上の推移は、店舗ごとのその月の最新日の客数とネット売上を並べる"""
+
+    def setUp(self):
+        super().setUp()
+        self.values = sales_values(4, 2, seed=1)
+        self.import_sales(date(2025, 2, 10), self.values, customers=[120, 80])
+        # 月末の取込に含まれない店舗（宮崎）は 2/10 が最新日
+        self.later = self.values + 1
+        self.import_sales(date(2025, 2, 28), self.later, shops=['日向', '延岡'], customers=[150, 60])
+        self.shop_ids = dict(Shop.objects.values_list('name', 'id'))
+
+    def tables(self, **params):
+        comparison = [str(self.shop_ids['宮崎']), str(self.shop_ids['延岡'])]
+        response = self.client.get(reverse('customer_net_trend'), {'comparison_shops': comparison, **params})
+        self.assertEqual(response.status_code, 200)
+        customers = {row['name']: row['amounts'] for row in response.context['customer_table']}
+        net = {row['name']: row['amounts'] for row in response.context['net_table']}
+        return customers, net
+
+    def test_shop_absent_on_the_final_date_uses_its_own_latest_date(self):
+        for month in ('total', '2'):
+            customers, net = self.tables(month=month)
+            with self.subTest(month=month):
+                self.assertEqual(customers, {'日向': ['150'], '宮崎': ['80'], '延岡': ['60']})
+                self.assertEqual(net, {
+                    '日向': [f'{int(self.later[:, 0, 3].sum()):,}'],
+                    '宮崎': [f'{int(self.values[:, 1, 3].sum()):,}'],
+                    '延岡': [f'{int(self.later[:, 1, 3].sum()):,}'],
+                })
+
+    def test_month_without_data_is_blank(self):
+        customers, net = self.tables(month='3')
+        self.assertEqual(customers, {'日向': ['-'], '宮崎': ['-'], '延岡': ['-']})
+        self.assertEqual(net, {'日向': ['-'], '宮崎': ['-'], '延岡': ['-']})
+
+
+class CustomerCountMigrationTests(TransactionTestCase):
+    """0013: 客数部門(9999)の SalesRecord を CustomerCount に移す"""
+
+    migrate_from = [('change', '0012_categoryclosure')]
+    migrate_to = [('change', '0013_customercount')]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(executor.loader.graph.leaf_nodes())
+        super().tearDown()
+
+    def test_customer_rows_move_to_customer_count(self):
+        apps = self.migrate(self.migrate_from)
+        Category = apps.get_model('change', 'Category')
+        SalesRecord = apps.get_model('change', 'SalesRecord')
+        Shop = apps.get_model('change', 'Shop')
+        shop = Shop.objects.create(name='日向')
+        customers = Category.objects.create(code=9999, level=10, name='客数')
+        sales = Category.objects.create(code=1, level=10, name='大分類1')
+        SalesRecord.objects.create(shop=shop, category=customers, cat10=customers, date=date(2025, 1, 10),
+                                   amount_sales=321)
+        SalesRecord.objects.create(shop=shop, category=sales, cat10=sales, date=date(2025, 1, 10), amount_sales=5000)
+
+        apps = self.migrate(self.migrate_to)
+        CustomerCount = apps.get_model('change', 'CustomerCount')
+        self.assertEqual(list(CustomerCount.objects.values_list('shop__name', 'date', 'count')),
+                         [('日向', date(2025, 1, 10), 321)])
+        self.assertFalse(apps.get_model('change', 'Category').objects.filter(code=9999).exists())
+        self.assertEqual(list(apps.get_model('change', 'SalesRecord').objects.values_list('amount_sales', flat=True)),
+                         [5000])
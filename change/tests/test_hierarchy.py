@@ -0,0 +1,83 @@
+from datetime import date
+
+from django.test import TestCase, override_settings
+
+from change.hierarchy import category_tree
+from change.models import Category, CategoryClosure, DataVersion, SalesRecord, SalesSummary
+from change.versions import bump_data_version
+
+from .utils import TEST_CACHES, SalesImportTestMixin, sales_values
+
+
+@override_settings(CACHES=TEST_CACHES)
+class CategoryReparentTests(SalesImportTestMixin, TestCase):
+    """部門マスタで 180部門の親を付け替えたときの売上の階層列と集計サマリーの更新"""
+
+    def setUp(self):
+        super().setUp()
+        self.values = sales_values(4, 2, seed=1)
+        self.import_sales(date(2025, 1, 10), self.values)
+        self.import_sales(date(2025, 2, 10), self.values + 1)
+
+    def test_reparent_updates_record_hierarchy_and_summary(self):
+        # 5003 を 90部門 1002（10部門 2）から 1001（10部門 1）へ移す
+        codes = [row if row[3] != 5003 else (1, 101, 1001, 5003) for row in self.master_codes]
+        result = self.import_master(codes)
+        self.assertEqual(result['levels'][180]['updated'], 1)
+
+        moved = set(SalesRecord.objects.filter(category__code=5003).values_list('cat10__code', 'cat35__code', 'cat90__code'))
+        self.assertEqual(moved, {(1, 101, 1001)})
+        others = set(SalesRecord.objects.filter(category__code=5004).values_list('cat10__code', 'cat35__code', 'cat90__code'))
+        self.assertEqual(others, {(2, 102, 1002)})
+
+        for year, month, values in ((2025, 1, self.values), (2025, 2, self.values + 1)):
+            summary = dict(SalesSummary.objects.filter(year=year, month=month, shop__name='日向')
+                           .exclude(level=SalesSummary.LEVEL_TOTAL)
+                           .values_list('category__code', 'amount_sales'))
+            sales = {code: int(values[i, 0, 0]) for i, code in enumerate(self.codes)}
+            with self.subTest(month=month):
+                self.assertEqual(summary[1], sales[5001] + sales[5002] + sales[5003])
+                self.assertEqual(summary[1001], sales[5001] + sales[5002] + sales[5003])
+                self.assertEqual(summary[2], sales[5004])
+                self.assertEqual(summary[1002], sales[5004])
+                self.assertEqual(summary[5003], sales[5003])
+
+    def test_unchanged_master_leaves_records_alone(self):
+        before = list(SalesRecord.objects.order_by('id').values_list('id', 'cat10', 'cat35', 'cat90'))
+        summary_ids = set(SalesSummary.objects.values_list('id', flat=True))
+        result = self.import_master(self.master_codes)
+
+        self.assertEqual(result['levels'][180]['updated'], 0)
+        self.assertEqual(list(SalesRecord.objects.order_by('id').values_list('id', 'cat10', 'cat35', 'cat90')), before)
+        self.assertEqual(set(SalesSummary.objects.values_list('id', flat=True)), summary_ids)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class CategoryTreeTests(SalesImportTestMixin, TestCase):
+    """プロセス内の部門ツリー（部門マスタの版が変わったときだけ読み直す）"""
+
+    def test_tree_is_shared_until_the_master_version_changes(self):
+        tree = category_tree()
+        self.assertIs(category_tree(), tree)
+        leaf = Category.objects.get(level=180, code=self.codes[2])
+        self.assertEqual([c.code for c in tree.breadcrumbs(leaf.id)], list(self.master_codes[2]))
+        self.assertEqual(tree.find(self.codes[2], 180), leaf)
+
+        self.import_master([row if row[3] != self.codes[2] else (1, 101, 1001, row[3]) for row in self.master_codes])
+        rebuilt = category_tree()
+        self.assertIsNot(rebuilt, tree)
+        self.assertEqual([c.code for c in rebuilt.breadcrumbs(leaf.id)], [1, 101, 1001, self.codes[2]])
+
+    def test_tree_without_closure_is_built_in_memory(self):
+        tree = category_tree()
+        leaf = Category.objects.get(level=180, code=self.codes[0])
+        top = Category.objects.get(level=10, code=self.master_codes[0][0])
+        CategoryClosure.objects.all().delete()
+        bump_data_version(DataVersion.CATEGORY_MASTER)
+
+        rebuilt = category_tree()
+        self.assertIsNot(rebuilt, tree)
+        self.assertIn(leaf.id, rebuilt.descendant_ids(top.id))
+        self.assertEqual(rebuilt.ancestor_ids(leaf.id)[-1], top.id)
+        # 読み込みだけを行い、閉包テーブルは作らない
+        self.assertFalse(CategoryClosure.objects.exists())
@@ -0,0 +1,245 @@
+from datetime import date
+
+import numpy as np
+import pandas as pd
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from change.benchmark import build_sales_workbook
+from change.importer import (
+    coerce_numeric_frame, import_sales_workbook, parse_sales_sheet, read_sales_sheet_streaming, read_sales_workbook,
+)
+from change.models import CustomerCount, SalesImportFingerprint, SalesRecord
+
+from .utils import TEST_CACHES, SHOPS, SalesImportTestMixin, sales_values
+
+
+@override_settings(CACHES=TEST_CACHES)
+class SalesImportTests(SalesImportTestMixin, TestCase):
+    """売上取込の一括書き込み（新規・更新の件数と書き込んだ値）"""
+
+    def test_first_import_inserts_every_row(self):
+        values = sales_values(4, 2, seed=1)
+        result = self.import_sales(date(2025, 1, 10), values, customers=[120, 80])
+
+        self.assertEqual(result['inserted'], 4 * 2 + 2)
+        self.assertEqual((result['updated'], result['unchanged'], result['deleted']), (0, 0, 0))
+        self.assertTrue(result['new_period'])
+        self.assertEqual(result['created_shops'], 2)
+        self.assertEqual(SalesRecord.objects.count(), 8)
+        record = SalesRecord.objects.get(shop__name='宮崎', category__code=self.codes[2])
+        self.assertEqual([getattr(record, f) for f in SalesRecord.METRIC_FIELDS], values[2, 1].tolist())
+        self.assertEqual(dict(CustomerCount.objects.values_list('shop__name', 'count')), {'日向': 120, '宮崎': 80})
+
+    def test_reimport_updates_changed_values_in_place(self):
+        values = sales_values(4, 2, seed=1)
+        self.import_sales(date(2025, 1, 10), values)
+        ids = set(SalesRecord.objects.values_list('id', flat=True))
+        changed = values.copy()
+        changed[1, 0] += 7
+        result = self.import_sales(date(2025, 1, 10), changed, customers=[100, 150])
+
+        self.assertEqual((result['inserted'], result['updated']), (0, 1 + 1))
+        self.assertEqual(set(SalesRecord.objects.values_list('id', flat=True)), ids)
+        record = SalesRecord.objects.get(shop__name='日向', category__code=self.codes[1])
+        self.assertEqual([getattr(record, f) for f in SalesRecord.METRIC_FIELDS], changed[1, 0].tolist())
+        self.assertEqual(CustomerCount.objects.get(shop__name='宮崎').count, 150)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class SalesDiffImportTests(SalesImportTestMixin, TestCase):
+    """同じ月の新しい報告日の取込（日付の付け替え・変更行の更新・消えた行の削除）"""
+
+    def test_later_date_redates_unchanged_rows_and_updates_changed_ones(self):
+        values = sales_values(4, 2, seed=1)
+        self.import_sales(date(2025, 1, 10), values)
+        unchanged_id = SalesRecord.objects.get(shop__name='宮崎', category__code=self.codes[3]).id
+        changed = values.copy()
+        changed[0, 0, 0] += 500
+        result = self.import_sales(date(2025, 1, 11), changed)
+
+        self.assertEqual((result['inserted'], result['updated'], result['deleted']), (0, 1, 0))
+        self.assertEqual(result['unchanged'], 4 * 2 - 1 + 2)
+        self.assertFalse(result['new_period'])
+        self.assertEqual(set(SalesRecord.objects.values_list('date', flat=True)), {date(2025, 1, 11)})
+        self.assertEqual(set(CustomerCount.objects.values_list('date', flat=True)), {date(2025, 1, 11)})
+        record = SalesRecord.objects.get(shop__name='日向', category__code=self.codes[0])
+        self.assertEqual(record.amount_sales, int(changed[0, 0, 0]))
+        # 変更のない行は削除・再挿入せず日付だけを付け替える
+        self.assertTrue(SalesRecord.objects.filter(id=unchanged_id, date=date(2025, 1, 11)).exists())
+
+    def test_rows_missing_from_later_import_are_deleted(self):
+        values = sales_values(4, 2, seed=1)
+        self.import_sales(date(2025, 1, 10), values)
+        result = self.import_sales(date(2025, 1, 11), values[:3], codes=self.codes[:3])
+
+        self.assertEqual(result['deleted'], 2)
+        self.assertEqual(SalesRecord.objects.count(), 6)
+        self.assertFalse(SalesRecord.objects.filter(category__code=self.codes[3]).exists())
+
+    def test_other_months_and_shops_are_left_alone(self):
+        values = sales_values(4, 2, seed=1)
+        self.import_sales(date(2024, 12, 31), values)
+        self.import_sales(date(2025, 1, 10), values)
+        # 1/20 の取込に含まれない店舗（宮崎）の 1/10 の行は残す
+        result = self.import_sales(date(2025, 1, 20), values, shops=['日向', '延岡'])
+
+        self.assertEqual(result['deleted'], 0)
+        self.assertEqual(SalesRecord.objects.filter(date=date(2024, 12, 31)).count(), 8)
+        self.assertEqual(set(SalesRecord.objects.filter(date=date(2025, 1, 10)).values_list('shop__name', flat=True)),
+                         {'宮崎'})
+        self.assertEqual(set(SalesRecord.objects.filter(date=date(2025, 1, 20)).values_list('shop__name', flat=True)),
+                         {'日向', '延岡'})
+
+    def test_dry_run_counts_without_writing(self):
+        self.import_sales(date(2025, 1, 10), sales_values(4, 2, seed=1))
+        before = list(SalesRecord.objects.order_by('id').values_list('id', 'date', 'amount_sales'))
+        result = self.import_sales(date(2025, 1, 11), sales_values(4, 2, seed=2), dry_run=True)
+
+        self.assertTrue(result['dry_run'])
+        self.assertEqual(result['updated'], 8)
+        self.assertEqual(list(SalesRecord.objects.order_by('id').values_list('id', 'date', 'amount_sales')), before)
+        self.assertEqual(set(CustomerCount.objects.values_list('date', flat=True)), {date(2025, 1, 10)})
+        self.assertEqual(SalesImportFingerprint.objects.count(), 1)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class DuplicateImportTests(SalesImportTestMixin, TestCase):
+    """直前の取込と同じ内容のブックの省略と、force での書き込み"""
+
+    def test_same_content_as_last_import_is_skipped(self):
+        values = sales_values(4, 2, seed=1)
+        self.import_sales(date(2025, 1, 10), values)
+        # 作り直したブック（ファイルのバイト列は異なりうる）でも解析結果が同じなら省略する
+        result = self.import_sales(date(2025, 1, 10), values)
+
+        self.assertTrue(result['skipped'])
+        self.assertEqual(result['inserted'] + result['updated'] + result['unchanged'], 0)
+        self.assertEqual(result['report_date'], date(2025, 1, 10))
+        self.assertEqual(SalesImportFingerprint.objects.count(), 1)
+
+    def test_force_writes_duplicate_import(self):
+        values = sales_values(4, 2, seed=1)
+        self.import_sales(date(2025, 1, 10), values)
+        result = self.import_sales(date(2025, 1, 10), values, force=True)
+
+        self.assertFalse(result['skipped'])
+        self.assertEqual(result['unchanged'], 4 * 2 + 2)
+        self.assertEqual(SalesImportFingerprint.objects.count(), 2)
+
+    def test_only_the_last_import_is_compared(self):
+        values = sales_values(4, 2, seed=1)
+        self.import_sales(date(2025, 1, 10), values)
+        self.import_sales(date(2025, 1, 10), values + 1)
+        result = self.import_sales(date(2025, 1, 10), values)
+
+        self.assertFalse(result['skipped'])
+        self.assertEqual(result['updated'], 4 * 2)
+
+    def test_master_import_resets_fingerprints(self):
+        values = sales_values(4, 2, seed=1)
+        self.import_sales(date(2025, 1, 10), values)
+        # 部門マスタが変わると同じブックでも取込結果が変わりうるため、次の取込は省略しない
+        self.import_master(self.master_codes)
+        self.assertFalse(SalesImportFingerprint.objects.exists())
+        self.assertFalse(self.import_sales(date(2025, 1, 10), values)['skipped'])
+
+
+class CoerceNumericFrameTests(SimpleTestCase):
+    """列単位の数値化（空欄・カンマ付きの文字列・数値でないセル）"""
+
+    def test_numeric_columns_keep_values_and_blanks_become_zero(self):
+        frame = pd.DataFrame({0: [1, np.nan, 3.9, -2.5], 1: [10, 20, 30, 40]})
+        self.assertEqual(coerce_numeric_frame(frame).tolist(), [[1, 10], [0, 20], [3, 30], [-2, 40]])
+
+    def test_strings_with_commas_and_spaces_are_parsed(self):
+        frame = pd.DataFrame({0: ['1,234', ' 56 ', '7,000.5', '-1,200']})
+        self.assertEqual(coerce_numeric_frame(frame)[:, 0].tolist(), [1234, 56, 7000, -1200])
+
+    def test_non_numeric_cells_become_zero(self):
+        frame = pd.DataFrame({0: ['-', None, '', 'abc'], 1: ['前年比', 12.7, '%', float('inf')]})
+        self.assertEqual(coerce_numeric_frame(frame).tolist(), [[0, 0], [0, 12], [0, 0], [0, 0]])
+
+    def test_result_is_int64(self):
+        frame = pd.DataFrame({0: ['1,000', 2], 1: [3.0, None]})
+        self.assertEqual(coerce_numeric_frame(frame).dtype, np.int64)
+
+
+class ParseSalesSheetTests(SimpleTestCase):
+    """180部門明細シートの解析（日付・店舗列・客数行・部門行）"""
+
+    def sheet(self):
+        rows = [
+            ['チェンジ速報', None, None, None, None, None, None, '2025年3月15日', None, None, None, None],
+            [None] * 12,
+            [None, None, '日向', None, None, None, None, '宮崎', None, None, None, None],
+            [None, None, '前年比', None, None, None, None, '前年比', None, None, None, None],
+            [None, None, '販売', '買取', '仕入', 'ネット', '粗利', '販売', '買取', '仕入', 'ネット', '粗利'],
+            ['客 数', None, 321, None, None, None, None, '1,050', None, None, None, None],
+            [5001, '部門5001', '1,234', None, '-', 10, 5.5, 2000, 1, 2, 3, 4],
+            ['5002', '部門5002', None, None, None, None, None, 'x', 7, None, None, None],
+            ['合計', None, 1234, 0, 0, 10, 5, 2000, 8, 2, 3, 4],
+        ]
+        return pd.DataFrame(rows)
+
+    def test_parses_header_customers_and_department_rows(self):
+        parsed = parse_sales_sheet(self.sheet())
+        self.assertEqual(parsed['report_date'], date(2025, 3, 15))
+        self.assertEqual(parsed['shop_names'], ['日向', '宮崎'])
+        self.assertEqual(parsed['customers'].tolist(), [321, 1050])
+        self.assertEqual(parsed['codes'].tolist(), [5001, 5002])
+        self.assertEqual(parsed['values'].tolist(), [
+            [[1234, 0, 0, 10, 5], [2000, 1, 2, 3, 4]],
+            [[0, 0, 0, 0, 0], [0, 7, 0, 0, 0]],
+        ])
+
+    def test_excluded_names_are_skipped_when_finding_shop_names(self):
+        sheet = self.sheet()
+        sheet.iat[3, 7] = '大分類1'
+        self.assertEqual(parse_sales_sheet(sheet)['shop_names'], ['日向', '大分類1'])
+        self.assertEqual(parse_sales_sheet(sheet, exclude_names={'大分類1'})['shop_names'], ['日向', '宮崎'])
+
+
+@override_settings(CACHES=TEST_CACHES)
+class StreamingReaderTests(SalesImportTestMixin, TestCase):
+    """openpyxl の read-only 逐次読込が pandas での読込と同じ結果になること"""
+
+    def workbook(self):
+        values = sales_values(4, 3, seed=5)
+        values[0, 1] = 0            # 空欄のセル
+        values[2, 0, 0] = 7 * 1111  # 「7,777」形式の文字列で書かれるセル
+        return build_sales_workbook(date(2025, 4, 30), SHOPS + ['延岡'], self.codes, values, [10, 0, 30]), values
+
+    def assertSameParse(self, streamed, parsed):
+        self.assertEqual(streamed['report_date'], parsed['report_date'])
+        self.assertEqual(streamed['shop_names'], parsed['shop_names'])
+        self.assertEqual(streamed['codes'].tolist(), parsed['codes'].tolist())
+        self.assertEqual(streamed['values'].tolist(), parsed['values'].tolist())
+        self.assertEqual(streamed['customers'].tolist(), parsed['customers'].tolist())
+
+    def test_streaming_parse_matches_pandas_parse(self):
+        data, values = self.workbook()
+        parsed = read_sales_workbook(self.upload(data), streaming=False)
+        self.assertSameParse(read_sales_workbook(self.upload(data), streaming=True), parsed)
+        self.assertEqual(parsed['values'].tolist(), values.tolist())
+        self.assertEqual(parsed['customers'].tolist(), [10, 0, 30])
+
+    def test_small_chunks_give_the_same_result(self):
+        data, _ = self.workbook()
+        parsed = read_sales_workbook(self.upload(data), streaming=False)
+        for chunk_rows in (1, 2, 3):
+            with self.subTest(chunk_rows=chunk_rows):
+                self.assertSameParse(read_sales_sheet_streaming(self.upload(data), chunk_rows=chunk_rows), parsed)
+
+    def test_both_readers_write_the_same_records(self):
+        data, _ = self.workbook()
+        self.import_file(data, streaming=True)
+        result = self.import_file(data, streaming=False, force=True)
+        self.assertEqual((result['inserted'], result['updated'], result['deleted']), (0, 0, 0))
+        self.assertEqual(result['unchanged'], 4 * 3 + 2)
+
+    def upload(self, data):
+        return SimpleUploadedFile('sales.xlsx', data)
+
+    def import_file(self, data, **kwargs):
+        return import_sales_workbook(self.upload(data), **kwargs)
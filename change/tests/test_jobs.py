@@ -0,0 +1,127 @@
+import os
+import shutil
+import tempfile
+from datetime import date, timedelta
+from unittest import mock
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from change.jobs import STALE_JOB_MESSAGE, claim_next_job, enqueue_import_job, job_status_payload, run_job
+from change.models import ImportJob, SalesRecord
+
+from .utils import TEST_CACHES, SalesImportTestMixin, sales_values
+
+
+class ImportJobTestMixin:
+    """アップロードファイルを一時ディレクトリに保存し、ワーカースレッドを起こさずにジョブを実行する"""
+
+    def setUp(self):
+        super().setUp()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        settings = override_settings(MEDIA_ROOT=self.media_root, IMPORT_JOBS_RUN_IN_PROCESS=False,
+                                     IMPORT_JOB_TIMEOUT_SECONDS=60, CACHES=TEST_CACHES)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def create_job(self, **fields):
+        job = ImportJob(kind=ImportJob.KIND_SALES, original_name='sales.xlsx', **fields)
+        job.file.save('sales.xlsx', SimpleUploadedFile('sales.xlsx', b''), save=False)
+        job.save()
+        return job
+
+
+class ImportJobTests(ImportJobTestMixin, SalesImportTestMixin, TestCase):
+    """取込ジョブの登録・実行・進捗確認"""
+
+    def test_enqueue_run_and_status(self):
+        upload = self.sales_workbook(date(2025, 1, 10), sales_values(4, 2, seed=1))
+        job = enqueue_import_job(ImportJob.KIND_SALES, upload)
+        path = job.file.path
+        self.assertEqual(job.status, ImportJob.STATUS_PENDING)
+        self.assertTrue(job.file.storage.exists(job.file.name))
+
+        claimed = claim_next_job()
+        self.assertEqual((claimed.id, claimed.status), (job.id, ImportJob.STATUS_RUNNING))
+        run_job(claimed)
+        job.refresh_from_db()
+
+        self.assertEqual(job.status, ImportJob.STATUS_DONE)
+        self.assertEqual(job.result['inserted'], 4 * 2 + 2)
+        self.assertEqual(job.result['report_date'], '2025-01-10')
+        self.assertEqual(set(job.timings), {'fingerprint', 'parse', 'diff', 'write', 'summary', 'cache'})
+        self.assertEqual(SalesRecord.objects.count(), 8)
+        # 完了したジョブのアップロードファイルは残さない
+        self.assertFalse(job.file)
+        self.assertFalse(os.path.exists(path))
+
+        payload = job_status_payload(job)
+        self.assertEqual(payload['status'], ImportJob.STATUS_DONE)
+        self.assertEqual(payload['file'], '20250110.xlsx')
+        self.assertIn('取り込み完了', payload['message'])
+        response = self.client.get(reverse('import_job_status', args=[job.id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), payload)
+
+    def test_failed_job_records_error_and_deletes_file(self):
+        job = enqueue_import_job(ImportJob.KIND_SALES, SimpleUploadedFile('broken.xlsx', b'not a workbook'))
+        path = job.file.path
+        with self.assertLogs('change.jobs', 'ERROR'):
+            run_job(claim_next_job())
+        job.refresh_from_db()
+
+        self.assertEqual(job.status, ImportJob.STATUS_FAILED)
+        self.assertTrue(job.message.startswith('エラー:'))
+        self.assertFalse(job.file)
+        self.assertFalse(os.path.exists(path))
+        self.assertFalse(SalesRecord.objects.exists())
+
+    def test_unknown_job_is_404(self):
+        self.assertEqual(self.client.get(reverse('import_job_status', args=[999])).status_code, 404)
+
+
+class StaleImportJobTests(ImportJobTestMixin, TestCase):
+    """ワーカーの停止で実行中のまま残ったジョブの回収"""
+
+    def test_stale_running_job_is_failed_before_claiming(self):
+        stale = self.create_job(status=ImportJob.STATUS_RUNNING, started_at=timezone.now() - timedelta(minutes=5))
+        stale_path = stale.file.path
+        running = self.create_job(status=ImportJob.STATUS_RUNNING, started_at=timezone.now())
+        pending = self.create_job()
+
+        with self.assertLogs('change.jobs', 'WARNING'):
+            self.assertEqual(claim_next_job().id, pending.id)
+        stale.refresh_from_db()
+        running.refresh_from_db()
+        self.assertEqual(stale.status, ImportJob.STATUS_FAILED)
+        self.assertEqual(stale.message, STALE_JOB_MESSAGE)
+        self.assertFalse(stale.file)
+        self.assertFalse(os.path.exists(stale_path))
+        self.assertEqual(running.status, ImportJob.STATUS_RUNNING)
+        self.assertTrue(running.file.storage.exists(running.file.name))
+
+
+class ImportJobWorkerTests(ImportJobTestMixin, TestCase):
+    """ワーカースレッドはアップロードで起こし、進捗確認では起こさない"""
+
+    def test_status_poll_does_not_start_the_worker(self):
+        job = self.create_job()
+        with override_settings(IMPORT_JOBS_RUN_IN_PROCESS=True), \
+                mock.patch('change.jobs._submit_worker') as submit:
+            response = self.client.get(reverse('import_job_status', args=[job.id]))
+        self.assertEqual(response.json()['status'], ImportJob.STATUS_PENDING)
+        submit.assert_not_called()
+
+    def test_upload_starts_the_worker_after_commit(self):
+        with override_settings(IMPORT_JOBS_RUN_IN_PROCESS=True), \
+                mock.patch('change.jobs._submit_worker') as submit:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(reverse('upload_sales'),
+                                            {'file': SimpleUploadedFile('sales.xlsx', b'data')})
+                submit.assert_not_called()
+        self.assertEqual(response.status_code, 302)
+        submit.assert_called_once_with()
+        self.assertEqual(ImportJob.objects.get().status, ImportJob.STATUS_PENDING)
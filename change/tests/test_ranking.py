@@ -0,0 +1,103 @@
+from collections import defaultdict
+from datetime import date
+
+from django.test import TestCase, override_settings
+
+from change.models import Category, SalesSummary
+from change.ranking import category_profit_ranking, category_sales_ranking, shop_sales_ranking
+from change.summary import snapshot_periods
+
+from .utils import TEST_CACHES, SalesImportTestMixin, sales_values
+
+
+@override_settings(CACHES=TEST_CACHES)
+class SalesRankingTests(SalesImportTestMixin, TestCase):
+    """ウィンドウ関数による順位・構成比が Python で並べた結果と一致すること"""
+
+    def setUp(self):
+        super().setUp()
+        self.shops = ['日向', '宮崎', '和歌山', '加治']
+        for report_date, seed in ((date(2024, 12, 31), 1), (date(2025, 6, 30), 2)):
+            values = sales_values(4, 4, seed)
+            values[1, 2] = values[1, 3]   # 同額の部門・店舗があっても順位は重ならない
+            if report_date.year == 2025:
+                values[:, 3] = values[:, 2]
+            self.import_sales(report_date, values, shops=self.shops)
+
+    @staticmethod
+    def rank(totals, order):
+        """{年: {名前: 金額}} -> {(年, 名前): (順位, 金額, 構成比)}"""
+        expected = {}
+        for year, amounts in totals.items():
+            total = sum(amounts.values())
+            for i, name in enumerate(sorted(amounts, key=lambda n: (-amounts[n], order(n))), start=1):
+                expected[(year, name)] = (i, amounts[name], round(amounts[name] * 100 / total, 1) if total else 0)
+        return expected
+
+    def test_shop_ranking_matches_python(self):
+        periods = snapshot_periods()
+        totals = defaultdict(lambda: defaultdict(int))
+        display = {'和歌山': '和歌', '加治': '加治木'}
+        for year, (month, _) in periods.items():
+            for name, amount in SalesSummary.objects.filter(
+                    year=year, month=month, level=SalesSummary.LEVEL_TOTAL).values_list('shop__name', 'amount_sales'):
+                totals[year][display.get(name, name)] += amount
+        expected = self.rank(totals, order=lambda name: name)
+        self.assertEqual(totals[2025]['和歌'], totals[2025]['加治木'])
+
+        rows = shop_sales_ranking(periods)
+        self.assertEqual({(r['year'], r['shop_name']): (r['rank'], r['amount'], r['share']) for r in rows}, expected)
+        self.assertEqual(sorted(r['rank'] for r in rows if r['year'] == 2025), [1, 2, 3, 4])
+        previous = {(r['year'], r['shop_name']): (r['prev_year'], r['prev_rank']) for r in rows}
+        self.assertEqual(previous[(2025, '日向')], (2024, expected[(2024, '日向')][0]))
+        self.assertEqual(previous[(2024, '日向')], (None, None))
+
+    def test_shop_ranking_of_one_category(self):
+        periods = snapshot_periods()
+        category = Category.objects.get(level=180, code=self.codes[1])
+        rows = shop_sales_ranking(periods, category=category)
+        amounts = {(r['year'], r['shop_name']): r['amount'] for r in rows}
+        for year, (month, _) in periods.items():
+            for name, amount in SalesSummary.objects.filter(
+                    year=year, month=month, category=category).values_list('shop__name', 'amount_sales'):
+                self.assertEqual(amounts[(year, {'和歌山': '和歌', '加治': '加治木'}.get(name, name))], amount)
+
+    def test_category_ranking_matches_python(self):
+        periods = snapshot_periods()
+        categories = list(Category.objects.filter(level=180))
+        codes = {c.id: c.code for c in categories}
+        totals = defaultdict(lambda: defaultdict(int))
+        for year, (month, _) in periods.items():
+            for category_id, amount in SalesSummary.objects.filter(
+                    year=year, month=month, category__in=categories).values_list('category_id', 'amount_sales'):
+                totals[year][category_id] += amount
+        expected = self.rank(totals, order=lambda category_id: (codes[category_id], category_id))
+
+        rows = category_sales_ranking(periods, categories)
+        self.assertEqual({(r['year'], r['category_id']): (r['rank'], r['amount'], r['share']) for r in rows},
+                         expected)
+
+    def test_profit_ranking_matches_python(self):
+        periods = snapshot_periods()
+        categories = {c.id: c.code for c in Category.objects.filter(level=10)}
+        totals = defaultdict(lambda: defaultdict(lambda: [0, 0]))
+        for year, (month, _) in periods.items():
+            for category_id, sales, profit in SalesSummary.objects.filter(
+                    year=year, month=month, level=10).values_list('category_id', 'amount_sales', 'amount_profit'):
+                totals[year][category_id][0] += sales
+                totals[year][category_id][1] += profit
+
+        rows = category_profit_ranking(periods, level=10)
+        for year, amounts in totals.items():
+            margins = {cid: profit * 100 / sales if sales > 0 else 0 for cid, (sales, profit) in amounts.items()}
+            by_sales = sorted(amounts, key=lambda cid: (-amounts[cid][0], categories[cid], cid))
+            by_margin = sorted(amounts, key=lambda cid: (-margins[cid], categories[cid], cid))
+            self.assertEqual(sorted(r['category_id'] for r in rows if r['year'] == year), sorted(amounts))
+            for row in (r for r in rows if r['year'] == year):
+                cid = row['category_id']
+                with self.subTest(year=year, category=cid):
+                    self.assertEqual((row['sales'], row['profit']), tuple(amounts[cid]))
+                    self.assertAlmostEqual(row['margin'], margins[cid], delta=0.05)
+                    self.assertEqual(row['sales_rank'], by_sales.index(cid) + 1)
+                    self.assertEqual(row['profit_rank'], by_margin.index(cid) + 1)
+                    self.assertEqual(row['gap'], row['sales_rank'] - row['profit_rank'])
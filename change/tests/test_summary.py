@@ -0,0 +1,107 @@
+from collections import defaultdict
+from datetime import date
+
+from django.test import TestCase, override_settings
+
+from change.benchmark import build_master_codes
+from change.models import Category, SalesPeriod, SalesRecord, SalesSummary
+from change.summary import rebuild_month_summary
+
+from .utils import TEST_CACHES, SalesImportTestMixin, sales_values
+
+METRIC_FIELDS = SalesRecord.METRIC_FIELDS
+
+
+@override_settings(CACHES=TEST_CACHES)
+class MonthSummaryTests(SalesImportTestMixin, TestCase):
+    """rebuild_month_summary の各階層の行と合計行を、SalesRecord を直接集計した値と比べる"""
+
+    def setUp(self):
+        super().setUp()
+        # 35/90 部門が複数の子を持つ部門マスタ（10部門 2 件 × 35部門 2 件 × 90部門 2 件 × 180部門 2 件）
+        self.master_codes = build_master_codes(n10=2, per=(2, 2, 2))
+        self.codes = [row[3] for row in self.master_codes]
+        self.import_master(self.master_codes)
+
+    def direct_totals(self, year, month):
+        """店舗ごとの最新日の SalesRecord を、部門の親をたどって各階層へ積み上げた {(店舗名, 階層, 部門コード): 値}"""
+        parents = {c.id: c for c in Category.objects.all()}
+        totals = defaultdict(lambda: [0] * len(METRIC_FIELDS))
+        records = SalesRecord.objects.filter(date__year=year, date__month=month).select_related('shop', 'category')
+        latest = {}
+        for record in records:
+            latest[record.shop.name] = max(latest.get(record.shop.name, record.date), record.date)
+        for record in records:
+            if record.date != latest[record.shop.name]:
+                continue
+            values = [getattr(record, f) for f in METRIC_FIELDS]
+            category = record.category
+            while category is not None:
+                row = totals[(record.shop.name, category.level, category.code)]
+                row[:] = [a + b for a, b in zip(row, values)]
+                category = parents.get(category.parent_id)
+            row = totals[(record.shop.name, SalesSummary.LEVEL_TOTAL, None)]
+            row[:] = [a + b for a, b in zip(row, values)]
+        return dict(totals)
+
+    def summary_totals(self, year, month):
+        rows = SalesSummary.objects.filter(year=year, month=month).values_list(
+            'shop__name', 'level', 'category__code', *METRIC_FIELDS)
+        return {(shop, level, code): list(values) for shop, level, code, *values in rows}
+
+    def test_every_level_matches_a_direct_aggregate(self):
+        self.import_sales(date(2025, 3, 10), sales_values(16, 2, seed=3))
+        self.import_sales(date(2025, 3, 20), sales_values(16, 2, seed=4), customers=[5000, 7000])
+
+        created = rebuild_month_summary(2025, 3)
+        summary = self.summary_totals(2025, 3)
+        self.assertEqual(created, len(summary))
+        self.assertEqual(summary, self.direct_totals(2025, 3))
+        # 店舗ごとに 10/35/90/180 部門 2 + 4 + 8 + 16 行と合計行
+        self.assertEqual(created, 2 * (2 + 4 + 8 + 16 + 1))
+        self.assertEqual(set(SalesSummary.objects.filter(year=2025, month=3).values_list('date', flat=True)),
+                         {date(2025, 3, 20)})
+
+    def test_total_row_excludes_customer_counts(self):
+        values = sales_values(16, 2, seed=5)
+        self.import_sales(date(2025, 3, 10), values, customers=[123456, 654321])
+        rebuild_month_summary(2025, 3)
+
+        totals = dict(SalesSummary.objects.filter(year=2025, month=3, level=SalesSummary.LEVEL_TOTAL)
+                      .values_list('shop__name', 'amount_sales'))
+        self.assertEqual(totals, {'日向': int(values[:, 0, 0].sum()), '宮崎': int(values[:, 1, 0].sum())})
+
+    def test_month_without_data_is_emptied(self):
+        self.import_sales(date(2025, 3, 10), sales_values(16, 2, seed=6))
+        SalesRecord.objects.all().delete()
+        self.assertEqual(rebuild_month_summary(2025, 3), 0)
+        self.assertFalse(SalesSummary.objects.filter(year=2025, month=3).exists())
+
+
+@override_settings(CACHES=TEST_CACHES)
+class ShopSnapshotSummaryTests(SalesImportTestMixin, TestCase):
+    """月の最終取込に含まれない店舗は、その店舗のその月の最新日で集計する"""
+
+    def test_month_summary_uses_each_shops_latest_date(self):
+        values = sales_values(4, 2, seed=1)
+        self.import_sales(date(2025, 2, 10), values)
+        later = values + 1
+        # 月末の取込に含まれない店舗（宮崎）は、その店舗の最新日（2/10）の値で集計する
+        self.import_sales(date(2025, 2, 28), later, shops=['日向', '延岡'])
+
+        totals = {name: (day, amount) for name, day, amount in SalesSummary.objects.filter(
+            year=2025, month=2, level=SalesSummary.LEVEL_TOTAL).values_list('shop__name', 'date', 'amount_sales')}
+        self.assertEqual(totals, {
+            '日向': (date(2025, 2, 28), int(later[:, 0, 0].sum())),
+            '延岡': (date(2025, 2, 28), int(later[:, 1, 0].sum())),
+            '宮崎': (date(2025, 2, 10), int(values[:, 1, 0].sum())),
+        })
+        period = SalesPeriod.objects.get(year=2025, month=2)
+        self.assertEqual((period.snapshot_date, period.shop_count), (date(2025, 2, 28), 3))
+
+    def test_later_month_does_not_carry_absent_shops(self):
+        self.import_sales(date(2025, 2, 10), sales_values(4, 2, seed=1))
+        self.import_sales(date(2025, 3, 10), sales_values(4, 2, seed=2), shops=['日向', '延岡'])
+
+        shops = set(SalesSummary.objects.filter(year=2025, month=3).values_list('shop__name', flat=True))
+        self.assertEqual(shops, {'日向', '延岡'})
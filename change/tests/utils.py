@@ -0,0 +1,42 @@
+"""テストの共通処理（小さな部門マスタと売上ブックを生成して取り込む）"""
+import numpy as np
+from django.core.files.uploadedfile import SimpleUploadedFile
+
+from change.benchmark import build_master_codes, build_master_workbook, build_sales_workbook
+from change.importer import import_category_master, import_sales_workbook
+from change.versions import forget_data_versions
+
+# テストではプロセス内のキャッシュだけを使う（BASE_DIR/cache に書かない）
+TEST_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'change-tests'}}
+
+SHOPS = ['日向', '宮崎']
+
+
+def sales_values(n_codes, n_shops, seed):
+    """部門 n_codes × 店舗 n_shops の累計値（0 は空欄になるため 1 以上にする）"""
+    rng = np.random.default_rng(seed)
+    return rng.integers(1, 100000, size=(n_codes, n_shops, 5), dtype=np.int64)
+
+
+class SalesImportTestMixin:
+    """小さな部門マスタ（10部門 2 件 × 180部門 2 件ずつ）を取り込んでおくテストの共通処理"""
+
+    def setUp(self):
+        super().setUp()
+        # 前のテストの版のスナップショット（ロールバック済みの版）を使わない
+        forget_data_versions()
+        self.master_codes = build_master_codes(n10=2, per=(1, 1, 2))
+        self.codes = [row[3] for row in self.master_codes]
+        self.import_master(self.master_codes)
+
+    def import_master(self, master_codes):
+        return import_category_master(SimpleUploadedFile('master.xlsx', build_master_workbook(master_codes)))
+
+    def sales_workbook(self, report_date, values, shops=SHOPS, codes=None, customers=None):
+        codes = self.codes if codes is None else codes
+        customers = [100 + i for i in range(len(shops))] if customers is None else customers
+        data = build_sales_workbook(report_date, shops, codes, values, customers)
+        return SimpleUploadedFile(f'{report_date:%Y%m%d}.xlsx', data)
+
+    def import_sales(self, report_date, values, shops=SHOPS, codes=None, customers=None, **kwargs):
+        return import_sales_workbook(self.sales_workbook(report_date, values, shops, codes, customers), **kwargs)
@@ -0,0 +1,57 @@
+"""データの版 (DataVersion) の参照と更新
+
+版は更新のたびに新しい乱数値になる。プロセス内キャッシュや派生データは、
+作成時の版を保持しておき、現在の版と違えば作り直す。
+
+版の参照はリクエストごとに何度も行われるため、すべての版をプロセス内に 1 つのスナップショットとして持ち、
+settings.DATA_VERSION_CHECK_INTERVAL 秒（既定 1 秒）ごとに 1 クエリで読み直す。自プロセスでの更新は
+すぐに読み直し、他のプロセスでの更新はこの間隔以内に反映される。
+"""
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import DataVersion
+
+_snapshot = None    # (読み込んだ時刻, {名前: 版})
+_snapshot_lock = threading.Lock()
+
+
+def _check_interval():
+    return getattr(settings, 'DATA_VERSION_CHECK_INTERVAL', 1.0)
+
+
+def data_versions():
+    """すべての版 {名前: 版}（プロセス内のスナップショット。古くなったら 1 クエリで読み直す）"""
+    global _snapshot
+    snapshot = _snapshot
+    if snapshot is not None and time.monotonic() - snapshot[0] < _check_interval():
+        return snapshot[1]
+    with _snapshot_lock:
+        if _snapshot is None or time.monotonic() - _snapshot[0] >= _check_interval():
+            _snapshot = (time.monotonic(), dict(DataVersion.objects.values_list('name', 'version')))
+        return _snapshot[1]
+
+
+def forget_data_versions():
+    """スナップショットを捨て、次の参照で版を読み直させる"""
+    global _snapshot
+    _snapshot = None
+
+
+def get_data_version(name):
+    """name の現在の版（まだ一度も更新されていなければ None）"""
+    return data_versions().get(name)
+
+
+def bump_data_version(name):
+    """name の版を新しい値に置き換えて返す（呼び出し側のトランザクション内で更新される）"""
+    version = uuid.uuid4().hex
+    DataVersion.objects.update_or_create(name=name, defaults={'version': version})
+    # 同じトランザクション内の参照と、コミット後の参照のどちらにも新しい版が見えるようにする
+    forget_data_versions()
+    transaction.on_commit(forget_data_versions)
+    return version
@@ -1,20 +1,28 @@
-import pandas as pd
 import re
 import json
+import hashlib
 from datetime import datetime, date
 from django.shortcuts import render, redirect
+from django.urls import reverse
 from django.contrib import messages
 from django.db.models import Sum, Max
-from django.db import transaction
-from django.views.decorators.cache import cache_page
+from django.db.models.functions import ExtractYear
 from django.core.cache import cache
-from .models import Category, Shop, SalesRecord
-from .forms import ExcelUploadForm
-import threading 
+from .models import Category, CustomerCount, Shop, SalesRecord, SalesSummary, ImportJob
+from .forms import ExcelUploadForm, SalesUploadForm
+from .jobs import enqueue_import_job, job_status_payload
+from .caching import (
+    ALL_DATES_CACHE_KEY, ALL_PERIODS, cache_sales_page, cached_payload, cached_period_values,
+    cached_shop_vectors, month_periods, pack_ints, sales_cache_key, unpack_ints, year_month_periods,
+)
+from .cube import get_sales_cube
+from .hierarchy import category_tree, hierarchy_filter
+from .ranking import category_profit_ranking, category_sales_ranking, shop_sales_ranking
+from .summary import closed_period_check, latest_sales_year, period_months, snapshot_periods, snapshot_summary
 import calendar
 import logging
 import csv
-from django.http import HttpResponse
+from django.http import HttpResponse, JsonResponse
 from collections import OrderedDict
 
 # --- ヘルパー関数 ---
@@ -72,407 +80,94 @@ def normalize_shop_name(n):
         return n
 
 def get_descendant_category_ids(dept10_code):
-    
-    # 【修正】キャッシュチェック
-    cache_key = f'descendants_{dept10_code}'
-    ids = cache.get(cache_key)
-    
-    if ids is not None:
-        return ids
-        
-    try:
-        root = Category.objects.get(code=dept10_code, level=10)
-    except Category.DoesNotExist:
-        return []
-    ids = {root.id}
-    l35 = Category.objects.filter(parent=root)
-    ids.update(l35.values_list('id', flat=True))
-    l90 = Category.objects.filter(parent__in=l35)
-    ids.update(l90.values_list('id', flat=True))
-    l180 = Category.objects.filter(parent__in=l90)
-    ids.update(l180.values_list('id', flat=True))
-    
-    # 【修正】キャッシュに保存 (1週間)
-    ids_list = list(ids)
-    cache.set(cache_key, ids_list, 60 * 60 * 24 * 7)
-    return ids_list
+    """10 部門コードの部門と、その下位のすべての部門の id を返す。"""
+    return get_descendant_ids_for_category(dept10_code, 10)
 
 
 def get_descendant_ids_for_category(code, level):
     """指定した code と level のカテゴリの id を含め、下位のすべてのカテゴリ id を返す。"""
-    cache_key = f'descendants_gen_{level}_{code}'
-    ids = cache.get(cache_key)
-    if ids is not None:
-        return ids
-    try:
-        root = Category.objects.get(code=code, level=level)
-    except Category.DoesNotExist:
-        return []
-    ids_set = {root.id}
-    current = [root]
-    # 幅優先で子孫をたどる。children を ids_set に追加してから
-    # 次の current を決めると深さ 1 で終わってしまうため、
-    # children を取得 -> next_current を準備 -> ids_set を更新、という順にする。
-    while current:
-        children = list(Category.objects.filter(parent__in=current))
-        if not children:
-            break
-        next_current = []
-        for c in children:
-            if c.id not in ids_set:
-                next_current.append(c)
-        # 新たに見つかった子を ids_set に追加し、ループを続ける
-        for c in next_current:
-            ids_set.add(c.id)
-        current = next_current
-
-    # ループ完了後にキャッシュして返す
-    ids_list = list(ids_set)
-    cache.set(cache_key, ids_list, 60 * 60 * 24 * 7)
-    return ids_list
+    tree = category_tree()
+    root = tree.find(code, level)
+    return list(tree.descendant_ids(root.id)) if root else []
 
 
 # キャッシュ付きで全日付リストを取得する（.dates() の全表走査を避けるため）
 def get_all_dates_cached(ttl=60 * 60 * 24):
-    cache_key = 'salesrecord_all_dates'
+    cache_key = sales_cache_key(ALL_DATES_CACHE_KEY)
     dates = cache.get(cache_key)
     if dates is not None:
         return dates
     try:
-        qs = SalesRecord.objects.values_list('date', flat=True).distinct().order_by('date')
-        dates = list(qs)
+        # 客数だけの取込日も含める
+        dates = sorted(
+            set(SalesRecord.objects.values_list('date', flat=True).distinct().order_by())
+            | set(CustomerCount.objects.values_list('date', flat=True).distinct().order_by())
+        )
         cache.set(cache_key, dates, ttl)
         return dates
     except Exception:
         return []
 
 
-def get_category_180_groups_cached(ttl=60 * 60 * 24 * 7):
-    """180部門ごとに、その上位(90,35,10)の ancestor をまとめて返す。
-
-    返り値: {
-        'by_180': {180_id: {'90': id_or_None, '35': id_or_None, '10': id_or_None}},
-        'by_90': {90_id: [180_id,...]},
-        'by_35': {35_id: [180_id,...]},
-        'by_10': {10_id: [180_id,...]},
-    }
-    キャッシュ化してビュー側の多重クエリを防止する。
-    """
-    cache_key = 'category_180_groups'
-    groups = cache.get(cache_key)
-    if groups is not None:
-        return groups
-
-    qs = Category.objects.filter(level=180).select_related('parent__parent__parent')
-    by_180 = {}
-    by_90 = {}
-    by_35 = {}
-    by_10 = {}
-
-    for c in qs:
-        id180 = c.id
-        p90 = getattr(c, 'parent', None)
-        p35 = getattr(p90, 'parent', None) if p90 else None
-        p10 = getattr(p35, 'parent', None) if p35 else None
-
-        by_180[id180] = {'90': p90.id if p90 else None, '35': p35.id if p35 else None, '10': p10.id if p10 else None}
-
-        if p90:
-            by_90.setdefault(p90.id, []).append(id180)
-        if p35:
-            by_35.setdefault(p35.id, []).append(id180)
-        if p10:
-            by_10.setdefault(p10.id, []).append(id180)
-
-    groups = {'by_180': by_180, 'by_90': by_90, 'by_35': by_35, 'by_10': by_10}
-    cache.set(cache_key, groups, ttl)
-    return groups
-
 # --- run_sales_aggregation 関数は不使用のため削除 ---
 def run_sales_aggregation(report_date):
     pass 
 
 def upload_category_master(request):
     """
-    部門マスタ(10-35-90-180階層)の一括登録
+    部門マスタ(10-35-90-180階層)の一括登録（取込ジョブとして登録し、すぐに応答する）
     """
     if request.method == 'POST':
         form = ExcelUploadForm(request.POST, request.FILES)
         if form.is_valid():
             try:
-                df = pd.read_excel(request.FILES['file'], header=None, engine='openpyxl')
-                
-                with transaction.atomic():
-                    for index, row in df.iloc[1:].iterrows():
-                        if pd.isna(row[0]): continue
-
-                        # 10部門
-                        code_10 = int(row[0])
-                        name_10 = str(row[1])
-                        cat_10, _ = Category.objects.get_or_create(code=code_10, level=10, defaults={'name': name_10})
-                        if cat_10.name != name_10:
-                            cat_10.name = name_10
-                            cat_10.save()
-
-                        # 35部門
-                        code_35 = int(row[2])
-                        name_35 = str(row[3])
-                        cat_35, _ = Category.objects.get_or_create(code=code_35, level=35, defaults={'name': name_35, 'parent': cat_10})
-                        if cat_35.name != name_35 or cat_35.parent != cat_10:
-                            cat_35.name = name_35
-                            cat_35.parent = cat_10
-                            cat_35.save()
-
-                        # 90部門
-                        code_90 = int(row[4])
-                        name_90 = str(row[5])
-                        cat_90, _ = Category.objects.get_or_create(code=code_90, level=90, defaults={'name': name_90, 'parent': cat_35})
-                        if cat_90.name != name_90 or cat_90.parent != cat_35:
-                            cat_90.name = name_90
-                            cat_90.parent = cat_35
-                            cat_90.save()
-
-                        # 180部門
-                        code_180 = int(row[6])
-                        name_180 = str(row[7])
-                        cat_180, _ = Category.objects.get_or_create(code=code_180, level=180, defaults={'name': name_180, 'parent': cat_90})
-                        if cat_180.name != name_180 or cat_180.parent != cat_90:
-                            cat_180.name = name_180
-                            cat_180.parent = cat_90
-                            cat_180.save()
-
-                # データ更新後にキャッシュをクリアする（重要）
-                cache.clear()
-                messages.success(request, "部門マスタの取り込みが完了しました！")
-                return redirect('admin:index')
-
+                job = enqueue_import_job(ImportJob.KIND_MASTER, request.FILES['file'])
+                messages.info(request, f"部門マスタの取り込みを受け付けました。(ジョブ #{job.id})")
+                return redirect(f"{reverse('upload_master')}?job={job.id}")
             except Exception as e:
                 messages.error(request, f"エラーが発生しました: {e}")
     else:
         form = ExcelUploadForm()
 
-    return render(request, 'admin/master_upload.html', {'form': form, 'title': '部門マスタ取込'})
+    return render(request, 'admin/master_upload.html', {'form': form, 'title': '部門マスタ取込', 'job': _requested_import_job(request)})
 
 
 def upload_sales_data(request):
     """
-    売上実績データ取込
+    売上実績データ取込（取込ジョブとして登録し、すぐに応答する）
     """
     if request.method == 'POST':
-        form = ExcelUploadForm(request.POST, request.FILES)
+        form = SalesUploadForm(request.POST, request.FILES)
         if form.is_valid():
             try:
-                # --- 【共通ヘルパー関数をここで定義】 ---
-                def get_val(row, col_idx, offset):
-                    """指定行、基点列、オフセットから整数値を取得する"""
-                    target_idx = col_idx + offset
-                    if target_idx < len(row):
-                        v = row[target_idx]
-                        if pd.isna(v): return 0
-                        if isinstance(v, str):
-                            v = v.replace(',', '').strip()
-                            if v == '' or v == '-': return 0
-                        try: return int(float(v))
-                        except: return 0
-                    return 0
-                
-                excel_file = request.FILES['file']
-                engine = 'openpyxl'
-                if excel_file.name.endswith('.xls'): engine = 'xlrd'
-                try:
-                    xl = pd.ExcelFile(excel_file, engine=engine)
-                    sheet_names = xl.sheet_names
-                    target_sheet = None
-                    for name in sheet_names:
-                        if ("180" in name or "１８０" in name) and "明細" in name and "類" in name: target_sheet = name; break
-                    if not target_sheet:
-                        for name in sheet_names:
-                            if ("180" in name or "１８０" in name) and "明細" in name: target_sheet = name; break
-                    if not target_sheet: target_sheet = sheet_names[0]
-                    df = pd.read_excel(excel_file, sheet_name=target_sheet, header=None, engine=engine)
-                except: df = pd.read_excel(excel_file, header=None, engine=engine)
-
-                report_date = None
-                search_limit = min(20, len(df))
-                for r in range(search_limit):
-                    for c in range(len(df.columns)):
-                        val = df.iloc[r, c]
-                        if isinstance(val, datetime): report_date = val.date(); break
-                        val_str = str(val)
-                        match = re.search(r'(\d+)年(\d+)月(\d+)日', val_str)
-                        if match: y, m, d = map(int, match.groups()); report_date = datetime(y, m, d).date(); break
-                    if report_date: break
-                if not report_date: raise ValueError("日付が見つかりませんでした。")
-
-                sales_header_row = -1
-                for r in range(search_limit):
-                    row_values = [str(v) for v in df.iloc[r].values]
-                    if any("販売" in v for v in row_values): sales_header_row = r; break
-                
-                logger.debug(f"sales_header_row index: {sales_header_row}")
-                
-                if sales_header_row == -1: raise ValueError("列名「販売」が見つかりませんでした。")
-
-                exclude_keywords = ["原価率", "累計", "合計", "構成比", "予算", "前年", "売上", "仕入", "販売"]
-                exclude_names = set(Category.objects.filter(level=10).values_list('name', flat=True))
-                
-                shop_cache = {s.name: s for s in Shop.objects.all()}
-                shop_columns = []
-                for col_idx in range(len(df.columns)):
-                    val = str(df.iloc[sales_header_row, col_idx])
-                    if "販売" in val:
-                        found_shop_name = ""
-                        for offset in range(1, 7):
-                            target_row = sales_header_row - offset
-                            if target_row < 0: break
-                            cell_val = df.iloc[target_row, col_idx]
-                            val_str = str(cell_val).strip()
-                            if pd.isna(cell_val) or val_str == "" or val_str == "nan": continue
-                            if any(k in val_str for k in exclude_keywords): continue
-                            if "%" in val_str: continue
-                            if isinstance(cell_val, (int, float)): continue
-                            if val_str in exclude_names: continue
-                            found_shop_name = val_str; break
-                        
-                        if found_shop_name:
-                            if found_shop_name not in shop_cache:
-                                new_shop = Shop.objects.create(name=found_shop_name)
-                                shop_cache[found_shop_name] = new_shop
-                            shop_obj = shop_cache[found_shop_name]
-                            shop_columns.append({'shop': shop_obj, 'col_idx': col_idx})
-
-                if not shop_columns: raise ValueError(f"店舗情報が見つかりませんでした。(販売行:{sales_header_row+1} の上を確認しました)")
-
-                customer_count_cat, _ = Category.objects.get_or_create(code=9999, level=10, defaults={'name': '客数'})
-                category_map = {c.code: c for c in Category.objects.filter(level=180)}
-
-                count = 0
-                customer_rows_count = 0
-                
-                data_start_index = sales_header_row + 1 
-                
-                logger.debug(f"data_start_index: {data_start_index}, Total rows in df: {len(df)}")
-                
-                with transaction.atomic():
-                    # 新しい累計データで同月内の過去日付分を上書きするため、
-                    # アップロード対象の店舗について同年同月で report_date より古い日付のレコードを削除する
-                    try:
-                        shop_ids = [s['shop'].id for s in shop_columns]
-                        if shop_ids:
-                            SalesRecord.objects.filter(
-                                shop_id__in=shop_ids,
-                                date__year=report_date.year,
-                                date__month=report_date.month,
-                                date__lt=report_date
-                            ).delete()
-                    except Exception:
-                        # 削除失敗しても継続（トランザクションによりロールバックされる可能性あり）
-                        logger.exception("Failed to prune old monthly records before import")
-
-                    for index, row in df.iloc[data_start_index:].iterrows(): 
-                        
-                        code_val = row[0]
-                        a_col_val = str(code_val).replace("　", "").replace(" ", "").strip()
-                        name_val = str(row[1]).strip() if len(row) > 1 else ""
-                        
-                        category_obj = None
-                        is_customer_count = False
-
-                        # 客数判定: A列に「客数」が含まれていれば客数行と見なす
-                        if "客数" in a_col_val:
-                            category_obj = customer_count_cat
-                            is_customer_count = True
-                            
-                        # 客数行でなければ、部門コードの有無を確認
-                        elif not pd.isna(code_val):
-                            try:
-                                # 部門コードとしてA列の値を使用
-                                code_int = int(float(a_col_val.replace(',', '')))
-                                category_obj = category_map.get(code_int)
-                            except:
-                                pass
-                        
-                        if not category_obj:
-                            if "客数" in a_col_val:
-                                logger.debug(f"客数検出失敗: Index {index}, A列='{a_col_val}', B列='{name_val}'")
-                            continue
-                        
-                        # --- データ登録処理 ---
-                        
-                        if is_customer_count:
-                            logger.debug(f"客数行検出 SUCCESS at Index: {index}. A列値: {a_col_val}")
-                            
-                            row_registered_count = 0
-                            
-                            for shop_info in shop_columns:
-                                shop = shop_info['shop']
-                                col_idx = shop_info['col_idx']
-                                
-                                # 各店舗の販売列(col_idx)に格納されている客数を取得 (offset=0)
-                                sales_val = get_val(row, col_idx, 0) 
-                                
-                                logger.debug(f"  > Shop: {shop.name} (Col {col_idx + 1}), Sales Value: {sales_val}")
-                                
-                                # 客数行では、買取、仕入、ネット、粗利は 0
-                                if sales_val > 0: # 値が入っている場合のみ登録
-                                    SalesRecord.objects.update_or_create(
-                                        shop=shop,
-                                        category=category_obj,
-                                        date=report_date,
-                                        defaults={
-                                            'amount_sales': sales_val, 
-                                            'amount_profit': 0, 
-                                            'amount_purchase': 0,
-                                            'amount_supply': 0,
-                                            'amount_net': 0,
-                                        }
-                                    )
-                                    customer_rows_count += 1
-                                    row_registered_count += 1
-                                    count += 1
-                            
-                            if row_registered_count == 0:
-                                logger.debug("  > Warning: 客数行として検出されましたが、すべての店舗の客数値が 0 だったため登録されませんでした。")
-                            
-                            continue # 客数行の処理が完了したため、次の行へ
-
-                        # 通常の部門データ行の場合
-                        for shop_info in shop_columns:
-                            shop = shop_info['shop']
-                            col_idx = shop_info['col_idx']
-                            
-                            # 通常の部門データ行の場合、5列のオフセットで値を取得
-                            sales_val = get_val(row, col_idx, 0)
-                            purchase_val = get_val(row, col_idx, 1)
-                            supply_val = get_val(row, col_idx, 2)
-                            net_val = get_val(row, col_idx, 3)
-                            profit_val = get_val(row, col_idx, 4)
-
-                            SalesRecord.objects.update_or_create(
-                                shop=shop,
-                                category=category_obj,
-                                date=report_date,
-                                defaults={
-                                    'amount_sales': sales_val,
-                                    'amount_profit': profit_val,
-                                    'amount_purchase': purchase_val,
-                                    'amount_supply': supply_val,
-                                    'amount_net': net_val,
-                                }
-                            )
-                        count += 1
-                
-                # キャッシュをクリアする（重要: ダッシュボードビューが古いデータを読み込まないように）
-                cache.clear()
-
-                messages.success(request, f"{report_date} のデータ取り込み完了！(合計{count}行 / うち客数行:{customer_rows_count})")
-                return redirect('admin:index')
-
+                dry_run = form.cleaned_data['dry_run']
+                job = enqueue_import_job(ImportJob.KIND_SALES, request.FILES['file'], dry_run=dry_run)
+                if dry_run:
+                    messages.info(request, f"売上データの差分確認を受け付けました。(ジョブ #{job.id})")
+                else:
+                    messages.info(request, f"売上データの取り込みを受け付けました。(ジョブ #{job.id})")
+                return redirect(f"{reverse('upload_sales')}?job={job.id}")
             except Exception as e:
-                logger.exception(f"Error importing Excel file: {e}")
+                logger.exception(f"Error queueing Excel file: {e}")
                 messages.error(request, f"エラー: {e}")
-    else: form = ExcelUploadForm()
-    return render(request, 'admin/sales_upload.html', {'form': form, 'title': '売上データ取込'})
+    else: form = SalesUploadForm()
+    return render(request, 'admin/sales_upload.html', {'form': form, 'title': '売上データ取込', 'job': _requested_import_job(request)})
+
+
+def _requested_import_job(request):
+    """?job=<id> で指定された取込ジョブ（進捗表示用）"""
+    job_id = request.GET.get('job')
+    if job_id and job_id.isdigit():
+        return ImportJob.objects.filter(id=int(job_id)).first()
+    return None
+
+
+def import_job_status(request, job_id):
+    """取込ジョブの進捗を JSON で返す（アップロード画面からポーリングする。読むだけでジョブは動かさない）"""
+    job = ImportJob.objects.filter(id=job_id).first()
+    if job is None:
+        return JsonResponse({'error': 'not found'}, status=404)
+    return JsonResponse(job_status_payload(job))
 
 # views.py の student_dashboard 関数全体を以下に置き換える
 
@@ -505,22 +200,12 @@ def student_dashboard(request):
         if selected_year not in years:
             selected_year = years[-1]
     else:
-        # デフォルトは、客数(コード9999)のみの年を避け、実売上データがある最新年を選択する
-        chosen = None
-        for y in reversed(years):
-            has_real = SalesRecord.objects.filter(date__year=y).exclude(category__code=9999).exists()
-            if has_real:
-                chosen = y
-                break
+        # デフォルトは、客数のみの年を避け、実売上データがある最新年を選択する
+        chosen = latest_sales_year(years)
         selected_year = chosen if chosen is not None else years[-1]
 
-    # 月プルダウン（DBから存在する月を取得）
-    try:
-        months_qs = SalesRecord.objects.filter(date__year=selected_year).values_list('date__month', flat=True).distinct()
-        # 重複が大量に出る環境に備え、set() で確実にユニーク化する
-        available_months = sorted({int(m) for m in months_qs if m})
-    except Exception:
-        available_months = []
+    # 月プルダウン（期間索引から存在する月を取得）
+    available_months = period_months(selected_year)
 
     # 選択月の決定（無ければ最新利用可能月）
     target_month = None
@@ -534,174 +219,94 @@ def student_dashboard(request):
 
     month_choices = [{'value': m, 'name': f"{m}月", 'disabled': False if m in available_months else True} for m in range(1, 13)]
 
-    # キャッシュキー
-    cache_key = f"dashboard_v3_record_month_{selected_year}_{target_month if target_month else 'all'}_{request.GET.get('parent_id','root')}"
-    cached = cache.get(cache_key)
-    if cached:
-        return render(request, 'dashboard.html', cached)
-
-    # 親カテゴリ・表示カテゴリの決定
+    # 親カテゴリの決定（部門ツリーはプロセス内にあるため、パンくずと見出しはキャッシュせずに作る）
     parent_id = request.GET.get('parent_id')
     parent_category = None
-    target_categories = []
     breadcrumbs = []
+    tree = category_tree()
     if parent_id and parent_id.isdigit():
-        try:
-            parent_category = Category.objects.get(id=parent_id)
-            cur = parent_category
-            while cur:
-                breadcrumbs.insert(0, cur)
-                cur = cur.parent
-
-            if parent_category.level == 10:
-                target_categories = Category.objects.filter(parent=parent_category).order_by('code')
-            else:
-                target_categories = [parent_category]
-        except Category.DoesNotExist:
-            parent_category = None
-
-    if not target_categories:
-        target_categories = Category.objects.filter(level=10).exclude(code=9999).order_by('code')
+        parent_category = tree.get(int(parent_id))
+        if parent_category:
+            breadcrumbs = tree.breadcrumbs(parent_category.id)
 
     current_title = parent_category.name if parent_category else '全社（10部門）'
 
-    # 10部門 -> 180部門マップを作成（キャッシュ化された helper を活用）
-    cat_map = {}
-    l10_categories = Category.objects.filter(level=10).exclude(code=9999)
-    for l10 in l10_categories:
-        descendants = get_descendant_category_ids(l10.code)
-        for d_id in descendants:
-            cat_map[d_id] = l10.id
-
-    # --- 修正: ドリルダウン対象の階層(10/35/90/180)に合わせて 180 部門を収集し、
-    #     各 180 部門を表示対象カテゴリ(id)へマップする ---
-    # キャッシュ化された 180 グループを使って DB への多重アクセスを回避
-    groups = get_category_180_groups_cached()
-    by_90 = groups['by_90']; by_35 = groups['by_35']; by_10 = groups['by_10']
-
-    cat_map_target = {}  # 180_id -> target_category_id
-    for tc in target_categories:
-        try:
-            if tc.level == 180:
-                cat_map_target[tc.id] = tc.id
-            elif tc.level == 90:
-                ids = by_90.get(tc.id, [])
-                for i in ids: cat_map_target[i] = tc.id
-            elif tc.level == 35:
-                ids = by_35.get(tc.id, [])
-                for i in ids: cat_map_target[i] = tc.id
-            elif tc.level == 10:
-                ids = by_10.get(tc.id, [])
-                for i in ids: cat_map_target[i] = tc.id
-            else:
-                # fallback
-                ids = by_10.get(tc.id, []) or []
-                for i in ids: cat_map_target[i] = tc.id
-        except Exception:
-            continue
+    # キャッシュキー（表示する月の売上が取り込まれると作り直す。同時アクセスでも集計は 1 回）
+    # キャッシュするのは部門 id と年ごとの順位・構成比・金額の整数配列だけ（形を変えたら v を上げる）
+    cache_periods = ((None, target_month),) if target_month else ALL_PERIODS
+    cache_key = f"dashboard_v4_record_month_{selected_year}_{target_month if target_month else 'all'}_{request.GET.get('parent_id','root')}"
 
-    relevant_180_ids = list(cat_map_target.keys())
+    def build_payload():
+        # 表示カテゴリの決定
+        target_categories = []
+        if parent_category:
+            if parent_category.level == 10:
+                target_categories = list(tree.children(parent_category.id))
+            else:
+                target_categories = [parent_category]
 
-    # 年ごとの最新日をまとめて取得（必要なら month フィルタ）
-    latest_cache_key = f"latest_per_year_month_{target_month if target_month else 'all'}"
-    year_to_latest = cache.get(latest_cache_key)
-    if year_to_latest is None:
-        year_to_latest = {}
-        # 月フィルタが指定されている場合、ExtractMonth を避けるため年ごとに日付範囲検索して最新日を取得
-        if target_month is not None:
-            for y in years:
-                try:
-                    last_day = calendar.monthrange(y, target_month)[1]
-                    start = date(y, target_month, 1)
-                    end = date(y, target_month, last_day)
-                    latest = SalesRecord.objects.filter(date__range=(start, end)).order_by('-date').values_list('date', flat=True).first()
-                    if latest:
-                        year_to_latest[y] = latest
-                except Exception:
-                    continue
-        else:
-            # 月フィルタがない場合は年ごとの最新日を集約で取得（関数適用なし）
-            qs = SalesRecord.objects
-            latest_per_year_qs = qs.values('date__year').annotate(latest_date=Max('date'))
-            year_to_latest = {item['date__year']: item['latest_date'] for item in latest_per_year_qs if item.get('latest_date')}
+        if not target_categories:
+            target_categories = Category.objects.filter(level=10).order_by('code')
 
+        # 年ごとの集計対象（月フィルタがあれば各年のその月、なければ各年の最新月）を集計サマリーから取得
+        year_to_snapshot = snapshot_periods(target_month)
         # フォールバック: 月フィルタで年別最新が一切見つからなかった場合、
-        # 月フィルタを外して年ごとの最新日を取得して表示可能にする
-        if not year_to_latest:
-            try:
-                qs = SalesRecord.objects
-                latest_per_year_qs = qs.values('date__year').annotate(latest_date=Max('date'))
-                year_to_latest = {item['date__year']: item['latest_date'] for item in latest_per_year_qs if item.get('latest_date')}
-            except Exception:
-                year_to_latest = {}
+        # 月フィルタを外して年ごとの最新日を使って表示可能にする
+        if not year_to_snapshot and target_month is not None:
+            year_to_snapshot = snapshot_periods()
 
-        cache.set(latest_cache_key, year_to_latest, 60 * 60 * 24)
+        # 表示対象カテゴリ(10/35/90/180)の年ごとの全店舗合計・順位・シェアを集計サマリーから 1 クエリで取得
+        ranking = category_sales_ranking(year_to_snapshot, target_categories)
 
-    latest_dates = list(year_to_latest.values())
-
-    # 最新日データを一括取得して 180 部門ごとに金額を集計
-    records_qs = []
-    if latest_dates and relevant_180_ids:
-        # 店舗ごとの明細が大量にあるため、DB側で日付＋カテゴリで集約して返す
-        records_qs = SalesRecord.objects.filter(
-            date__in=latest_dates,
-            category_id__in=relevant_180_ids
-        ).values('date', 'category_id').annotate(total_sales=Sum('amount_sales'))
-
-    # --- DEBUG: 出力して原因を特定 ---
-    try:
-        logger.debug("student_dashboard: selected_year=%s", selected_year)
-        logger.debug("student_dashboard: years=%s", years)
-        logger.debug("student_dashboard: available_months=%s", available_months)
-        logger.debug("student_dashboard: target_month=%s", target_month)
-        logger.debug("student_dashboard: parent_id=%s", parent_id)
-        logger.debug("student_dashboard: target_categories count=%s", len(target_categories))
-        logger.debug("student_dashboard: relevant_180_ids count=%s", len(relevant_180_ids))
-        logger.debug("student_dashboard: year_to_latest=%s", year_to_latest)
-        logger.debug("student_dashboard: latest_dates=%s", latest_dates)
+        # --- DEBUG: 出力して原因を特定 ---
         try:
-            # Query count may be expensive; show sample sizes
-            if hasattr(records_qs, 'count'):
-                logger.debug("student_dashboard: records_qs count (est): %s", records_qs.count())
-            else:
-                logger.debug("student_dashboard: records_qs count (est): %s", len(list(records_qs)))
+            logger.debug("student_dashboard: selected_year=%s", selected_year)
+            logger.debug("student_dashboard: years=%s", years)
+            logger.debug("student_dashboard: available_months=%s", available_months)
+            logger.debug("student_dashboard: target_month=%s", target_month)
+            logger.debug("student_dashboard: parent_id=%s", parent_id)
+            logger.debug("student_dashboard: target_categories count=%s", len(target_categories))
+            logger.debug("student_dashboard: year_to_snapshot=%s", year_to_snapshot)
         except Exception:
             pass
-    except Exception:
-        pass
 
-    per_year_dept = {y: {} for y in year_to_latest.keys()}
-    for r in records_qs:
-        d = r['date']
-        y = d.year
-        cat180 = r['category_id']
-        # DB側で集約した合計を使用
-        amount = r.get('total_sales') or 0
-        # ドリルダウン対象のカテゴリIDへマップ（10/35/90/180に対応）
-        root_id = cat_map_target.get(cat180)
-        if not root_id: continue
-        if y not in per_year_dept: per_year_dept[y] = {}
-        per_year_dept[y][root_id] = per_year_dept[y].get(root_id, 0) + amount
-
-    # DEBUG: per_year_dept summary (年ごとの上位3部門の id:amount を出力)
-    try:
-        for y, totals in sorted(per_year_dept.items()):
-            items = sorted(totals.items(), key=lambda x: x[1], reverse=True)[:3]
-            logger.debug("student_dashboard: per_year_dept top3 for %s -> %s", y, items)
-        logger.debug("student_dashboard: per_year_dept keys-> %s", sorted(list(per_year_dept.keys())))
-    except Exception:
-        pass
+        # 部門 × 集計年の順位・構成比（0.1% 単位）・金額。順位 0 はデータなし
+        category_ids = [dept.id for dept in target_categories]
+        snapshot_years = sorted(year_to_snapshot.keys())
+        position = {(cid, year): i * len(snapshot_years) + j
+                    for i, cid in enumerate(category_ids) for j, year in enumerate(snapshot_years)}
+        ranks = [0] * len(position)
+        shares = [0] * len(position)
+        amounts = [0] * len(position)
+        for r in ranking:
+            i = position[(r['category_id'], r['year'])]
+            ranks[i] = r['rank']
+            shares[i] = round(r['share'] * 10)
+            amounts[i] = r['amount']
+        return {
+            'category_ids': pack_ints(category_ids),
+            'years': pack_ints(snapshot_years),
+            'ranks': pack_ints(ranks),
+            'shares': pack_ints(shares),
+            'amounts': pack_ints(amounts),
+        }
+
+    payload = cached_payload(cache_key, build_payload, cache_periods, timeout=60 * 60 * 24 * 7)
 
     # year_data の構築（ランクとシェア）
-    year_data = {}
-    for y, totals in per_year_dept.items():
-        total_sales = sum(totals.values())
-        sorted_depts = sorted(totals.items(), key=lambda x: x[1], reverse=True)
-        info = {}
-        for rank, (cid, amt) in enumerate(sorted_depts, 1):
-            share = round((amt / total_sales * 100), 1) if total_sales > 0 else 0
-            info[cid] = {'rank': rank, 'share': share, 'amount_total': amt}
-        year_data[y] = info
+    category_ids = payload['category_ids'].tolist()
+    snapshot_years = payload['years'].tolist()
+    ranks = unpack_ints(payload['ranks'], len(snapshot_years))
+    shares = unpack_ints(payload['shares'], len(snapshot_years))
+    amounts = unpack_ints(payload['amounts'], len(snapshot_years))
+    year_data = {y: {} for y in snapshot_years}
+    for j, year in enumerate(snapshot_years):
+        # 年の合計が 0 のときの構成比は SQL と同じく整数の 0
+        has_total = sum(row[j] for row in amounts) > 0
+        for i, cid in enumerate(category_ids):
+            if ranks[i][j]:
+                share = shares[i][j] / 10 if has_total else 0
+                year_data[year][cid] = {'rank': ranks[i][j], 'share': share, 'amount_total': amounts[i][j]}
 
     # DEBUG: year_data sample
     try:
@@ -711,9 +316,9 @@ def student_dashboard(request):
     except Exception:
         pass
 
-    # table_data 構築
+    # table_data 構築（部門マスタの変更後に古い payload を返した場合は、無くなった部門を飛ばす）
     table_data = []
-    for dept in target_categories:
+    for dept in filter(None, map(tree.get, category_ids)):
         row = {'id': dept.id, 'name': dept.name, 'level': dept.level, 'is_clickable': dept.level < 35, 'cells': []}
         for year in years:
             data = year_data.get(year, {}).get(dept.id)
@@ -759,11 +364,9 @@ def student_dashboard(request):
         'target_month': target_month,
         'selected_year': selected_year,
     }
-
-    cache.set(cache_key, context, 60 * 60 * 24 * 7)
     return render(request, 'dashboard.html', context)
 
-@cache_page(60 * 60 * 24)
+@cache_sales_page(60 * 60 * 24, month_periods)
 def trend_dashboard(request):
     # 全日付キャッシュを取得
     all_dates = get_all_dates_cached()
@@ -781,26 +384,11 @@ def trend_dashboard(request):
         if m in available_months:
             target_month = m
 
-    # 日付リストを決定（target_month があれば各年のその月の最新日を取得）
-    dates = []
-    # debug_info removed from production; keep local list for potential logging
-    debug_info = []
+    # 日付リストを決定（target_month があれば各年のその月の最新日を集計サマリーから取得）
+    snapshots = {}
     if target_month is not None:
-        for y in years:
-            try:
-                last_day = calendar.monthrange(y, target_month)[1]
-                start = date(y, target_month, 1)
-                end = date(y, target_month, last_day)
-                latest = SalesRecord.objects.filter(date__range=(start, end)).order_by('-date').values_list('date', flat=True).first()
-                if latest:
-                    dates.append(latest)
-                    debug_info.append(f"year {y}: found {latest}")
-                else:
-                    debug_info.append(f"year {y}: no data in {start}..{end}")
-            except Exception as e:
-                debug_info.append(f"year {y}: error {e}")
-                continue
-        dates = sorted(dates)
+        snapshots = snapshot_periods(target_month)
+        dates = sorted(d for _, d in snapshots.values())
     else:
         dates = all_dates
 
@@ -814,52 +402,53 @@ def trend_dashboard(request):
     else:
         labels = [d.strftime('%Y/%m/%d') for d in dates]
 
-    # カテゴリマップ（180 -> 10 部門名）
-    cat_map = {}
-    # 客数(9999)を除外
-    l10s = Category.objects.filter(level=10).exclude(code=9999).order_by('code')
-    for l10 in l10s:
-        # より堅牢に下位(180)カテゴリを取得する: 再帰的に子を取得するヘルパーを利用
-        descendants = get_descendant_ids_for_category(l10.code, 10)
-        for d_id in descendants:
-            cat_map[d_id] = l10.name
-
-    categories_10 = l10s.order_by('code')
+    # 10 部門
+    categories_10 = Category.objects.filter(level=10).order_by('code')
     length = len(years_to_use) if yearly_mode else len(dates)
     dataset_map = {cat.name: [0] * length for cat in categories_10}
     # 金額のマップ（表示用テーブルの元データ）
     amounts_map = {cat.name: [0] * length for cat in categories_10}
 
+    # 10 部門ごとの全店舗合計を売上キューブ（無効なら集計サマリー）から取得
+    # （店舗ごとの月内最新日のスナップショット。年集計モードはその各月の合計）。年・年月ごとにキャッシュし、締まった期間は作り直さない
     if yearly_mode:
-        for i, y in enumerate(years_to_use):
-            records = SalesRecord.objects.filter(date__year=y).values('category_id').annotate(total=Sum('amount_sales'))
-            yearly_totals = {cat.name: 0 for cat in categories_10}
-            for r in records:
-                cat_id = r.get('category_id'); amount = r.get('total', 0); root_name = cat_map.get(cat_id)
-                if root_name and root_name in yearly_totals:
-                    yearly_totals[root_name] += amount
-            total_sales = sum(yearly_totals.values())
-            # 常に金額配列を格納（表示テーブル用）
-            for name in yearly_totals:
-                amounts_map[name][i] = yearly_totals.get(name, 0)
-            if total_sales > 0:
-                for name, amount in yearly_totals.items():
-                    dataset_map[name][i] = round((amount / total_sales) * 100, 1)
+        columns = {(y, None): i for i, y in enumerate(years_to_use)}
     else:
-        for i, d in enumerate(dates):
-            records = SalesRecord.objects.filter(date=d).values('category_id', 'amount_sales')
-            daily_totals = {cat.name: 0 for cat in categories_10}
-            for r in records:
-                cat_id = r['category_id']; amount = r['amount_sales']; root_name = cat_map.get(cat_id)
-                if root_name and root_name in daily_totals:
-                    daily_totals[root_name] += amount
-            total_sales = sum(daily_totals.values())
-            # 常に金額配列を格納（表示テーブル用）
-            for name in daily_totals:
-                amounts_map[name][i] = daily_totals.get(name, 0)
-            if total_sales > 0:
-                for name, amount in daily_totals.items():
-                    dataset_map[name][i] = round((amount / total_sales) * 100, 1)
+        columns = {(y, target_month): dates.index(d) for y, (_, d) in snapshots.items()}
+
+    def dept_totals(periods):
+        """期間ごとの 10 部門別の全店舗合計 {期間: {部門 id: 合計}}"""
+        result = {period: {} for period in periods}
+        cube = get_sales_cube()
+        if cube is not None:
+            groups = cube.category_groups(category_tree(), categories_10)
+            for y, m in periods:
+                values, _ = cube.rollup(cube.period_indices(y, m), groups)
+                result[(y, m)] = {cat.id: int(v[0]) for cat, v in zip(categories_10, values)}
+        else:
+            if yearly_mode:
+                summary_qs = SalesSummary.objects.filter(year__in=[y for y, _ in periods], level=10)
+            else:
+                summary_qs = snapshot_summary({y: snapshots[y] for y, _ in periods}, level=10)
+            for r in summary_qs.values('year', 'category_id').annotate(total=Sum('amount_sales')):
+                totals = result[(r['year'], target_month)]
+                totals[r['category_id']] = totals.get(r['category_id'], 0) + (r['total'] or 0)
+        return result
+
+    column_totals = [{cat.name: 0 for cat in categories_10} for _ in range(length)]
+    period_totals = cached_period_values('trend_dept_totals', columns, dept_totals, closed_period_check())
+    for period, col in columns.items():
+        for cat in categories_10:
+            column_totals[col][cat.name] += period_totals[period].get(cat.id, 0)
+
+    for i, totals in enumerate(column_totals):
+        total_sales = sum(totals.values())
+        # 常に金額配列を格納（表示テーブル用）
+        for name in totals:
+            amounts_map[name][i] = totals.get(name, 0)
+        if total_sales > 0:
+            for name, amount in totals.items():
+                dataset_map[name][i] = round((amount / total_sales) * 100, 1)
 
     colors = ['#FF6384', '#36A2EB', '#FFCE56', '#4BC0C0', '#9966FF', '#FF9F40', '#E7E9ED', '#71B37C', '#8B4513', '#5D6D7E']
     datasets = []
@@ -885,7 +474,7 @@ def trend_dashboard(request):
     }
     return render(request, 'trend_dashboard.html', context)
 
-@cache_page(60 * 60 * 24)
+@cache_sales_page(60 * 60 * 24, month_periods)
 def shop_ranking(request):
     all_dates = get_all_dates_cached()
     years = sorted(list(set([d.year for d in all_dates])))
@@ -909,43 +498,21 @@ def shop_ranking(request):
     for m in range(1, 13):
         month_choices.append((str(m), f"{m}月"))
 
-    # 客数(9999)を除外
-    all_10_depts = Category.objects.filter(level=10).exclude(code=9999).order_by('code')
+    all_10_depts = Category.objects.filter(level=10).order_by('code')
     selected_dept_code = request.GET.get('dept_code')
     selected_dept_name = "全店合計"
     
-    target_category_ids = []
+    dept = None
     if selected_dept_code:
-        target_category_ids = get_descendant_category_ids(selected_dept_code)
-        try: selected_dept_name = Category.objects.get(code=selected_dept_code, level=10).name
-        except: pass
-    
+        dept = category_tree().find(selected_dept_code, 10)
+        if dept: selected_dept_name = dept.name
+
+    # 各年のスナップショット（月指定時はその月の最新日、合計なら年の最新日）の店舗別売上の順位を
+    # 前年の順位と一緒に集計サマリーから 1 クエリで取得（店舗名は表示名に揃えて集計済み）
+    month = int(target_month) if target_month != 'total' and target_month.isdigit() else None
     year_data = {}
-    for year in years:
-        if target_month != 'total' and target_month.isdigit():
-            m = int(target_month)
-            latest_date = SalesRecord.objects.filter(date__year=year, date__month=m).order_by('-date').values_list('date', flat=True).first()
-        else:
-            latest_date = SalesRecord.objects.filter(date__year=year).order_by('-date').values_list('date', flat=True).first()
-        if not latest_date: continue
-        
-        qs = SalesRecord.objects.filter(date=latest_date)
-        if target_category_ids: qs = qs.filter(category__id__in=target_category_ids)
-        else: qs = qs.exclude(category__code=9999) # 客数除外
-        
-        records = qs.values('shop__name', 'amount_sales')
-        shop_totals = {}
-        for d in records:
-            shop_name = d['shop__name']; amount = d['amount_sales']
-            # 正規化: 例として和歌山->和歌 などを統合
-            shop_name = normalize_shop_name(shop_name)
-            if shop_name == "加治": shop_name = "加治木"
-            shop_totals[shop_name] = shop_totals.get(shop_name, 0) + amount
-        
-        sorted_shops = sorted(shop_totals.items(), key=lambda x: x[1], reverse=True)
-        year_info = {}
-        for rank, (name, amount) in enumerate(sorted_shops, 1): year_info[name] = {'rank': rank}
-        year_data[year] = year_info
+    for r in shop_sales_ranking(snapshot_periods(month), dept):
+        year_data.setdefault(r['year'], {})[r['shop_name']] = r
 
     all_shops = Shop.objects.all().order_by('name')
     # display_map: display_name -> [shop_id,...]
@@ -969,7 +536,9 @@ def shop_ranking(request):
             diff_icon = ""; diff_class = ""; status_text = ""
 
             if i > 0:
-                prev_year = years[i-1]; prev_data = year_data.get(prev_year, {}).get(disp, None); prev_rank = prev_data['rank'] if prev_data else None
+                prev_year = years[i-1]
+                if data: prev_rank = data['prev_rank'] if data['prev_year'] == prev_year else None
+                else: prev_rank = year_data.get(prev_year, {}).get(disp, {}).get('rank')
                 if rank and not prev_rank: status_text = "新店"; diff_class = "store-new"
                 elif not rank and prev_rank:
                     if i == len(years) - 1:
@@ -1029,7 +598,7 @@ def shop_ranking(request):
     context['target_month'] = target_month
     return render(request, 'shop_ranking.html', context)
 
-@cache_page(60 * 60 * 24)
+@cache_sales_page(60 * 60 * 24, month_periods)
 def profit_ranking(request):
     all_dates = get_all_dates_cached()
     years = sorted(list(set([d.year for d in all_dates])))
@@ -1041,63 +610,23 @@ def profit_ranking(request):
     for m in range(1, 13):
         month_choices.append((str(m), f"{m}月"))
     
-    cat_map = {}
-    # 客数(9999)を除外
-    l10s = Category.objects.filter(level=10).exclude(code=9999)
-    for l10 in l10s:
-        # 再帰的に下位カテゴリ(180など)の id を取得する共通ヘルパーを利用
-        descendants = get_descendant_ids_for_category(l10.code, 10)
-        for d_id in descendants: cat_map[d_id] = l10.name
-    
+    # 各年のスナップショットの 10 部門別の売上順位・粗利率順位を集計サマリーから 1 クエリで取得
+    month = int(target_month) if target_month != 'total' and target_month.isdigit() else None
     year_data = {}
-    for year in years:
-        if target_month != 'total' and target_month.isdigit():
-            m = int(target_month)
-            latest_date = SalesRecord.objects.filter(date__year=year, date__month=m).order_by('-date').values_list('date', flat=True).first()
-        else:
-            latest_date = SalesRecord.objects.filter(date__year=year).order_by('-date').values_list('date', flat=True).first()
-        if not latest_date: continue
-        
-        records = SalesRecord.objects.filter(date=latest_date).values('category_id', 'amount_sales', 'amount_profit')
-        dept_data = {}
-        for r in records:
-            cat_id = r['category_id']; root_name = cat_map.get(cat_id)
-            if root_name:
-                if root_name not in dept_data: dept_data[root_name] = {'sales': 0, 'profit': 0}
-                dept_data[root_name]['sales'] += r['amount_sales']
-                dept_data[root_name]['profit'] += r['amount_profit']
-        
-        sorted_by_sales = sorted(dept_data.items(), key=lambda x: x[1]['sales'], reverse=True)
-        sales_ranks = {name: i+1 for i, (name, _) in enumerate(sorted_by_sales)}
-        
-        margin_list = []
-        for name, data in dept_data.items():
-            sales = data['sales']; profit = data['profit']
-            margin = (profit / sales * 100) if sales > 0 else 0
-            margin_list.append((name, margin))
-        
-        sorted_by_margin = sorted(margin_list, key=lambda x: x[1], reverse=True)
-        
-        year_info = {}
-        for i, (name, margin) in enumerate(sorted_by_margin):
-            profit_rank = i + 1
-            sales_rank = sales_ranks.get(name, 0)
-            gap = sales_rank - profit_rank
-            profit_amount = dept_data.get(name, {}).get('profit', 0)
-            year_info[name] = {
-                'profit_rank': profit_rank,
-                'sales_rank': sales_rank,
-                'profit_amount': profit_amount,
-                'gap': gap, 'gap_abs': abs(gap), 'margin': round(margin, 1)
-            }
-        year_data[year] = year_info
-
-    all_depts = Category.objects.filter(level=10).exclude(code=9999).order_by('code')
+    for r in category_profit_ranking(snapshot_periods(month), level=10):
+        year_data.setdefault(r['year'], {})[r['category_id']] = {
+            'profit_rank': r['profit_rank'],
+            'sales_rank': r['sales_rank'],
+            'profit_amount': r['profit'],
+            'gap': r['gap'], 'gap_abs': abs(r['gap']), 'margin': r['margin']
+        }
+
+    all_depts = Category.objects.filter(level=10).order_by('code')
     table_data = []
     for dept in all_depts:
-        row = {'name': dept.name, 'cells': []}
+        row = {'id': dept.id, 'name': dept.name, 'cells': []}
         for i, year in enumerate(years):
-            data = year_data.get(year, {}).get(dept.name, None)
+            data = year_data.get(year, {}).get(dept.id, None)
             profit_rank = data['profit_rank'] if data else None
             gap = data['gap'] if data else 0
             gap_abs = data['gap_abs'] if data else 0
@@ -1125,14 +654,14 @@ def profit_ranking(request):
         table_data.append(row)
 
     latest_year = years[-1]
-    table_data.sort(key=lambda x: year_data.get(latest_year, {}).get(x['name'], {}).get('profit_rank', 999))
+    table_data.sort(key=lambda x: year_data.get(latest_year, {}).get(x['id'], {}).get('profit_rank', 999))
 
     context = {'years': years, 'table_data': table_data, 'month_choices': month_choices, 'target_month': target_month}
     return render(request, 'profit_ranking.html', context)
 
 
 
-@cache_page(60 * 60 * 24)
+@cache_sales_page(60 * 60 * 24)
 def hyuga_trend(request):
     # 年次集計モード: 各年ごとに 10 部門の年間合計を計算してスタック棒グラフにする
     dates = get_all_dates_cached()
@@ -1146,28 +675,41 @@ def hyuga_trend(request):
     years = sorted(list(set([d.year for d in dates])))
     labels = [str(y) for y in years]
 
-    # 客数(9999)を除外
-    l10s = Category.objects.filter(level=10).exclude(code=9999).order_by('code')
-
-    cat_map = {}
-    for l10 in l10s:
-        descendants = get_descendant_ids_for_category(l10.code, 10)
-        for d_id in descendants:
-            cat_map[d_id] = l10.name
+    l10s = Category.objects.filter(level=10).order_by('code')
+    l10_names = {cat.id: cat.name for cat in l10s}
 
     # datasets: 各部門ごとに years 長の配列を用意
     dataset_map = {cat.name: [0] * len(years) for cat in l10s}
 
-    # 年ごとに集計（DBでカテゴリごとに合計を取得）
+    # 年ごとに集計（売上キューブ、無効なら DB で 10 部門ごとに合計を取得）。
+    # 年ごとにキャッシュし、締まった年は作り直さない
+    def yearly_dept_totals(periods):
+        """年ごとの日向の 10 部門別合計 {(年, None): {部門 id: 合計}}"""
+        result = {period: {} for period in periods}
+        cube = get_sales_cube()
+        if cube is not None:
+            groups = cube.category_groups(category_tree(), l10s)
+            for y, _ in periods:
+                values, present = cube.rollup(cube.period_indices(y), groups, shop_ids=[hyuga_shop.id])
+                result[(y, None)] = {c.id: int(v[0]) for c, v, p in zip(l10s, values, present) if p}
+        else:
+            period_years = [y for y, _ in periods]
+            records = (SalesRecord.objects
+                       .filter(date__range=(date(min(period_years), 1, 1), date(max(period_years), 12, 31)),
+                               shop=hyuga_shop, cat10__in=l10s)
+                       .annotate(year=ExtractYear('date')).values('year', 'cat10_id')
+                       .annotate(total=Sum('amount_sales')).order_by())
+            for r in records:
+                if (r['year'], None) in result:
+                    result[(r['year'], None)][r['cat10_id']] = r['total'] or 0
+        return result
+
+    year_totals = cached_period_values(f'hyuga_trend_dept_totals:{hyuga_shop.id}', [(y, None) for y in years],
+                                       yearly_dept_totals, closed_period_check())
     for i, y in enumerate(years):
-        records = SalesRecord.objects.filter(date__year=y, shop=hyuga_shop).values('category_id').annotate(total=Sum('amount_sales'))
         yearly_totals = {cat.name: 0 for cat in l10s}
-        for r in records:
-            cat_id = r.get('category_id')
-            amount = r.get('total', 0) or 0
-            root_name = cat_map.get(cat_id)
-            if root_name:
-                yearly_totals[root_name] += amount
+        for cat_id, amount in year_totals[(y, None)].items():
+            yearly_totals[l10_names[cat_id]] += amount
         for name, amount in yearly_totals.items():
             dataset_map[name][i] = amount
     
@@ -1217,7 +759,6 @@ def hyuga_trend(request):
     }
     return render(request, 'hyuga_trend.html', context)
 
-@cache_page(60 * 60 * 24)
 def store_comparison(request):
     all_dates = get_all_dates_cached()
     years = sorted(list(set([d.year for d in all_dates])), reverse=True)
@@ -1227,13 +768,8 @@ def store_comparison(request):
     if selected_year:
         selected_year = int(selected_year)
     else:
-        # デフォルトは、客数(コード9999)のみしか無い年を避け、実データがある最新年を選ぶ
-        chosen = None
-        for y in years:
-            has_real = SalesRecord.objects.filter(date__year=y).exclude(category__code=9999).exists()
-            if has_real:
-                chosen = y
-                break
+        # デフォルトは、客数のみしか無い年を避け、実データがある最新年を選ぶ
+        chosen = latest_sales_year(years)
         selected_year = chosen if chosen is not None else years[0]
     
     target_shop_obj = Shop.objects.filter(name__contains="日向").first()
@@ -1248,13 +784,9 @@ def store_comparison(request):
     include_all_others = 'all_others' in raw_comparison_ids
     include_all_others = 'all_others' in raw_comparison_ids
     
-    cat_map = {}
-    # 客数(9999)を除外
-    l10s = Category.objects.filter(level=10).exclude(code=9999).order_by('code')
+    l10s = Category.objects.filter(level=10).order_by('code')
     dept_names = [c.name for c in l10s]
-    for l10 in l10s:
-        descendants = get_descendant_ids_for_category(l10.code, 10)
-        for d_id in descendants: cat_map[d_id] = l10.name
+    l10_names = {c.id: c.name for c in l10s}
         
     chart_data = {'labels': dept_names, 'datasets': []}
 
@@ -1268,19 +800,37 @@ def store_comparison(request):
             selected_display_values.append(token)
     
     # 年次合計モード: selected_year の年間合計を使って店舗ごとの部門構成比を計算
-    qs = SalesRecord.objects.filter(date__year=selected_year)
+    tree = category_tree()
+    cube = get_sales_cube()
+
+    def shop_dept_totals(shop_ids):
+        """店舗ごとの {10 部門 id: 年間合計}（売上キューブ、無効なら DB）"""
+        totals = {}
+        if cube is None:
+            rows = (SalesRecord.objects.filter(date__year=selected_year, cat10__in=l10s, shop_id__in=shop_ids)
+                    .values('shop_id', 'cat10_id').annotate(total_sales=Sum('amount_sales')))
+            for r in rows:
+                totals.setdefault(r['shop_id'], {})[r['cat10_id']] = r['total_sales']
+            return totals
+        values, present = cube.rollup(cube.period_indices(selected_year), cube.category_groups(tree, l10s),
+                                      shop_ids=shop_ids, by_shop=True)
+        for s, sid in enumerate(cube.shops_of(shop_ids)):
+            totals[sid] = {c.id: int(values[s, g, 0]) for g, c in enumerate(l10s) if present[s, g]}
+        return totals
 
     if include_all_others:
         # 全店舗（対象店を除く）を "他店合計" として集計
-        records = qs.values('shop_id', 'shop__name', 'category_id').annotate(total_sales=Sum('amount_sales'))
+        ids_to_fetch = list(Shop.objects.order_by('id').values_list('id', flat=True))
     else:
         ids_to_fetch = comparison_shop_ids.copy()
         if target_shop_id:
             ids_to_fetch.append(target_shop_id)
-        if ids_to_fetch:
-            records = qs.filter(shop_id__in=ids_to_fetch).values('shop_id', 'shop__name', 'category_id').annotate(total_sales=Sum('amount_sales'))
-        else:
-            records = []
+    # 店舗ごとの集計をキャッシュし、選択された店舗の分だけを使う（未集計の店舗だけを集計する）
+    shop_totals = cached_shop_vectors(f'store_comparison:{tree.version}:{selected_year}', ids_to_fetch,
+                                      shop_dept_totals, periods=((selected_year, None),), empty={})
+    shop_names = dict(Shop.objects.filter(id__in=ids_to_fetch).values_list('id', 'name')) if ids_to_fetch else {}
+    records = [{'shop_id': sid, 'shop__name': shop_names.get(sid), 'cat10_id': cid, 'total_sales': amount}
+               for sid, totals in shop_totals.items() for cid, amount in totals.items()]
 
     shop_aggs = {}
     all_others_agg = {'name': '他店合計', 'total': 0, 'depts': {d: 0 for d in dept_names}}
@@ -1289,9 +839,8 @@ def store_comparison(request):
         sid = r['shop_id']; sname = r['shop__name']
         if sname == "加治": sname = "加治木"
 
-        cat_id = r['category_id']; root_name = cat_map.get(cat_id)
+        root_name = l10_names[r['cat10_id']]
         amount = r.get('total_sales', 0)
-        if not root_name: continue
 
         if (target_shop_id and sid == target_shop_id) or (sid in comparison_shop_ids):
             if sid not in shop_aggs:
@@ -1436,7 +985,6 @@ def store_comparison(request):
     }
     return render(request, 'store_comparison.html', context)
 
-@cache_page(60 * 60 * 24)
 def customer_net_trend(request):
     all_dates = get_all_dates_cached()
     years = sorted(list(set([d.year for d in all_dates])))
@@ -1472,71 +1020,42 @@ def customer_net_trend(request):
     if target_shop_id: target_ids.append(target_shop_id)
     target_ids.extend(comparison_shop_ids)
     
-    shop_data = {}
-    # キャッシュキー (選択店舗, 月, 年の並び)
-    years_str = '_'.join(map(str, years))
-    ids_key = ','.join(map(str, sorted(target_ids))) if target_ids else 'none'
-    cache_key = f'customer_net_trend:{ids_key}:{target_month}:{years_str}'
-    cached = cache.get(cache_key)
-    if cached is not None:
-        shop_data = cached
-    else:
-        if target_ids:
-            shops = Shop.objects.filter(id__in=target_ids)
-            for s in shops:
-                sname = s.name
-                if sname == "加治": sname = "加治木"
-                shop_data[s.id] = {
-                    'name': sname,
-                    'customers': [0] * len(years),
-                    'net': [0] * len(years)
-                }
-
     # build display groups once (normalize and grouping)
     raw_comparison_ids = request.GET.getlist('comparison_shops')
     display_map, all_shops_display, selected_display_values, comparison_shop_ids = build_display_groups(all_shops, raw_comparison_ids)
 
-    for i, year in enumerate(years):
-        if target_month != 'total' and target_month.isdigit():
-            m = int(target_month)
-            latest_date = SalesRecord.objects.filter(date__year=year, date__month=m).order_by('-date').values_list('date', flat=True).first()
-        else:
-            latest_date = SalesRecord.objects.filter(date__year=year).order_by('-date').values_list('date', flat=True).first()
-
-        if not latest_date:
-            continue
-
-        # 1. 客数取得 (category__code=9999)
-        cust_records = SalesRecord.objects.filter(
-            date=latest_date,
-            shop_id__in=target_ids,
-            category__code=9999
-        ).values('shop_id', 'amount_sales')
-
-        for r in cust_records:
-            sid = r['shop_id']
-            if sid in shop_data:
-                shop_data[sid]['customers'][i] = r['amount_sales']
-
-        # 2. ネット売上取得 (全カテゴリのamount_netの合計)
-        net_records = SalesRecord.objects.filter(
-            date=latest_date,
-            shop_id__in=target_ids
-        ).values('shop_id').annotate(total_net=Sum('amount_net'))
-
-        for r in net_records:
-            sid = r['shop_id']
-            if sid in shop_data:
-                shop_data[sid]['net'][i] = r['total_net']
-
-        # キャッシュに保存（1時間）
-        if cached is None:
-            try:
-                cache.set(cache_key, shop_data, 60 * 60)
-            except Exception:
-                logger.exception('cache set failed for %s', cache_key)
-
-        
+    # 各年のスナップショット日（月指定時はその月の最新日、合計なら年の最新日）
+    snapshots = snapshot_periods(int(target_month) if target_month != 'total' and target_month.isdigit() else None)
+    year_position = {y: i for i, y in enumerate(years) if y in snapshots}
+
+    def shop_customer_net(shop_ids):
+        """店舗ごとの各年の客数とネット売上（全カテゴリの amount_net の合計）を 1 本の整数配列（客数, ネット売上の順）で返す"""
+        result = {sid: {'customers': [0] * len(years), 'net': [0] * len(years)} for sid in shop_ids}
+        # 1. ネット売上取得（集計サマリーの全部門合計。店舗ごとのその月の最新日）
+        shop_dates = {}
+        net_records = snapshot_summary(snapshots, level=SalesSummary.LEVEL_TOTAL, shop_id__in=shop_ids)
+        for r in net_records.values('shop_id', 'year', 'date', 'amount_net'):
+            result[r['shop_id']]['net'][year_position[r['year']]] = r['amount_net']
+            shop_dates[(r['shop_id'], r['year'])] = r['date']
+        # 2. 客数取得（ネット売上と同じ店舗ごとの最新日。売上の無い店舗は期間のスナップショット日）
+        positions = {(sid, shop_dates.get((sid, y), snapshots[y][1])): i for sid in shop_ids for y, i in year_position.items()}
+        customers = CustomerCount.objects.filter(date__in={d for _, d in positions}, shop_id__in=shop_ids)
+        for shop_id, day, count in customers.values_list('shop_id', 'date', 'count'):
+            if (shop_id, day) in positions:
+                result[shop_id]['customers'][positions[(shop_id, day)]] = count
+        return {sid: pack_ints(v['customers'], v['net']) for sid, v in result.items()}
+
+    # 店舗ごとにキャッシュ (月, 年の並び)。選択店舗の組み合わせによらず店舗単位で再利用する
+    shop_data = {}
+    if target_ids:
+        years_str = '_'.join(map(str, years))
+        vectors = cached_shop_vectors(f'customer_net_trend_v4:{target_month}:{years_str}', target_ids, shop_customer_net,
+                                      periods=month_periods(request), timeout=60 * 60)
+        for s in Shop.objects.filter(id__in=target_ids):
+            sname = s.name
+            if sname == "加治": sname = "加治木"
+            customers, net = unpack_ints(vectors[s.id], len(years))
+            shop_data[s.id] = {'name': sname, 'customers': customers, 'net': net}
 
     # Chart.js データ構築（グループ化して和歌山->和歌 を統合）
     customer_chart = {'labels': [str(y) for y in years], 'datasets': []}
@@ -1618,7 +1137,6 @@ def customer_net_trend(request):
     }
     return render(request, 'customer_net_trend.html', context)
 
-@cache_page(60 * 60 * 24)
 def hyuga_vs_others_trend(request):
     all_dates = get_all_dates_cached()
     years = sorted(list(set([d.year for d in all_dates])))
@@ -1644,21 +1162,20 @@ def hyuga_vs_others_trend(request):
     # month: 'total' or '1'..'12'
     selected_month = request.GET.get('month', 'total')
     
-    # 部門リスト（客数除外）
-    all_10_depts = Category.objects.filter(level=10).exclude(code=9999).order_by('code')
+    # 部門リスト
+    all_10_depts = Category.objects.filter(level=10).order_by('code')
     
     # デフォルト部門（選択がなければ最初のもの）
     if not selected_dept_code and all_10_depts.exists():
         selected_dept_code = str(all_10_depts[0].code)
     
     selected_dept_name = "部門"
-    target_category_ids = []
+    dept_filter = None
     if selected_dept_code:
-        try:
-            cat = Category.objects.get(code=selected_dept_code, level=10)
+        cat = category_tree().find(selected_dept_code, 10)
+        if cat:
             selected_dept_name = cat.name
-            target_category_ids = get_descendant_category_ids(selected_dept_code)
-        except: pass
+            dept_filter = hierarchy_filter(cat)
 
     # データ集計用
     # { shop_id: [year1_sales, year2_sales, ...], ... }
@@ -1667,41 +1184,43 @@ def hyuga_vs_others_trend(request):
     if target_shop_id: target_ids.append(target_shop_id)
     target_ids.extend(comparison_shop_ids)
 
+    cube = get_sales_cube()
+    month = int(selected_month) if selected_month and selected_month != 'total' and str(selected_month).isdigit() else None
+
+    def shop_yearly_sales(shop_ids):
+        """店舗ごとの各年の選択部門の売上（トータルは年合計、月指定時はその月の合計）"""
+        result = {}
+        if dept_filter is None or (month is not None and not 1 <= month <= 12):
+            return result
+        if cube is None:
+            qs = SalesRecord.objects.filter(shop_id__in=shop_ids, **dept_filter)
+            if month is not None:
+                qs = qs.filter(date__month=month)
+            year_pos = {y: i for i, y in enumerate(years)}
+            rows = qs.annotate(year=ExtractYear('date')).values('shop_id', 'year').annotate(total_sales=Sum('amount_sales'))
+            for r in rows:
+                if r['year'] in year_pos:
+                    result.setdefault(r['shop_id'], [0] * len(years))[year_pos[r['year']]] = r['total_sales']
+            return result
+        dept_groups = cube.category_groups(category_tree(), [cat])
+        for i, year in enumerate(years):
+            values, present = cube.rollup(cube.period_indices(year, month), dept_groups, shop_ids=shop_ids, by_shop=True)
+            for sid, v, p in zip(cube.shops_of(shop_ids), values, present):
+                if p[0]:
+                    result.setdefault(sid, [0] * len(years))[i] = int(v[0, 0])
+        return result
+
+    # 店舗ごとにキャッシュ (部門, 月, 年の並び)。選択店舗の組み合わせによらず店舗単位で再利用する
     if target_ids:
-        shops = Shop.objects.filter(id__in=target_ids)
-        for s in shops:
+        dept_key = cat.id if dept_filter is not None else 'none'
+        vectors = cached_shop_vectors(
+            f"hyuga_vs_others_trend:{category_tree().version}:{dept_key}:{selected_month}:{'_'.join(map(str, years))}",
+            target_ids, shop_yearly_sales, periods=month_periods(request), empty=[0] * len(years),
+        )
+        for s in Shop.objects.filter(id__in=target_ids):
             sname = s.name
             if sname == "加治": sname = "加治木"
-            shop_data[s.id] = {'name': sname, 'sales': [0] * len(years)}
-    
-    for i, year in enumerate(years):
-        # 集計モード: トータル（年合計）または特定月の合計
-        if selected_month and selected_month != 'total' and str(selected_month).isdigit():
-            m = int(selected_month)
-            try:
-                last_day = calendar.monthrange(year, m)[1]
-                start = date(year, m, 1)
-                end = date(year, m, last_day)
-                records = SalesRecord.objects.filter(
-                    date__range=(start, end),
-                    shop_id__in=target_ids,
-                    category_id__in=target_category_ids
-                ).values('shop_id').annotate(total_sales=Sum('amount_sales'))
-            except Exception:
-                records = []
-        else:
-            # 年合計
-            records = SalesRecord.objects.filter(
-                date__year=year,
-                shop_id__in=target_ids,
-                category_id__in=target_category_ids
-            ).values('shop_id').annotate(total_sales=Sum('amount_sales'))
-        
-        for r in records:
-            sid = r['shop_id']
-            val = r['total_sales']
-            if sid in shop_data:
-                shop_data[sid]['sales'][i] = val
+            shop_data[s.id] = {'name': sname, 'sales': list(vectors[s.id])}
 
     # Chart.js データ
     chart_data = {'labels': [str(y) for y in years], 'datasets': []}
@@ -1797,7 +1316,71 @@ def hyuga_vs_others_trend(request):
     return render(request, 'hyuga_vs_others.html', context)
 
 
-@cache_page(60 * 60 * 24)
+def compare_dept_shop_totals(depts, start, end, periods=ALL_PERIODS, ttl=60 * 60):
+    """日向 vs 他店 比較（ページと CSV 共通）の 部門 × 店舗 の集計。
+
+    start〜end（None なら全期間）の全店舗・全指標を、1 回の集計（売上キューブ、無効なら
+    店舗 × 部門 の GROUP BY 1 クエリ）で求めて depts の各部門へ積み上げる。
+    選択店舗・指標によらず同じ結果を使えるよう、部門と期間ごとにキャッシュし、
+    periods [(年, 月), ...] の売上が取り込まれたら無効になる。
+    返り値: {(部門 id, 店舗 id): [SalesRecord.METRIC_FIELDS ごとの合計]}（データの無い組み合わせは含まない）
+    """
+    depts = list(depts)
+    tree = category_tree()
+    dept_key = hashlib.md5(','.join(str(d.id) for d in depts).encode()).hexdigest()
+    cache_key = f"hyuga_compare_totals_v2:{tree.version}:{dept_key}:{start}:{end}"
+
+    def aggregate():
+        metrics = SalesRecord.METRIC_FIELDS
+        totals = {}
+        cube = get_sales_cube()
+        if cube is not None:
+            values, present = cube.rollup(cube.range_indices(start, end), cube.category_groups(tree, depts),
+                                          by_shop=True, metrics=metrics)
+            for s, sid in enumerate(cube.shops_of()):
+                for g, dept in enumerate(depts):
+                    if present[s, g]:
+                        totals[(dept.id, sid)] = [int(v) for v in values[s, g]]
+        else:
+            qs = SalesRecord.objects.all()
+            if start and end:
+                qs = qs.filter(date__range=(start, end))
+            rows = qs.order_by().values_list('shop_id', 'category_id').annotate(*[Sum(f) for f in metrics])
+            # 部門ごとに、積み上げ先（自身か祖先にあたる depts の部門）を一度だけ求める
+            dept_ids = {d.id for d in depts}
+            target_of = {}
+            for shop_id, category_id, *row_values in rows:
+                if category_id not in target_of:
+                    target_of[category_id] = next((a for a in tree.ancestor_ids(category_id) if a in dept_ids), None)
+                dept_id = target_of[category_id]
+                if dept_id is None:
+                    continue
+                acc = totals.setdefault((dept_id, shop_id), [0] * len(metrics))
+                for i, v in enumerate(row_values):
+                    acc[i] += v or 0
+        # (部門 id, 店舗 id) の組と指標の合計を、それぞれ 1 本の整数配列にしてキャッシュする
+        return {
+            'pairs': pack_ints(*totals.keys()),
+            'values': pack_ints(*totals.values()),
+        }
+
+    payload = cached_payload(cache_key, aggregate, periods, timeout=ttl)
+    metric_count = len(SalesRecord.METRIC_FIELDS)
+    return dict(zip(map(tuple, unpack_ints(payload['pairs'], 2)), unpack_ints(payload['values'], metric_count)))
+
+
+def sum_dept_shop_totals(totals, dept, shop_ids, metrics):
+    """compare_dept_shop_totals の結果から、dept の shop_ids の店舗を合計した metrics（フィールド名）ごとの値"""
+    positions = [SalesRecord.METRIC_FIELDS.index(m) for m in metrics]
+    result = [0] * len(positions)
+    for sid in dict.fromkeys(shop_ids):
+        values = totals.get((dept.id, sid))
+        if values:
+            for i, p in enumerate(positions):
+                result[i] += values[p]
+    return result
+
+
 def hyuga_vs_others_compare(request):
     """新：部門レベルを選べる日向 vs 他店 比較ページ
     フォーム: dept_level (10/35/90/180), dept_code (code at that level), month, comparison_shops
@@ -1829,7 +1412,7 @@ def hyuga_vs_others_compare(request):
     comparison_shop_ids = list(dict.fromkeys(comparison_shop_ids))
 
     # 部門リスト（選択レベル） — テーブル行はこのレベルの部門一覧になる
-    all_depts_at_level = Category.objects.filter(level=dept_level).exclude(code=9999).order_by('code')
+    all_depts_at_level = Category.objects.filter(level=dept_level).order_by('code')
 
     # デフォルト年/月: 最新日を使う
     all_dates = get_all_dates_cached()
@@ -1904,22 +1487,15 @@ def hyuga_vs_others_compare(request):
         'profit': 'amount_profit',
     }
 
+    # 部門 × 店舗 × 指標 を一度に集計し（CSV と共通）、表示列ごとに店舗を合計する
     table_rows = []
-    # 各部門ごとに、各店舗の選択指標を取得して値配列に格納する（店舗ごとに指標が横並びになる）
+    selected_fields = [metric_fields[k] for k in metric_keys]
+    dept_totals = compare_dept_shop_totals(all_depts_at_level, start, end, year_month_periods(request))
     for dept in all_depts_at_level:
-        cat_ids = get_descendant_ids_for_category(dept.code, dept_level)
         row_vals = []
         for shop_col in table_shops:
-            shop_ids = shop_col.get('ids', [])
-            if start and end:
-                qs = SalesRecord.objects.filter(date__range=(start, end), shop_id__in=shop_ids, category_id__in=cat_ids)
-            else:
-                qs = SalesRecord.objects.filter(shop_id__in=shop_ids, category_id__in=cat_ids)
-            # 選択された指標だけを集計する
-            agg_kwargs = {mk: Sum(metric_fields.get(mk)) for mk in metric_keys}
-            agg = qs.aggregate(**agg_kwargs)
-            for k in metric_keys:
-                row_vals.append(fmt_num(agg.get(k) or 0))
+            for v in sum_dept_shop_totals(dept_totals, dept, shop_col.get('ids', []), selected_fields):
+                row_vals.append(fmt_num(v))
         table_rows.append({'dept_name': dept.name, 'values': row_vals})
 
     # テーブル合計（店舗ごと・指標ごと）: 各店舗ごとに metric_keys 数の合計を持つリストを作る
@@ -2077,26 +1653,21 @@ def hyuga_vs_others_compare_csv(request):
             start = None; end = None
 
     # 部門リスト
-    all_depts_at_level = Category.objects.filter(level=dept_level).exclude(code=9999).order_by('code')
+    all_depts_at_level = Category.objects.filter(level=dept_level).order_by('code')
 
     def to_int(v):
         try: return int(v)
         except: return 0
 
-    # テーブル行作成（flat）
+    # テーブル行作成（flat）。集計はページと共通（ページで集計済みならキャッシュから返る）
     table_rows = []
+    selected_fields = [metric_fields[k] for k in metric_keys]
+    dept_totals = compare_dept_shop_totals(all_depts_at_level, start, end, year_month_periods(request))
     for dept in all_depts_at_level:
-        cat_ids = get_descendant_ids_for_category(dept.code, dept_level)
         row_vals = []
         for shop in table_shops:
-            if start and end:
-                qs = SalesRecord.objects.filter(date__range=(start, end), shop_id=shop.id, category_id__in=cat_ids)
-            else:
-                qs = SalesRecord.objects.filter(shop_id=shop.id, category_id__in=cat_ids)
-            agg_kwargs = {mk: Sum(metric_fields.get(mk)) for mk in metric_keys}
-            agg = qs.aggregate(**agg_kwargs)
-            for k in metric_keys:
-                row_vals.append(str(to_int(agg.get(k) or 0)))
+            for v in sum_dept_shop_totals(dept_totals, dept, [shop.id], selected_fields):
+                row_vals.append(str(to_int(v)))
         table_rows.append({'dept_name': dept.name, 'values': row_vals})
 
     # totals
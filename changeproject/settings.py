@@ -111,4 +111,62 @@ INTERNAL_IPS = []
 DEBUG_TOOLBAR_CONFIG = {
     'INTERCEPT_REDIRECTS': False,
     'SHOW_TOOLBAR_CALLBACK': lambda request: False,
-}
\ No newline at end of file
+}
+
+# 取込ジョブのアップロードファイル保存先
+MEDIA_ROOT = BASE_DIR / 'media'
+
+# キャッシュ: プロセス内 LRU（上限はバイト数）の後ろに、全ワーカー・管理コマンドで共有するファイルキャッシュを置く。
+# 既にあるキーの上書き・削除は共有キャッシュの無効化ログで各ワーカーに伝わり、各ワーカーは
+# VERSION_CHECK_INTERVAL 秒ごとにログを確認して、そのキーだけをプロセス内 LRU から捨てる（change.cache_backend を参照）。
+CACHES = {
+    'default': {
+        'BACKEND': 'change.cache_backend.TwoTierCache',
+        'LOCATION': 'default',
+        'OPTIONS': {
+            'LOCAL_MAX_BYTES': 64 * 1024 * 1024,
+            'LOCAL_TIMEOUT': 60 * 5,
+            'VERSION_CHECK_INTERVAL': 1.0,
+            'SHARED': {
+                'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                'LOCATION': BASE_DIR / 'cache',
+                'OPTIONS': {'MAX_ENTRIES': 20000},
+            },
+        },
+    },
+}
+
+# 取込ジョブをプロセス内のワーカースレッドで実行する。
+# False の場合は `python manage.py run_import_jobs --loop` を別プロセスで動かす。
+IMPORT_JOBS_RUN_IN_PROCESS = True
+# 実行中のまま この秒数を過ぎた取込ジョブは、実行していたワーカーが停止したものとして失敗にする
+IMPORT_JOB_TIMEOUT_SECONDS = 60 * 60
+
+# 売上データ取込: 1ステートメントあたりの upsert 件数
+SALES_IMPORT_BATCH_SIZE = 500
+# .xlsx を openpyxl の read-only モードで逐次読込する（メモリ使用量を一定に保つ）
+SALES_IMPORT_STREAMING = True
+SALES_IMPORT_CHUNK_ROWS = 256
+
+# 売上キューブ: 集計サマリーをプロセス内の NumPy 配列（年月 × 店舗 × 部門 × 指標）に読み込み、
+# レポートを配列の集計で作る。False の場合は各レポートが DB を集計する。
+# キューブは年月の数に比例してワーカーごとにメモリを使う（月ごとのスナップショットのため取込日の数にはよらない）。
+SALES_CUBE_ENABLED = True
+# 見積もりがこのバイト数を超えるキューブは読み込まずに DB を集計する
+SALES_CUBE_MAX_BYTES = 128 * 1024 * 1024
+
+# データの版 (change.versions): 各プロセスはすべての版をこの秒数だけ使い回し、過ぎたら 1 クエリで読み直す
+# （他のプロセスでの売上取込・部門マスタの更新は、この秒数以内にキャッシュのキーやキューブへ反映される）
+DATA_VERSION_CHECK_INTERVAL = 1.0
+
+# 時間のかかるレポートのキャッシュ（change.caching.cached_report）:
+# 古い世代のエントリでも作成からこの秒数以内なら返し、裏で作り直す（0 なら常に作り直しを待つ）
+SALES_CACHE_STALE_SECONDS = 60 * 30
+# 同じ集計を他のリクエストが実行中のとき、結果を待つ最大秒数
+SALES_CACHE_LOCK_SECONDS = 30
+# レポートのキャッシュの payload (change.caching.cached_payload) を zlib で圧縮する最小バイト数
+SALES_CACHE_COMPRESS_MIN_BYTES = 4096
+
+# 売上キャッシュのウォームアップ (`python manage.py warm_sales_cache`) で使うサイトの URL
+# （ページ全体のキャッシュのキーにはホスト名とスキームが含まれるため、実際のアクセスと揃える）
+SALES_CACHE_WARM_BASE_URL = 'https://changerank.pythonanywhere.com'
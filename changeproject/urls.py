@@ -10,6 +10,7 @@ urlpatterns = [
     # 2. 先生用: データ取込
     path('upload-master/', views.upload_category_master, name='upload_master'),
     path('upload-sales/', views.upload_sales_data, name='upload_sales'),
+    path('import-jobs/<int:job_id>/', views.import_job_status, name='import_job_status'),
     
     # 3. 生徒用: 部門ランキング（トップページ）
     path('', views.student_dashboard, name='dashboard'),